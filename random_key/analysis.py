@@ -0,0 +1,236 @@
+"""
+Static checks of a rule set before it's handed to the sequence engine.
+
+The engine picks a weighted item different from the last one out of the
+items its Avoid rules allow. A rule set where no item can be placed, or where
+some item has no allowed successor, can't be honoured: the engine would
+stop, or carry the run of that item on to the end. analyze() finds those in
+O(k^2) for k items and reports them as diagnostics, generation only starts
+when there are no errors.
+"""
+
+from dataclasses import dataclass
+
+from .avoid_rules import DISTANCE, NEIGHBOUR, PATTERN, parse_avoids
+from .sequences import ItemSequence
+
+ERROR = "error"
+WARNING = "warning"
+
+
+@dataclass(frozen=True)
+class Diagnostic:
+    severity: str
+    code: str
+    message: str
+    items: tuple[str, ...] = ()
+
+    def __str__(self):
+        return "%s: %s" % (self.severity.capitalize(), self.message)
+
+
+def analyze(
+    rules: list[ItemSequence], known_items=None, length: int | None = None
+) -> list[Diagnostic]:
+    """
+    Check a rule set can be generated.
+    :param rules: From build_rule
+    :param known_items: Names of items that exist, e.g. the palette
+    :param length: Height of the sequence, to check the Limits against
+    :return: Diagnostics, errors first
+    """
+    diagnostics: list[Diagnostic] = []
+
+    if not rules:
+        return [Diagnostic(ERROR, "no-items", "No items are enabled.")]
+
+    # Merge rules the same way the engine does, weights add up and the last
+    # rule of a name wins
+    merged: dict[str, ItemSequence] = {}
+    weights: dict[str, int] = {}
+    for rule in rules:
+        if rule.item_name in merged:
+            diagnostics.append(
+                Diagnostic(
+                    WARNING,
+                    "duplicate",
+                    "%s is set on more than one key, its last key is used."
+                    % rule.item_name,
+                    (rule.item_name,),
+                )
+            )
+        merged[rule.item_name] = rule
+        weights[rule.item_name] = weights.get(rule.item_name, 0) + rule.probability
+
+    for name, rule in merged.items():
+        if not name:
+            diagnostics.append(
+                Diagnostic(ERROR, "no-name", "An enabled item has no block set.")
+            )
+        elif known_items is not None and name not in known_items:
+            diagnostics.append(
+                Diagnostic(
+                    WARNING,
+                    "unknown-item",
+                    "%s is not in the palette." % name,
+                    (name,),
+                )
+            )
+        if rule.min_entropy > rule.max_entropy:
+            diagnostics.append(
+                Diagnostic(
+                    ERROR,
+                    "min-max",
+                    "%s has Min %d more than Max %d."
+                    % (name, rule.min_entropy, rule.max_entropy),
+                    (name,),
+                )
+            )
+        if 0 < rule.quota < rule.min_entropy:
+            diagnostics.append(
+                Diagnostic(
+                    WARNING,
+                    "quota-min",
+                    "%s has a Limit of %d, less than its Min %d."
+                    % (name, rule.quota, rule.min_entropy),
+                    (name,),
+                )
+            )
+        entries, invalid = parse_avoids(rule)
+        for message in invalid:
+            diagnostics.append(
+                Diagnostic(
+                    WARNING,
+                    "bad-avoid",
+                    "%s: %s, it's ignored." % (name, message),
+                    (name,),
+                )
+            )
+        for entry in entries:
+            for avoid in entry.items:
+                if avoid not in merged:
+                    diagnostics.append(
+                        Diagnostic(
+                            WARNING,
+                            "unknown-avoid",
+                            "%s avoids %s, which isn't an enabled item."
+                            % (name, avoid),
+                            (name, avoid),
+                        )
+                    )
+            if entry.kind == PATTERN and entry.repeats():
+                diagnostics.append(
+                    Diagnostic(
+                        WARNING,
+                        "repeat-pattern",
+                        "%s can't happen, runs of the same item join into one."
+                        % ">".join(entry.items),
+                        (name,),
+                    )
+                )
+
+    placeable = [
+        name for name in merged if weights[name] > 0 and merged[name].max_entropy > 0
+    ]
+    if not any(weights[name] > 0 for name in merged):
+        diagnostics.append(
+            Diagnostic(ERROR, "no-weight", "Every item has a Prob of 0.")
+        )
+    elif not placeable:
+        diagnostics.append(
+            Diagnostic(
+                ERROR,
+                "no-placeable",
+                "Every item has a Max of 0, nothing can be placed.",
+            )
+        )
+    else:
+        diagnostics.extend(_successor_diagnostics(merged, weights))
+
+        # Only items with a Limit can be picked, the sequence ends with them
+        limited = [merged[name].quota for name in placeable]
+        if length is not None and all(limited) and sum(limited) < length:
+            diagnostics.append(
+                Diagnostic(
+                    WARNING,
+                    "quota-short",
+                    "The Limits add up to %d blocks, the sequence stops there."
+                    % sum(limited),
+                )
+            )
+
+    diagnostics.sort(key=lambda d: d.severity != ERROR)
+    return diagnostics
+
+
+def _successor_diagnostics(
+    merged: dict[str, ItemSequence], weights: dict[str, int]
+) -> list[Diagnostic]:
+    """
+    Every item that can be picked needs another item that's allowed after it,
+    or the engine retries forever once it's picked.
+    :param merged:
+    :param weights:
+    :return:
+    """
+    diagnostics = []
+    candidates = [name for name in merged if weights[name] > 0]
+
+    # Items never allowed straight after an item, from neighbour and distance
+    # rules both ways round and from two item patterns
+    never_after = {name: set() for name in merged}
+    for rule in merged.values():
+        for entry in parse_avoids(rule)[0]:
+            if entry.kind in (NEIGHBOUR, DISTANCE):
+                a, b = entry.items
+                never_after.setdefault(a, set()).add(b)
+                never_after.setdefault(b, set()).add(a)
+            elif len(entry.items) == 2:
+                a, b = entry.items
+                never_after.setdefault(a, set()).add(b)
+
+    def allowed(a: str, b: str) -> bool:
+        return b not in never_after[a]
+
+    if len(candidates) == 1:
+        name = candidates[0]
+        if not allowed(name, name):
+            diagnostics.append(
+                Diagnostic(
+                    ERROR,
+                    "self-avoid",
+                    "%s is the only item and avoids itself." % name,
+                    (name,),
+                )
+            )
+        else:
+            diagnostics.append(
+                Diagnostic(
+                    WARNING,
+                    "single-item",
+                    "Only %s can be picked, every block will be %s." % (name, name),
+                    (name,),
+                )
+            )
+        return diagnostics
+
+    for name in candidates:
+        if not any(allowed(name, other) for other in candidates if other != name):
+            diagnostics.append(
+                Diagnostic(
+                    ERROR,
+                    "dead-end",
+                    "Nothing is allowed after %s, Avoid rules exclude every "
+                    "other item." % name,
+                    (name,),
+                )
+            )
+    return diagnostics
+
+
+def errors(diagnostics: list[Diagnostic]) -> list[Diagnostic]:
+    return [d for d in diagnostics if d.severity == ERROR]
+
+
+def is_satisfiable(rules: list[ItemSequence]) -> bool:
+    return not errors(analyze(rules))
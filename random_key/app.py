@@ -1,11 +1,19 @@
 import sys
+from multiprocessing import freeze_support
+
+from random_key.startup import trace
 
 from PySide6.QtWidgets import QApplication
 
 from random_key.dialog import RandomKeyDialog
 
 if __name__ == "__main__":
+    # Material plans run on a process pool, a frozen build starts the pool's
+    # processes through this exe
+    freeze_support()
+    trace.mark("imports")
     app = QApplication(sys.argv)
+    trace.mark("application")
     window = RandomKeyDialog()
     window.show()
     sys.exit(app.exec())
@@ -0,0 +1,262 @@
+"""
+Avoid rules and the automaton that enforces them.
+
+An items Avoid field takes comma separated entries:
+
+    Dirt                Dirt is never next to this item
+    Dirt@3              Dirt is never within 3 blocks of this item
+    Stone>Dirt>Stone    A run of Stone, then Dirt, then Stone never happens
+
+Patterns are over runs of blocks, Stone>Dirt>Stone forbids a run of Dirt
+between two runs of Stone however long the runs are. A neighbour rule is the
+two patterns Name>Item and Item>Name.
+
+Every pattern goes into one Aho-Corasick automaton, so a sequence only
+carries the automaton state and the last position of items with distance
+rules. Finding what may come next is a lookup of the state, not a scan of the
+sequence against every rule, so generation stays linear in its length.
+"""
+
+from dataclasses import dataclass
+
+NEIGHBOUR = "neighbour"
+DISTANCE = "distance"
+PATTERN = "pattern"
+
+
+class AvoidSyntaxError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class AvoidEntry:
+    kind: str
+    items: tuple[str, ...]
+    distance: int = 1
+
+    def repeats(self) -> bool:
+        """
+        True for a pattern with the same item twice in a row, it can never
+        happen since the two runs would be one run.
+        :return:
+        """
+        return any(a == b for a, b in zip(self.items, self.items[1:]))
+
+
+def parse_avoid(owner: str, text: str) -> AvoidEntry:
+    """
+    Parse one entry of an items Avoid field.
+    :param owner: Item the Avoid field belongs to
+    :param text:
+    :return:
+    """
+    text = text.strip()
+    if ">" in text:
+        items = tuple(part.strip() for part in text.split(">"))
+        if not all(items):
+            raise AvoidSyntaxError("%r needs an item on both sides of every >" % text)
+        return AvoidEntry(PATTERN, items)
+
+    if "@" in text:
+        name, _, distance = text.rpartition("@")
+        name = name.strip()
+        try:
+            distance = int(distance)
+        except ValueError:
+            raise AvoidSyntaxError("%r needs a whole number after @" % text)
+        if not name or distance < 1:
+            raise AvoidSyntaxError(
+                "%r needs an item and a distance of 1 or more" % text
+            )
+        return AvoidEntry(DISTANCE, (owner, name), distance)
+
+    if not text:
+        raise AvoidSyntaxError("Empty Avoid entry")
+    return AvoidEntry(NEIGHBOUR, (owner, text))
+
+
+def parse_avoids(rule) -> tuple[list[AvoidEntry], list[str]]:
+    """
+    :param rule: ItemSequence
+    :return: Entries of the rules Avoid field, the error of each entry that
+        didn't parse
+    """
+    entries = []
+    invalid = []
+    for text in rule.avoids:
+        try:
+            entries.append(parse_avoid(rule.item_name, text))
+        except AvoidSyntaxError as e:
+            invalid.append(str(e))
+    return entries, invalid
+
+
+class AvoidAutomaton:
+    """
+    Compiled Avoid rules of a rule set. Items are referred to by their index
+    in symbols, so the sequence engine can share the indexes of its sampler.
+    """
+
+    def __init__(self, rules, symbols=None):
+        """
+        :param rules: ItemSequence rule set
+        :param symbols: Item names in index order, the rules items by default
+        """
+        if symbols is None:
+            symbols = dict.fromkeys(rule.item_name for rule in rules)
+        self.symbols = list(symbols)
+        self.index = {name: i for i, name in enumerate(self.symbols)}
+
+        # Item to {other item: distance}, both ways round
+        self.distances: list[dict[int, int]] = [{} for _ in self.symbols]
+
+        patterns = set()
+        for rule in rules:
+            for entry in parse_avoids(rule)[0]:
+                if entry.repeats() or any(n not in self.index for n in entry.items):
+                    continue
+                ids = tuple(self.index[name] for name in entry.items)
+                if entry.kind == PATTERN or entry.distance == 1:
+                    patterns.add(ids)
+                    if entry.kind != PATTERN:
+                        patterns.add(ids[::-1])
+                else:
+                    a, b = ids
+                    self.distances[a][b] = max(
+                        self.distances[a].get(b, 0), entry.distance
+                    )
+                    self.distances[b][a] = self.distances[a][b]
+
+        self._goto: list[dict[int, int]] = [{}]
+        self._fail = [0]
+        self._match = [False]
+        self._delta: dict[tuple[int, int], int] = {}
+        self._forbidden: dict[int, frozenset] = {}
+        self._build(sorted(patterns))
+
+    def _build(self, patterns) -> None:
+        for pattern in patterns:
+            node = 0
+            for symbol in pattern:
+                child = self._goto[node].get(symbol)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._match.append(False)
+                    self._goto[node][symbol] = child
+                node = child
+            self._match[node] = True
+
+        # Failure links breadth first, a node matches if any suffix does
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for symbol, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and symbol not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(symbol, 0)
+                self._match[child] = (
+                    self._match[child] or self._match[self._fail[child]]
+                )
+                queue.append(child)
+
+    @property
+    def states(self) -> int:
+        return len(self._goto)
+
+    def step(self, node: int, symbol: int) -> int:
+        """
+        State after a run of symbol starts.
+        :param node:
+        :param symbol:
+        :return:
+        """
+        key = (node, symbol)
+        nxt = self._delta.get(key)
+        if nxt is None:
+            state = node
+            while state and symbol not in self._goto[state]:
+                state = self._fail[state]
+            nxt = self._delta[key] = self._goto[state].get(symbol, 0)
+        return nxt
+
+    def matched(self, node: int) -> bool:
+        return self._match[node]
+
+    def forbidden(self, node: int) -> frozenset:
+        """
+        Items that would complete a pattern if their run started next.
+        :param node:
+        :return:
+        """
+        forbidden = self._forbidden.get(node)
+        if forbidden is None:
+            # Only symbols on the failure chain can lead anywhere but the root
+            symbols = set()
+            state = node
+            while True:
+                symbols.update(self._goto[state])
+                if not state:
+                    break
+                state = self._fail[state]
+            forbidden = self._forbidden[node] = frozenset(
+                s for s in symbols if self._match[self.step(node, s)]
+            )
+        return forbidden
+
+    def tracker(self) -> "AvoidTracker":
+        return AvoidTracker(self)
+
+
+class AvoidTracker:
+    """
+    Position of a sequence in the automaton, advanced one block or one run
+    at a time.
+    """
+
+    def __init__(self, automaton: AvoidAutomaton):
+        self.automaton = automaton
+        self.node = 0
+        self.last: int | None = None
+        self.position = 0
+        # Position of the last block of each item with distance rules
+        self._last_seen: dict[int, int] = {}
+
+    def blocked(self) -> set[int]:
+        """
+        Items whose run may not start at the next position.
+        :return:
+        """
+        blocked = set(self.automaton.forbidden(self.node))
+        distances = self.automaton.distances
+        for item, seen in self._last_seen.items():
+            gap = self.position - seen
+            for other, distance in distances[item].items():
+                if gap <= distance:
+                    blocked.add(other)
+        return blocked
+
+    def place(self, index: int | None, count: int = 1) -> bool:
+        """
+        Add blocks of an item to the sequence.
+        :param index: Item index, None for an item outside the rule set
+        :param count: Length of the run of blocks
+        :return: True if the blocks break a rule
+        """
+        violated = False
+        if index is None:
+            self.node = 0
+        elif index != self.last:
+            self.node = self.automaton.step(self.node, index)
+            violated = self.automaton.matched(self.node)
+            for other, distance in self.automaton.distances[index].items():
+                seen = self._last_seen.get(other)
+                if seen is not None and self.position - seen <= distance:
+                    violated = True
+        self.last = index
+
+        self.position += count
+        if index is not None and self.automaton.distances[index]:
+            self._last_seen[index] = self.position - 1
+        return violated
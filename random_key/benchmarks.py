@@ -0,0 +1,506 @@
+"""
+Headless benchmarks of the UI, for catching regressions in the preview strip,
+the Required panel and the overlay.
+
+Runs RandomKeyDialog and OverlayWindow on the offscreen Qt platform, so it
+runs on Linux and CI without a display or the game. The Windows only modules
+(win32gui, keyboard, pynput) are blocked from importing, the dialog is given
+the headless input, key sink and window backends instead and a fake game
+window for the overlay to attach to. Settings, the texture cache and the
+data folder go to a temp folder, every run starts cold and leaves the users
+alone.
+
+    python -m random_key.benchmarks --out bench.json
+    python -m random_key.benchmarks --compare bench.json --out new.json
+
+Measures
++ Time to first paint of the dialog, and until its first buffer is shown.
++ Regenerate to preview latency at each height, until the preview strip
+  is painted with the new buffer and until the last preview is added.
++ Frame times of scrolling the preview strip and of stepping the cursor
+  through the Required panel and the overlay.
++ Widgets, pixmap memory of the previews and the palette cache, Python heap
+  peak and RSS.
+
+Results are JSON with the app version, commit and environment, times are
+in ms with the median, p95 and spread of the samples. --compare prints the
+change of each median against an earlier result.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from random_key import __version__
+
+SCHEMA = 1
+HEIGHTS = (32, 512, 2048)
+
+# Modules that hook the desktop, never imported by a benchmark
+BLOCKED_MODULES = ("win32gui", "win32process", "keyboard", "pynput", "pynput.mouse")
+
+# Longest wait for the app to finish something before the run is failed
+TIMEOUT = 60.0
+
+
+def isolate(folder: str, height: int = HEIGHTS[0]) -> None:
+    """
+    Point the app's settings, cache and data at folder and block the
+    desktop modules. Called before Qt or the dialog are imported.
+    :param folder:
+    :param height: Max height the dialog starts with
+    :return:
+    """
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    os.environ["LOCALAPPDATA"] = os.path.join(folder, "cache")
+    os.environ["APPDATA"] = os.path.join(folder, "data")
+    # A None entry makes an import raise ImportError
+    for name in BLOCKED_MODULES:
+        sys.modules[name] = None
+
+    from PySide6.QtCore import QSettings
+
+    for settings_format in (QSettings.NativeFormat, QSettings.IniFormat):
+        QSettings.setPath(
+            settings_format, QSettings.UserScope, os.path.join(folder, "settings")
+        )
+
+    from .constants import APP_NAME, GROUP_NAME
+
+    settings = QSettings(GROUP_NAME, APP_NAME)
+    settings.setValue("max_length", height)
+    settings.sync()
+
+
+def summary(samples: list[float]) -> dict:
+    """
+    :param samples: Times in seconds
+    :return: Stats in ms
+    """
+    from .planning import percentile
+
+    ordered = sorted(samples)
+    if not ordered:
+        return {"n": 0}
+    ms = [round(value * 1000, 3) for value in ordered]
+    return {
+        "n": len(ms),
+        "median": percentile(ms, 50),
+        "p95": percentile(ms, 95),
+        "min": ms[0],
+        "max": ms[-1],
+        "mean": round(sum(ms) / len(ms), 3),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def pixmap_bytes(pixmaps) -> int:
+    """
+    Memory of pixmaps, each shared pixmap counted once.
+    :param pixmaps:
+    :return:
+    """
+    seen = {}
+    for pixmap in pixmaps:
+        if pixmap is not None and not pixmap.isNull():
+            seen[pixmap.cacheKey()] = (
+                pixmap.width() * pixmap.height() * pixmap.depth() // 8
+            )
+    return sum(seen.values())
+
+
+class Bench:
+    """
+    One dialog under test and the measurements taken from it.
+    """
+
+    def __init__(self, app, samples: int, frames: int, items: int):
+        self.app = app
+        self.samples = samples
+        self.frames = frames
+        self.items = items
+        self.dialog = None
+
+    def pump(self, done, what: str) -> float:
+        """
+        Process events until done() is true.
+        :param done:
+        :param what: For the timeout error
+        :return: perf_counter when done
+        """
+        end = time.perf_counter() + TIMEOUT
+        while not done():
+            if time.perf_counter() > end:
+                raise RuntimeError("Timed out waiting for %s" % what)
+            self.app.processEvents()
+        return time.perf_counter()
+
+    def flush_deletes(self) -> None:
+        from PySide6.QtCore import QCoreApplication, QEvent
+
+        QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+
+    def open_dialog(self):
+        """
+        Show a new dialog and wait until it's painted.
+        :return: Dialog, seconds to first paint, seconds until the first
+            buffer was complete
+        """
+        from PySide6.QtCore import QRect
+        from .dialog import RandomKeyDialog
+        from .input_backends import FakeKeySink, ReplayInputBackend
+        from .window_location import FakeBackend
+
+        windows = FakeBackend()
+        windows.add_window(1, "Minecraft 1.21", QRect(0, 0, 1280, 720), 1, "javaw.exe")
+
+        start = time.perf_counter()
+        dialog = RandomKeyDialog(ReplayInputBackend([]), FakeKeySink(), windows)
+        dialog.show()
+        painted = self.pump(lambda: dialog._initialized, "the first paint")
+        ready = self.pump(
+            lambda: dialog._buffer_complete
+            and dialog.ui.preview_layout.count() == len(dialog.buffer),
+            "the first buffer",
+        )
+        return dialog, painted - start, ready - start
+
+    def close_dialog(self, dialog) -> None:
+        dialog.close()
+        dialog.deleteLater()
+        self.flush_deletes()
+
+    def startup(self) -> dict:
+        """
+        Open the dialog cold, then samples more times. Like a restart the
+        later ones have the texture cache and resume the session the one
+        before saved.
+        :return:
+        """
+        painted = []
+        ready = []
+        for _ in range(self.samples + 1):
+            dialog, first_paint, first_buffer = self.open_dialog()
+            painted.append(first_paint)
+            ready.append(first_buffer)
+            self.close_dialog(dialog)
+        return {
+            "cold_first_paint_ms": round(painted[0] * 1000, 3),
+            "cold_ready_ms": round(ready[0] * 1000, 3),
+            "first_paint_ms": summary(painted[1:]),
+            "ready_ms": summary(ready[1:]),
+        }
+
+    def set_height(self, height: int) -> None:
+        dialog = self.dialog
+        dialog.ui.max_height_spinbox.setValue(height)
+        self.pump(lambda: dialog._buffer_complete, "the buffer at %d" % height)
+
+    def regenerate(self, height: int) -> dict:
+        """
+        Time regenerating the buffer until the preview strip shows it. The
+        strip is painted once the first previews are in, previews past its
+        width don't paint until scrolled to.
+        :param height:
+        :return:
+        """
+        from PySide6.QtCore import QEvent, QObject
+
+        dialog = self.dialog
+        self.set_height(height)
+        # The previews' container, the viewport behind it doesn't repaint
+        strip = dialog.ui.scroll_area.widget()
+
+        class PaintProbe(QObject):
+            last = 0.0
+
+            def eventFilter(self, watched, event):
+                if event.type() == QEvent.Paint:
+                    PaintProbe.last = time.perf_counter()
+                return False
+
+        probe = PaintProbe()
+        strip.installEventFilter(probe)
+
+        shown = []
+        complete = []
+        for _ in range(self.samples):
+            start = time.perf_counter()
+            dialog._generate_buffer()
+            first = self.pump(
+                lambda: dialog.ui.preview_layout.count() > 0, "the first preview"
+            )
+            painted = self.pump(lambda: probe.last > first, "the preview paint")
+            done = self.pump(
+                lambda: dialog._buffer_complete
+                and dialog.ui.preview_layout.count() == len(dialog.buffer),
+                "the last preview",
+            )
+            shown.append(painted - start)
+            complete.append(done - start)
+        strip.removeEventFilter(probe)
+
+        self.flush_deletes()
+        labels = [
+            dialog.ui.preview_layout.itemAt(i).widget()
+            for i in range(dialog.ui.preview_layout.count())
+        ]
+        return {
+            "buffer": len(dialog.buffer),
+            "shown_ms": summary(shown),
+            "complete_ms": summary(complete),
+            "widgets": len(self.app.allWidgets()),
+            "preview_pixmap_bytes": pixmap_bytes(label.pixmap() for label in labels),
+        }
+
+    def frames_of(self, step) -> dict:
+        """
+        Time a repaint per frame.
+        :param step: Called with the frame number, draws the frame
+        :return:
+        """
+        times = []
+        for frame in range(self.frames):
+            start = time.perf_counter()
+            step(frame)
+            times.append(time.perf_counter() - start)
+        return summary(times)
+
+    def scrolling(self) -> dict:
+        """
+        Frame times at the largest height, the preview strip scrolled end
+        to end, the Required panel and overlay as the cursor steps on.
+        :return:
+        """
+        from .constants import OVERLAY_LOOKAHEAD
+
+        dialog = self.dialog
+        length = len(dialog.buffer)
+        strip = dialog.ui.scroll_area
+        bar = strip.horizontalScrollBar()
+        required = dialog.ui.required_widget
+
+        def scroll(frame):
+            bar.setValue(bar.maximum() * frame // max(1, self.frames - 1))
+            strip.repaint()
+
+        def tally(frame):
+            required.set_cursor(frame * length // self.frames, dialog.buffer)
+            required.repaint()
+
+        overlay = self.overlay()
+
+        def overlay_step(frame):
+            index = frame * length // self.frames
+            upcoming = dialog.buffer[index : index + OVERLAY_LOOKAHEAD + 1]
+            overlay.set_state("Active\nCurrent: %s" % upcoming[0], upcoming)
+            overlay.repaint()
+
+        results = {
+            "height": length,
+            "preview_frame_ms": self.frames_of(scroll),
+            "required_frame_ms": self.frames_of(tally),
+            "overlay_frame_ms": self.frames_of(overlay_step),
+        }
+        bar.setValue(0)
+        return results
+
+    def overlay(self):
+        """
+        The overlay the dialog attached to the fake game window.
+        :return:
+        """
+        dialog = self.dialog
+        self.pump(lambda: dialog.overlay_widget is not None, "the overlay")
+        return dialog.overlay_widget
+
+    def memory(self) -> dict:
+        """
+        Widgets and pixmaps held with the largest buffer shown, and the
+        Python heap peak of regenerating it.
+        :return:
+        """
+        dialog = self.dialog
+        tracemalloc.start()
+        dialog._generate_buffer()
+        self.pump(lambda: dialog._buffer_complete, "the buffer")
+        self.flush_deletes()
+        python_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        pixmaps = dialog.palette._pixmaps
+        return {
+            "widgets": len(self.app.allWidgets()),
+            "palette_pixmaps": len(pixmaps),
+            "palette_pixmap_bytes": pixmap_bytes(pixmaps.values()),
+            "python_peak_bytes": python_peak,
+            "rss_bytes": rss_bytes(),
+        }
+
+    def run(self, heights) -> dict:
+        results = self.startup()
+
+        self.dialog, _, _ = self.open_dialog()
+        self.dialog.ui.item_count_spinbox.setValue(self.items)
+        self.pump(lambda: self.dialog._buffer_complete, "the buffer")
+        try:
+            results["regenerate"] = {
+                str(height): self.regenerate(height) for height in heights
+            }
+            results["scroll"] = self.scrolling()
+            results["memory"] = self.memory()
+        finally:
+            self.close_dialog(self.dialog)
+            self.dialog = None
+        return results
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    """
+    Medians and counts of a results dict by dotted path.
+    :param results:
+    :param prefix:
+    :return:
+    """
+    values = {}
+    for key, value in results.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            if "median" in value:
+                values[path] = value["median"]
+            else:
+                values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(baseline: dict, current: dict) -> str:
+    """
+    Table of the change of each measurement.
+    :param baseline: Earlier output of run
+    :param current:
+    :return:
+    """
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    rows = [("Measurement", "Before", "After", "Change")]
+    for path, value in new.items():
+        before = old.get(path)
+        if before is None:
+            rows.append((path, "-", str(value), "new"))
+        elif before:
+            rows.append(
+                (
+                    path,
+                    str(before),
+                    str(value),
+                    "%+.1f%%" % ((value - before) / before * 100),
+                )
+            )
+        else:
+            rows.append((path, str(before), str(value), ""))
+    widths = [max(len(row[i]) for row in rows) for i in range(4)]
+    return "\n".join(
+        "  ".join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        )
+        for row in rows
+    )
+
+
+def run(samples: int = 5, frames: int = 200, items: int = 9, heights=HEIGHTS) -> dict:
+    """
+    Run the benchmarks in a temp folder.
+    :param samples: Runs of each timed action
+    :param frames: Frames of each scroll
+    :param items:
+    :param heights:
+    :return: Results with the environment they ran in
+    """
+    with tempfile.TemporaryDirectory(prefix="random_key_bench_") as folder:
+        isolate(folder)
+
+        import PySide6
+        from PySide6.QtCore import qVersion
+        from PySide6.QtWidgets import QApplication
+
+        app = QApplication.instance() or QApplication([])
+        results = Bench(app, samples, frames, items).run(heights)
+
+        return {
+            "schema": SCHEMA,
+            "app_version": __version__,
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "environment": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "qt": qVersion(),
+                "pyside": PySide6.__version__,
+                "qpa": app.platformName(),
+                "cpus": os.cpu_count(),
+            },
+            "parameters": {
+                "samples": samples,
+                "frames": frames,
+                "items": items,
+                "heights": list(heights),
+            },
+            "results": results,
+        }
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--out", help="Write the results JSON here")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--items", type=int, default=9)
+    parser.add_argument("--heights", type=int, nargs="+", default=list(HEIGHTS))
+    args = parser.parse_args(argv)
+
+    results = run(args.samples, args.frames, args.items, args.heights)
+    print(json.dumps(results, indent=2))
+
+    if args.out:
+        from .storage import atomic_write
+
+        atomic_write(args.out, json.dumps(results, indent=2).encode("utf-8"))
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            print(compare(json.load(f), results))
+    return results
+
+
+if __name__ == "__main__":
+    main()
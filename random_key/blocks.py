@@ -0,0 +1,153 @@
+"""
+Block ids of palette items for exports.
+
+Palette textures use the names of the texture files, some from before 1.13
+(concrete_powder_silver, log_big_oak, ...). block_id maps a texture name to
+the block state to place, e.g. "minecraft:light_gray_concrete_powder", from
+a table of the irregular names and the rules the rest follow. Ids can be
+overridden per item in block_ids.json in the apps data folder.
+"""
+
+import json
+import os
+import re
+
+from .storage import data_dir
+
+# Texture names that don't follow any of the rules below
+BLOCK_IDS = {
+    "brick": "bricks",
+    "cobblestone_mossy": "mossy_cobblestone",
+    "end_bricks": "end_stone_bricks",
+    "farmland_dry": "farmland",
+    "farmland_wet": "farmland[moisture=7]",
+    "ice_packed": "packed_ice",
+    "nether_brick": "nether_bricks",
+    "noteblock": "note_block",
+    "prismarine_dark": "dark_prismarine",
+    "pumpkin_face_off": "carved_pumpkin",
+    "pumpkin_face_on": "jack_o_lantern",
+    "quartz_block_chiseled": "chiseled_quartz_block",
+    "quartz_block_chiseled_top": "chiseled_quartz_block",
+    "red_nether_brick": "red_nether_bricks",
+    "red_sandstone_carved": "chiseled_red_sandstone",
+    "red_sandstone_normal": "red_sandstone",
+    "red_sandstone_smooth": "cut_red_sandstone",
+    "sandstone_carved": "chiseled_sandstone",
+    "sandstone_normal": "sandstone",
+    "sandstone_smooth": "cut_sandstone",
+    "skull_pottery_pattern": "decorated_pot",
+    "slime": "slime_block",
+    "stone_andesite": "andesite",
+    "stone_andesite_smooth": "polished_andesite",
+    "stone_diorite": "diorite",
+    "stone_diorite_smooth": "polished_diorite",
+    "stone_granite": "granite",
+    "stone_granite_smooth": "polished_granite",
+    "stone_slab_top": "smooth_stone",
+    "stonebrick": "stone_bricks",
+    "stonebrick_carved": "chiseled_stone_bricks",
+    "stonebrick_cracked": "cracked_stone_bricks",
+    "stonebrick_mossy": "mossy_stone_bricks",
+    "crimson_log_top": "crimson_stem",
+    "chiseled_bookshelf_empty": "chiseled_bookshelf",
+    "chiseled_bookshelf_occupied": "chiseled_bookshelf",
+}
+
+# Old colour and wood names
+_COLOURS = {"silver": "light_gray"}
+_WOODS = {"big_oak": "dark_oak"}
+
+# Texture name pattern to block id, {0} is the (renamed) group
+_FAMILIES = [
+    (re.compile(r"concrete_powder_(\w+)"), "{0}_concrete_powder", _COLOURS),
+    (re.compile(r"concrete_(\w+)"), "{0}_concrete", _COLOURS),
+    (re.compile(r"glazed_terracotta_(\w+)"), "{0}_glazed_terracotta", _COLOURS),
+    (re.compile(r"hardened_clay_stained_(\w+)"), "{0}_terracotta", _COLOURS),
+    (re.compile(r"wool_colored_(\w+)"), "{0}_wool", _COLOURS),
+    (re.compile(r"shulker_top_undyed"), "shulker_box", {}),
+    (re.compile(r"shulker_top_(\w+)"), "{0}_shulker_box", _COLOURS),
+    (re.compile(r"log_(\w+?)(?:_top)?"), "{0}_log", _WOODS),
+    (re.compile(r"planks_(\w+)"), "{0}_planks", _WOODS),
+    (re.compile(r"frosted_ice_(\d)"), "frosted_ice[age={0}]", {}),
+    (re.compile(r"quartz_block_(?:top|side|bottom)"), "quartz_block", {}),
+    (re.compile(r"(\w+sandstone)_(?:top|bottom)"), "{0}", {}),
+    (re.compile(r"pumpkin_(?:side|top)"), "pumpkin", {}),
+]
+
+# Faces of blocks with more than one texture, any face places the block
+_FACES = re.compile(r"_(?:top|side|bottom)$")
+
+# Texture variants that are block states
+_STATES = [
+    (re.compile(r"(\w+_bulb)_lit_powered"), "{0}[lit=true,powered=true]"),
+    (re.compile(r"(\w+_bulb)_lit"), "{0}[lit=true]"),
+    (re.compile(r"(\w+_bulb)_powered"), "{0}[powered=true]"),
+    (re.compile(r"redstone_lamp_on"), "redstone_lamp[lit=true]"),
+    (re.compile(r"redstone_lamp_off"), "redstone_lamp"),
+]
+
+
+def block_id(key: str) -> str:
+    """
+    Block state placed for a palette texture.
+    :param key: Texture file name without extension e.g. "log_big_oak_top"
+    :return: e.g. "minecraft:dark_oak_log"
+    """
+    key = key.lower()
+    block = BLOCK_IDS.get(key)
+    if block is None:
+        for pattern, template, names in _FAMILIES:
+            match = pattern.fullmatch(key)
+            if match:
+                block = template.format(*(names.get(g, g) for g in match.groups()))
+                break
+    if block is None:
+        for pattern, template in _STATES:
+            match = pattern.fullmatch(key)
+            if match:
+                block = template.format(*match.groups())
+                break
+    if block is None:
+        block = _FACES.sub("", key)
+    return "minecraft:" + block
+
+
+def overrides_path() -> str:
+    return os.path.join(data_dir(), "block_ids.json")
+
+
+def load_overrides(path: str | None = None) -> dict[str, str]:
+    """
+    User block ids, by item name or texture name.
+    :param path:
+    :return:
+    """
+    try:
+        with open(path or overrides_path(), "rb") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {str(k): str(v) for k, v in data.items()}
+
+
+def block_ids(palette, names, overrides: dict[str, str] | None = None) -> dict:
+    """
+    Block id of each item.
+    :param palette:
+    :param names: Item names
+    :param overrides: From load_overrides
+    :return: Item name to block id
+    """
+    overrides = load_overrides() if overrides is None else overrides
+    ids = {}
+    for name in names:
+        texture = palette.texture(name)
+        key = texture.key if texture else name.replace(" ", "_")
+        block = overrides.get(name) or overrides.get(key) or block_id(key)
+        if ":" not in block.split("[")[0]:
+            block = "minecraft:" + block
+        ids[name] = block
+    return ids
@@ -0,0 +1,309 @@
+"""
+Colours of the palette textures and a nearest neighbour index over them.
+
+Every texture's mean colour, dominant colours and luminance are computed
+once from its pixels, a pass over each channel as a whole rather than pixel
+by pixel, and cached in the palette manifest alongside the texture entries
+so only new or changed sources are ever measured. ColourIndex keeps the mean
+colours in CIELAB, where distance follows what the eye sees, in a KD-tree.
+"""
+
+import heapq
+import itertools
+import math
+from collections import Counter
+from dataclasses import dataclass
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QImage
+
+from .tracing import span
+
+# Dominant colours are the most common of 8 x 8 x 8 colour buckets
+_BUCKET = bytes(v >> 5 for v in range(256))
+_OPAQUE = bytes(1 if v >= 128 else 0 for v in range(256))
+DOMINANT_COLOURS = 3
+
+
+def _linear(channel: float) -> float:
+    c = channel / 255
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def relative_luminance(rgb) -> float:
+    r, g, b = (_linear(c) for c in rgb)
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def srgb_to_lab(rgb) -> tuple[float, float, float]:
+    """
+    :param rgb: 0-255 sRGB
+    :return: CIELAB under D65
+    """
+    r, g, b = (_linear(c) for c in rgb)
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+
+    def f(t):
+        return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+
+    fx, fy, fz = f(x), f(y), f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+@dataclass(frozen=True)
+class TextureColour:
+    mean: tuple[int, int, int]
+    dominant: tuple[tuple[int, int, int], ...]
+    luminance: float
+
+    @property
+    def lab(self) -> tuple[float, float, float]:
+        return srgb_to_lab(self.mean)
+
+    def to_list(self) -> list:
+        return [list(self.mean), [list(c) for c in self.dominant], self.luminance]
+
+    @classmethod
+    def from_list(cls, data: list) -> "TextureColour":
+        mean, dominant, luminance = data
+        return cls(tuple(mean), tuple(tuple(c) for c in dominant), luminance)
+
+
+def texture_colour(image: QImage) -> TextureColour | None:
+    """
+    Measure a decoded texture, pixels more than half transparent are left
+    out.
+    :param image:
+    :return: None for a null or fully transparent image
+    """
+    if image.isNull():
+        return None
+    image = image.convertToFormat(QImage.Format_RGBA8888)
+    width = image.width() * 4
+    data = bytes(image.constBits())[: image.bytesPerLine() * image.height()]
+    if image.bytesPerLine() != width:
+        data = b"".join(
+            data[row : row + width] for row in range(0, len(data), image.bytesPerLine())
+        )
+
+    channels = [data[i::4] for i in range(3)]
+    alpha = data[3::4]
+    if min(alpha, default=0) < 128:
+        mask = alpha.translate(_OPAQUE)
+        channels = [bytes(itertools.compress(c, mask)) for c in channels]
+    count = len(channels[0])
+    if not count:
+        return None
+
+    mean = tuple(round(sum(c) / count) for c in channels)
+
+    buckets = Counter(zip(*(c.translate(_BUCKET) for c in channels)))
+    top = [bucket for bucket, _ in buckets.most_common(DOMINANT_COLOURS)]
+    sums = {bucket: [0, 0, 0, 0] for bucket in top}
+    for pixel, bucket in zip(
+        zip(*channels), zip(*(c.translate(_BUCKET) for c in channels))
+    ):
+        total = sums.get(bucket)
+        if total is not None:
+            total[0] += pixel[0]
+            total[1] += pixel[1]
+            total[2] += pixel[2]
+            total[3] += 1
+    dominant = tuple(
+        tuple(round(v / total[3]) for v in total[:3])
+        for total in (sums[bucket] for bucket in top)
+    )
+
+    return TextureColour(mean, dominant, round(relative_luminance(mean), 4))
+
+
+class KDTree:
+    """
+    KD-tree over fixed dimension points for nearest neighbour queries.
+    """
+
+    def __init__(self, points: list[tuple[float, ...]]):
+        self.points = points
+        self.dimensions = len(points[0]) if points else 0
+        # Node: point index, split axis, left node, right node
+        self._root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indexes: list[int], depth: int):
+        if not indexes:
+            return None
+        axis = depth % self.dimensions
+        indexes.sort(key=lambda i: self.points[i][axis])
+        middle = len(indexes) // 2
+        return (
+            indexes[middle],
+            axis,
+            self._build(indexes[:middle], depth + 1),
+            self._build(indexes[middle + 1 :], depth + 1),
+        )
+
+    def nearest(self, point, k: int = 1, exclude=()) -> list[tuple[float, int]]:
+        """
+        :param point:
+        :param k:
+        :param exclude: Point indexes to leave out
+        :return: (squared distance, point index), nearest first
+        """
+        # Max heap of the best k by negated distance
+        best: list[tuple[float, int]] = []
+        # Node and the least squared distance its side of the split can be
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if node is None or (len(best) == k and bound >= -best[0][0]):
+                continue
+            index, axis, left, right = node
+            other = self.points[index]
+            if index not in exclude:
+                distance = sum((a - b) ** 2 for a, b in zip(point, other))
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, index))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, index))
+
+            delta = point[axis] - other[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            # Far is pushed first so near is searched first, by the time far
+            # is popped it's usually out of reach of the best so far
+            stack.append((far, delta * delta))
+            stack.append((near, bound))
+        return sorted((-distance, index) for distance, index in best)
+
+
+class ColourIndex:
+    """
+    Palette textures by colour.
+    """
+
+    def __init__(self, colours: dict[str, TextureColour]):
+        self.colours = colours
+        self.names = list(colours)
+        self._labs = [colours[name].lab for name in self.names]
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._tree = KDTree(self._labs)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def colour(self, name: str) -> TextureColour | None:
+        return self.colours.get(name)
+
+    def lab(self, name: str) -> tuple[float, float, float] | None:
+        index = self._index.get(name)
+        return None if index is None else self._labs[index]
+
+    def nearest(self, lab, k: int = 1, exclude=()) -> list[tuple[str, float]]:
+        """
+        Textures closest to a colour.
+        :param lab: CIELAB colour
+        :param k:
+        :param exclude: Names to leave out
+        :return: (name, CIELAB distance), nearest first
+        """
+        skip = {self._index[name] for name in exclude if name in self._index}
+        return [
+            (self.names[index], math.sqrt(distance))
+            for distance, index in self._tree.nearest(lab, k, skip)
+        ]
+
+    def similar(self, name: str, k: int = 8) -> list[str]:
+        """
+        Textures that look most like another.
+        :param name:
+        :param k:
+        :return:
+        """
+        lab = self.lab(name)
+        if lab is None:
+            return []
+        return [other for other, _ in self.nearest(lab, k, (name,))]
+
+    @classmethod
+    def build(cls, palette) -> "ColourIndex":
+        """
+        Colour index of a palette, measuring only textures the manifest
+        doesn't have colours for yet. Safe to call from a worker thread,
+        textures a refresh removes meanwhile are left out.
+        :param palette:
+        :return:
+        """
+        manifest = palette.manifest
+        textures = [(name, palette.texture(name)) for name in list(palette)]
+        colours = {}
+        with span("colour index", "colours", items=len(textures)):
+            for name, texture in textures:
+                if texture is None:
+                    continue
+                cached = manifest.colour(texture.source, texture.key)
+                if cached is not None:
+                    colours[name] = TextureColour.from_list(cached)
+                    continue
+                colour = texture_colour(palette.image(name))
+                if colour is not None:
+                    manifest.set_colour(texture.source, texture.key, colour.to_list())
+                    colours[name] = colour
+        manifest.save()
+        return cls(colours)
+
+
+class ColourGradient:
+    """
+    Steers the sequence engine from one colour to another over the height.
+    Items are weighted by how close their colour is to the colour at that
+    point of the gradient.
+    """
+
+    def __init__(self, start, end, colours: dict[str, tuple], spread: float = 20.0):
+        """
+        :param start: CIELAB colour at the bottom
+        :param end: CIELAB colour at the top
+        :param colours: Item name to CIELAB colour
+        :param spread: CIELAB distance at which an items weight falls to 60%
+        """
+        self.start = tuple(start)
+        self.end = tuple(end)
+        self.colours = colours
+        self.spread = spread
+
+    def target(self, t: float) -> tuple[float, ...]:
+        return tuple(a + (b - a) * t for a, b in zip(self.start, self.end))
+
+    def bias(self, name: str, t: float) -> float:
+        """
+        Weight multiplier of an item at a point of the gradient.
+        :param name:
+        :param t: 0 at the bottom to 1 at the top
+        :return:
+        """
+        colour = self.colours.get(name)
+        if colour is None:
+            return 1e-6
+        distance = sum((a - b) ** 2 for a, b in zip(colour, self.target(t)))
+        return max(1e-6, math.exp(-distance / (2 * self.spread**2)))
+
+
+class ColourIndexWorker(QObject):
+    """
+    Builds the palette's colour index in thread.
+    """
+
+    ready = Signal(object)
+    """ColourIndex"""
+    finished = Signal()
+
+    def __init__(self, palette):
+        super().__init__()
+
+        self.palette = palette
+
+    def run(self) -> None:
+        try:
+            self.ready.emit(ColourIndex.build(self.palette))
+        finally:
+            self.finished.emit()
@@ -3,3 +3,20 @@ APP_NAME = "RandomKeys"
 GROUP_NAME = "MCTools"
 
 REMAP_ITEMS = {"stone_andesite": "andesite"}
+
+# Number of upcoming blocks shown on the overlay after the current one
+OVERLAY_LOOKAHEAD = 8
+
+# Heights a preset's sequences are generated ahead of time for
+PRESET_HEIGHTS = (32, 64, 128, 256)
+
+# Hotbar slots per page, and pages (saved hotbars) items can be spread over
+HOTBAR_SIZE = 9
+HOTBAR_PAGES = 9
+MAX_ITEMS = HOTBAR_SIZE * HOTBAR_PAGES
+
+STACK_SIZE = 64
+
+# Chord loading a saved hotbar, page is 1 based. Minecraft's default
+# "Load Hotbar Activator" is C + the hotbar number.
+PAGE_CHORD = "c+{page}"
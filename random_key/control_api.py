@@ -0,0 +1,434 @@
+"""
+Local control API, for client mods, stream deck scripts and tests to drive
+the app without its widgets.
+
+Off unless enabled with Help -> Control API. The server listens on
+127.0.0.1 only, one JSON object per line both ways. A random token is made
+each time the server starts and written to control_token in the data folder,
+a connection has to send it with auth before anything else:
+
+    -> {"id": 0, "method": "auth", "params": {"token": "..."}}
+    <- {"id": 0, "result": true}
+    -> {"id": 1, "method": "next", "params": {"count": 3}}
+    <- {"id": 1, "result": [{"index": 0, "item": "Stone", "key": "1"}, ...]}
+    <- {"id": 1, "error": "..."}
+
+A line that isn't a JSON object, e.g. an HTTP request a web page sent to the
+port, or a wrong token closes the connection.
+
+Methods:
+
+    status                          Cursor, buffer length, seed and preset
+    generate                        Generate a new buffer
+    load_preset {name}              Switch to a saved preset
+    advance {steps=1, press=false}  Move the cursor on, press=true also
+                                    presses the new item's hotbar key
+    rewind {steps=1}                Move the cursor back
+    next {count=1, start=cursor}    The next items and their keys
+    subscribe {events=[...]}        Push events, "cursor" and "buffer"
+    unsubscribe
+
+Events are pushed to subscribed clients between responses:
+
+    <- {"event": "cursor", "index": 12, "item": "Stone", "key": "1"}
+    <- {"event": "buffer", "state": "complete", "length": 256, "seed": 42}
+
+The server runs an asyncio loop in its own thread, reads and cursor moves
+are answered there, KeyCursor is safe from any thread. Calls that change
+widgets are handed to the GUI thread with GuiCalls. An event is encoded once
+and written to every subscriber without waiting, a subscriber that falls
+too far behind is disconnected rather than holding the rest up.
+"""
+
+import asyncio
+import concurrent.futures
+import hmac
+import json
+import os
+import secrets
+import threading
+import traceback
+from typing import Callable
+
+from PySide6.QtCore import QObject, Signal
+
+from .storage import atomic_write, data_dir
+
+DEFAULT_PORT = 47615
+EVENTS = ("cursor", "buffer")
+
+# Longest request line
+MAX_LINE = 64 * 1024
+# Bytes queued for a subscriber before it's dropped as too slow
+MAX_BACKLOG = 1 << 20
+
+
+class ControlError(Exception):
+    """
+    A request that can't be done, sent back to the client as the error.
+    """
+
+
+def token_path() -> str:
+    return os.path.join(data_dir(), "control_token")
+
+
+def read_token(path: str | None = None) -> str:
+    """
+    Token of the running server.
+    :param path: Defaults to token_path()
+    :return:
+    :raise OSError: If no server wrote one
+    """
+    with open(path or token_path(), "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def int_param(params: dict, name: str, default: int, low: int, high: int) -> int:
+    value = params.get(name, default)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ControlError("%s must be a whole number" % name)
+    if not low <= value <= high:
+        raise ControlError("%s must be from %d to %d" % (name, low, high))
+    return value
+
+
+class ControlServer:
+    """
+    Serves the control API from its own thread.
+    """
+
+    def __init__(
+        self,
+        handlers: dict[str, Callable[[dict], object]],
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        token_file: str | None = None,
+    ):
+        """
+        :param handlers: Method name to a callable taking the params, called
+            on the server thread. It may return a concurrent Future, e.g. from
+            GuiCalls, and raise ControlError.
+        :param host:
+        :param port: 0 for any free port, the bound port is in port after start
+        :param token_file: Where the token is written, defaults to token_path()
+        """
+        self.handlers = handlers
+        self.host = host
+        self.port = port
+        self.token_file = token_file
+        self.token = ""
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop: asyncio.Event | None = None
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+        self._error: Exception | None = None
+        # Subscribed client to the events it wants
+        self._subscribers: dict[asyncio.StreamWriter, frozenset] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def start(self, timeout: float = 5.0) -> None:
+        """
+        Start serving with a new token, returns once the port is bound.
+        :param timeout:
+        :return:
+        :raise OSError: If the token can't be written, the port bound or the
+            server thread stopped as it started
+        """
+        self.token = secrets.token_hex(16)
+        # The temp file atomic_write makes is only readable by this user
+        atomic_write(self.token_file or token_path(), self.token.encode("ascii"))
+        self._ready.clear()
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name="control api", daemon=True
+        )
+        self._thread.start()
+        self._ready.wait(timeout)
+        if self._error or not self._thread.is_alive():
+            self._thread.join()
+            self._thread = None
+            self._remove_token()
+            if isinstance(self._error, OSError):
+                raise self._error
+            raise OSError("Server thread stopped: %r" % self._error) from self._error
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join()
+        self._thread = None
+        self._remove_token()
+
+    def _remove_token(self) -> None:
+        try:
+            os.remove(self.token_file or token_path())
+        except OSError:
+            pass
+
+    def publish(self, event: str, **data) -> None:
+        """
+        Send an event to its subscribers, safe to call from any thread.
+        :param event: One of EVENTS
+        :param data:
+        :return:
+        """
+        loop = self._loop
+        if loop is None or not self._subscribers:
+            return
+        line = json.dumps(dict(event=event, **data)).encode("utf-8") + b"\n"
+        try:
+            loop.call_soon_threadsafe(self._broadcast, event, line)
+        except RuntimeError:
+            # The loop closed as it stopped
+            pass
+
+    # Server thread
+    def _run(self) -> None:
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            print("Control API stopped: %s" % e)
+            self._error = e
+        finally:
+            # start waits on this, also when serving failed before the port
+            # was bound
+            self._ready.set()
+
+    async def _serve(self) -> None:
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(
+            self._client, self.host, self.port, limit=MAX_LINE
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._loop = asyncio.get_running_loop()
+        self._ready.set()
+        print("Control API listening on %s:%d" % (self.host, self.port))
+        async with server:
+            await self._stop.wait()
+            for writer in list(self._subscribers):
+                writer.close()
+            self._subscribers.clear()
+        self._loop = None
+
+    def _broadcast(self, event: str, line: bytes) -> None:
+        for writer, events in list(self._subscribers.items()):
+            if event not in events:
+                continue
+            transport = writer.transport
+            if (
+                transport.is_closing()
+                or transport.get_write_buffer_size() > MAX_BACKLOG
+            ):
+                del self._subscribers[writer]
+                writer.close()
+                continue
+            writer.write(line)
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        authenticated = False
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than MAX_LINE
+                    writer.write(b'{"id": null, "error": "request too long"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                if not isinstance(request, dict):
+                    # Not a client of this API, e.g. a browser's HTTP request
+                    writer.write(b'{"id": null, "error": "not a JSON object"}\n')
+                    break
+                if authenticated:
+                    response = await self._respond(request, writer)
+                elif self._authenticate(request):
+                    authenticated = True
+                    response = {"id": request.get("id"), "result": True}
+                else:
+                    writer.write(
+                        b'{"id": null, "error": "auth with the token first"}\n'
+                    )
+                    break
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.pop(writer, None)
+            writer.close()
+
+    def _authenticate(self, request: dict) -> bool:
+        params = request.get("params")
+        if request.get("method") != "auth" or not isinstance(params, dict):
+            return False
+        token = params.get("token")
+        if not isinstance(token, str):
+            return False
+        return hmac.compare_digest(token.encode("utf-8"), self.token.encode("ascii"))
+
+    async def _respond(self, request: dict, writer: asyncio.StreamWriter) -> dict:
+        request_id = request.get("id")
+        params = request.get("params") or {}
+        method = request.get("method")
+
+        try:
+            if not isinstance(params, dict):
+                raise ControlError("params must be an object")
+            if method == "subscribe":
+                result = self._subscribe(writer, params)
+            elif method == "unsubscribe":
+                result = self._subscribers.pop(writer, None) is not None
+            elif method in self.handlers:
+                result = self.handlers[method](params)
+                if isinstance(result, concurrent.futures.Future):
+                    result = await asyncio.wrap_future(result)
+            else:
+                raise ControlError("unknown method %r" % method)
+        except ControlError as e:
+            return {"id": request_id, "error": str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            return {"id": request_id, "error": "failed: %s" % e}
+        return {"id": request_id, "result": result}
+
+    def _subscribe(self, writer: asyncio.StreamWriter, params: dict) -> list[str]:
+        events = params.get("events", list(EVENTS))
+        if not isinstance(events, list) or not set(events) <= set(EVENTS):
+            raise ControlError("events must be a list of %s" % ", ".join(EVENTS))
+        self._subscribers[writer] = frozenset(events)
+        return sorted(events)
+
+
+class GuiCalls(QObject):
+    """
+    Runs functions on the thread it was created on, the GUI thread, for the
+    server's handlers.
+    """
+
+    _requested = Signal(object)
+
+    def __init__(self):
+        super().__init__()
+        self._requested.connect(self._run)
+
+    def call(self, func, *args) -> concurrent.futures.Future:
+        """
+        :param func:
+        :param args:
+        :return: Future of func's result, set once the GUI thread ran it
+        """
+        future = concurrent.futures.Future()
+        self._requested.emit((future, func, args))
+        return future
+
+    def _run(self, request) -> None:
+        future, func, args = request
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class ControlClient:
+    """
+    Minimal asyncio client, a stand in for a mod or script in tests.
+
+        client = await ControlClient.connect(port)  # Reads the token file
+        await client.call("advance", steps=2)
+        await client.call("subscribe", events=["cursor"])
+        event = await client.event()
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._next_id = 0
+        self._pending: dict[int, asyncio.Future] = {}
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._reading = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect(
+        cls, port: int = DEFAULT_PORT, host: str = "127.0.0.1", token: str | None = None
+    ):
+        """
+        Connect and authenticate.
+        :param port:
+        :param host:
+        :param token: The server's token, read from token_path() if not given
+        :return:
+        """
+        if token is None:
+            token = read_token()
+        reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer)
+        try:
+            await client.call("auth", token=token)
+        except (ControlError, ConnectionError):
+            await client.close()
+            raise
+        return client
+
+    async def call(self, method: str, **params):
+        """
+        :param method:
+        :param params:
+        :return: The result
+        :raise ControlError: With the server's error
+        """
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        request = {"id": request_id, "method": method, "params": params}
+        self.writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def event(self) -> dict:
+        return await self._events.get()
+
+    async def close(self) -> None:
+        self._reading.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _read(self) -> None:
+        try:
+            while line := await self.reader.readline():
+                message = json.loads(line)
+                if "event" in message:
+                    self._events.put_nowait(message)
+                    continue
+                future = self._pending.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(ControlError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("control API closed"))
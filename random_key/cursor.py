@@ -0,0 +1,74 @@
+import threading
+from array import array
+
+
+class KeyCursor:
+    """
+    Position in the buffer and the key bound to every buffer position.
+
+    Keys are appended once as the buffer is built and stored as indexes into
+    a small key table, so advancing from the input listener thread is a
+    locked increment and an array lookup, no widget state is read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = 0
+        self._key_table: list[str] = []
+        self._key_ids: dict[str, int] = {}
+        self._keys = array("B")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._index = 0
+            self._keys = array("B")
+
+    def append(self, key: str) -> None:
+        """
+        Bind the key for the next buffer position.
+        :param key:
+        :return:
+        """
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = len(self._key_table)
+            self._key_table.append(key)
+            self._key_ids[key] = key_id
+        self._keys.append(key_id)
+
+    def extend(self, keys: list[str]) -> None:
+        for key in keys:
+            self.append(key)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    def set_index(self, index: int) -> None:
+        with self._lock:
+            self._index = index
+
+    def key_at(self, index: int) -> str | None:
+        if 0 <= index < len(self._keys):
+            return self._key_table[self._keys[index]]
+        return None
+
+    def advance(self, steps: int = 1) -> tuple[int, str | None]:
+        """
+        Move the cursor on, safe to call from any thread.
+        :param steps:
+        :return: New index and the key bound to it, None past the end.
+        """
+        with self._lock:
+            self._index += steps
+            index = self._index
+        return index, self.key_at(index)
+
+    def rewind(self, steps: int = 1) -> tuple[int, str | None]:
+        with self._lock:
+            self._index = max(0, self._index - steps)
+            index = self._index
+        return index, self.key_at(index)
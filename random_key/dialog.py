@@ -1,120 +1,331 @@
-import os
+import html
 import pprint
+import random
+import time
+from collections import Counter
 import traceback
-from collections import defaultdict, OrderedDict
-
-from PySide6.QtWidgets import QLabel, QMainWindow, QMessageBox, QVBoxLayout
-from PySide6.QtGui import QPixmap, QIcon, QPainter, QColor, QFont, QPainterPath, QPen
-from PySide6.QtCore import Qt, QSettings, QThread, QObject, Signal, QPointF
-
-from pynput import mouse
-from pynput import keyboard as py_keyboard
-import keyboard
+from typing import TYPE_CHECKING
+
+from PySide6.QtWidgets import (
+    QFileDialog,
+    QInputDialog,
+    QLabel,
+    QMainWindow,
+    QMessageBox,
+    QVBoxLayout,
+)
+from PySide6.QtGui import QPixmap, QIcon
+from PySide6.QtCore import Qt, QSettings, QThread, QTimer, QObject, Signal
 
 from .ui.dialog import AppDialog
 from .ui.item_widget import ItemParameterWidget
+from .ui.widgets import PaletteModel
+from .ui.latency_widget import LatencyPanel
 from .sequences import ItemSequence, BlockSequence
-from .constants import APP_NAME, GROUP_NAME, REMAP_ITEMS
+from .cursor import KeyCursor
+from .metrics import SequenceMetrics, buffer_metrics
+from .analysis import ERROR, Diagnostic, analyze, errors
+from .session import Session, load_session, rules_to_dicts, save_session
+from .journal import FSYNC_INTERVAL, FSYNC_POLICIES, Journal, replay
+from .rule_model import RuleSetModel
+from .startup import trace
+from .tracing import save_trace, span, traced, tracer
+from .latency import LatencyRecorder
+from .input_backends import (
+    ClickRecorder,
+    InputBackend,
+    InputSource,
+    KeyboardSink,
+    KeySink,
+    PynputInputBackend,
+)
+from .constants import (
+    APP_NAME,
+    GROUP_NAME,
+    HOTBAR_SIZE,
+    OVERLAY_LOOKAHEAD,
+    PRESET_HEIGHTS,
+    STACK_SIZE,
+)
+from .keymap import KeyBinding, KeyMap, binding_for
+from .palette import Palette, PaletteChange, PaletteWatcher, default_sources
 from .overlay import OverlayWindow
+from .window_location import (
+    WindowBackend,
+    WindowInfo,
+    WindowRegistry,
+    WindowWatcher,
+    default_backend,
+)
+
+# Only needed once their actions are used, imported there to keep them off
+# the startup path
+if TYPE_CHECKING:
+    from .colours import ColourGradient, ColourIndex, ColourIndexWorker
+    from .control_api import ControlServer, GuiCalls
+    from .export import ExportWorker
+    from .planning import MaterialPlan, PlanWorker
+    from .presets import Preset, PresetLibrary, PresetSequenceWorker
 
 settings = QSettings(GROUP_NAME, APP_NAME)
 
+# Saved settings and preset state hold a list per value, keyed by these
+STATE_KEYS = {
+    "items": "item",
+    "sliders": "slider",
+    "enabled": "enabled",
+    "mins": "min",
+    "max": "max",
+    "avoids": "avoids",
+    "quotas": "quota",
+    "quota_stacks": "quota_stacks",
+}
+
 from random_key import __version__
 
 
 class ItemIconWorker(QObject):
     """
-    Generates the palette as a QIcon's Emits signal
-    when each icon has be been generated.
+    Decodes palette textures ahead of use so the first previews don't
+    have to. Emits signal when each texture has been decoded.
     """
 
-    item_ready = Signal(int, QIcon)
+    item_ready = Signal(str)
     finished = Signal()
 
-    def __init__(self, item_mappings: dict, parent=None):
+    def __init__(self, palette: Palette, names: list[str], parent=None):
         super().__init__()
 
-        self.item_mappings = item_mappings
+        self.palette = palette
+        self.names = names
 
     def run(self):
 
-        for k, v in enumerate(list(self.item_mappings.values())):
-            icon = QIcon(v)
-            self.item_ready.emit(k, icon)
+        for name in self.names:
+            with span("decode icon", "icons", item=name):
+                self.palette.image(name)
+            self.item_ready.emit(name)
 
         self.finished.emit()
 
 
 class RandomKeyDialog(QMainWindow):
 
-    def __init__(self):
+    cursor_moved = Signal()
+    """Emitted from the input thread, coalesced refresh of the displays"""
+
+    toggle_requested = Signal()
+    """Emitted from the hotkey thread to toggle the listener on the GUI thread"""
+
+    def __init__(
+        self,
+        input_backend: InputBackend | None = None,
+        key_sink: KeySink | None = None,
+        window_backend: WindowBackend | None = None,
+    ):
         super().__init__()
 
         self.setWindowTitle("Random Block Selector")
         self.ui = AppDialog()
 
-        self._item_widgets: list[ItemParameterWidget] = []
-        self._current_index = 0
+        # Values of every item, item widgets are only created for the pages
+        # shown and write their edits back here.
+        self._item_values: list[dict] = []
+        self._item_widgets: dict[int, ItemParameterWidget] = {}
+        self._page = 0
+        self.keymap = KeyMap()
+        self.cursor = KeyCursor()
+        self._key_map: dict[str, KeyBinding] = {}
+        self._cursor_page = 0
+        self._refresh_pending = False
+        # Cursor moves since the session was saved, written off the click path
+        fsync = settings.value("journal_fsync", FSYNC_INTERVAL)
+        self.journal = Journal(
+            fsync=fsync if fsync in FSYNC_POLICIES else FSYNC_INTERVAL
+        )
+        self.latency = LatencyRecorder()
+        self._latency_panel: LatencyPanel | None = None
         self._max_index = 0
         self.active = False
         self.buffer: list[str] = []
+        self._rule_set: list[ItemSequence] = []
+        self._seed: int | None = None
+        self._buffer_complete = False
+        self.metrics = SequenceMetrics([])
+        self.overlay_widget: OverlayWindow | None = None
+        self.presets: PresetLibrary | None = None
+        self._preset: Preset | None = None
+        self._preset_thread = QThread()
+        self._preset_worker: PresetSequenceWorker | None = None
+        self._initialized = False
+        self.colour_index: ColourIndex | None = None
+        self._colour_thread: QThread | None = None
+        self._colour_worker: ColourIndexWorker | None = None
+        self._gradient_pending = False
+        self._colours_stale = False
+        self.palette_watcher: PaletteWatcher | None = None
+        self._export_thread: QThread | None = None
+        self._export_worker: ExportWorker | None = None
+        self._plan_thread: QThread | None = None
+        self._plan_worker: PlanWorker | None = None
+        self.control_server: ControlServer | None = None
+        self._gui_calls: GuiCalls | None = None
         self.palette = self._build_palette()
-        self._block_counts = defaultdict(int)
-
-        # Mouse Listener
-        self.mouse_listener = mouse.Listener(on_click=self.on_click)
-        keyboard.add_hotkey("ctrl", self.toggle_listener)
-        rows, cols = 3, 3
-        for index in range(0, rows * cols):
-            row = index // cols
-            col = index % cols
-            self.add_item_widget(row, col, index)
+        self.palette_model = PaletteModel(self.palette)
+        self.ui.required_widget.set_palette(self.palette)
+        self.ui.gradient_from.set_palette_model(self.palette_model)
+        self.ui.gradient_to.set_palette_model(self.palette_model)
+        trace.mark("palette")
+
+        # Mouse Listener, input threads only advance the cursor and hand UI
+        # work to the GUI thread through queued signals. Hooks are installed
+        # after the first paint.
+        self.input_backend = input_backend or PynputInputBackend()
+        self.key_sink = key_sink
+        self.mouse_listener: InputSource | None = None
+        self._click_recorder: ClickRecorder | None = None
+        self.cursor_moved.connect(self.on_cursor_moved, Qt.QueuedConnection)
+        self.toggle_requested.connect(self.toggle_listener, Qt.QueuedConnection)
 
         # Threads and workers
         self._icon_thread = QThread()
-        self._icon_worker = ItemIconWorker(self.palette)
-
-        self._preview_thread = QThread()
-        self._preview_worker = ItemIconWorker(self.palette)
 
         self.block_sequence_thread = QThread()
         self.block_sequence = BlockSequence()
 
+        # Widget edits go through the rule model, which only regenerates
+        # when the compiled rules change.
+        self.rule_model = RuleSetModel(
+            lambda: (self.build_rule(), self.ui.max_height_spinbox.value())
+        )
+        self.ui.max_height_spinbox.valueChanged.connect(self.rule_model.invalidate)
+        self.ui.item_count_spinbox.valueChanged.connect(self.set_item_count)
+        self.ui.page_tabs.currentChanged.connect(self.show_page)
+        self.set_item_count(HOTBAR_SIZE)
+
         # UI Setup
         try:
             self._restore_values()
         except Exception:
             pass
+        self._restore_gradient()
+        self.rule_model.refresh()
 
         # Connections
-        self.ui.max_height_spinbox.valueChanged.connect(self._generate_buffer)
+        self.rule_model.rules_changed.connect(self.on_rules_changed)
         self.ui.buffer_button.clicked.connect(self._generate_buffer)
         self.ui.stop_start_button.clicked.connect(self.on_stop_start_button)
-        for i in self._item_widgets:
-            i.values_changed.connect(self.on_values_changed)
+        self.ui.gradient_checkbox.toggled.connect(self.on_gradient_changed)
+        self.ui.gradient_from.currentTextChanged.connect(self.on_gradient_changed)
+        self.ui.gradient_to.currentTextChanged.connect(self.on_gradient_changed)
+
+        # self.reposition_widgets()
+        self.setCentralWidget(self.ui)
+        self.create_menu_bar()
+
+        self.window_backend = window_backend
+        self._window_thread: QThread | None = None
+        self._window_watcher: WindowWatcher | None = None
+        trace.mark("widgets")
+
+    def paintEvent(self, event):
+        """
+        Re-implement Qt paintEvent, the rest of the app is initialised once
+        the window has been painted.
+        :param event:
+        :return:
+        """
+        super().paintEvent(event)
+        if not self._initialized:
+            self._initialized = True
+            trace.mark("first paint")
+            QTimer.singleShot(0, self.deferred_init)
+
+    def deferred_init(self) -> None:
+        """
+        Initialisation that doesn't need to block the first paint, input hooks,
+        presets, the buffer, icon decoding and game window discovery.
+        :return:
+        """
 
-        # Setup Icons for item selector in thread
+        self._initialized = True
+
+        self.input_backend.add_hotkey("ctrl", self.toggle_requested.emit)
+        if self.key_sink is None:
+            self.key_sink = KeyboardSink()
+        trace.mark("input hooks")
+
+        self.presets = self._open_presets()
+        self.presets_menu.setEnabled(self.presets is not None)
+        trace.mark("presets")
+
+        if not self._resume_session():
+            self._generate_buffer()
+        trace.mark("buffer")
+
+        # Decode the selected items textures in thread
+        self._icon_worker = ItemIconWorker(
+            self.palette, [values["item"] for values in self._item_values]
+        )
         self._icon_worker.moveToThread(self._icon_thread)
         self._icon_thread.started.connect(self._icon_worker.run)
-        self._icon_worker.item_ready.connect(self.on_item_icons_generated)
         self._icon_worker.finished.connect(self._icon_thread.quit)
         self._icon_worker.finished.connect(self.on_icons_built)
         self._icon_thread.start()
 
-        self._generate_buffer()
+        self._start_colour_index()
 
-        # self.reposition_widgets()
-        self.setCentralWidget(self.ui)
-        self.create_menu_bar()
+        # Pick up textures added to or changed in the palette's sources
+        self.palette_watcher = PaletteWatcher(self.palette, parent=self)
+        self.palette_watcher.changed.connect(self.on_palette_changed)
+
+        # Look for the game window in thread, the overlay attaches when found
+        if self.window_backend is None:
+            self.window_backend = default_backend()
+        self._window_thread = QThread()
+        self._window_watcher = WindowWatcher(WindowRegistry(self.window_backend))
+        self._window_watcher.moveToThread(self._window_thread)
+        self._window_thread.started.connect(self._window_watcher.run)
+        self._window_watcher.window_found.connect(self.on_game_window_found)
+        self._window_watcher.window_lost.connect(self.on_game_window_lost)
+        self._window_watcher.finished.connect(self._window_thread.quit)
+        self._window_thread.start()
+        trace.mark("threads started")
+
+        if settings.value("control_api", False, type=bool):
+            self.control_action.setChecked(True)
+
+        print("Startup:\n%s" % trace.report())
+
+    def on_game_window_found(self, info: WindowInfo) -> None:
+        """
+        Callback from the window watcher when the game window appears or
+        was restarted. (Re)attaches the overlay.
+        :param info:
+        :return:
+        """
 
-        self.overlay_widget = OverlayWindow.find_game_window()
+        self.on_game_window_lost()
+        provider = self.window_backend.geometry_provider(info.handle)
+        self.overlay_widget = OverlayWindow("", provider, palette=self.palette)
+        self.overlay_widget.show()
         self.update_overlay()
 
+    def on_game_window_lost(self) -> None:
+        if self.overlay_widget:
+            self.overlay_widget.close()
+            self.overlay_widget.deleteLater()
+            self.overlay_widget = None
+
     def update_overlay(self):
+        if not self.overlay_widget:
+            return
         text = "Active" if self.active else "Inactive"
         text += "\nCurrent: %s" % self.current_item
-        text += "\nNext: %s" % self.next_item
-        self.overlay_widget.set_text(text)
+        upcoming = self.buffer[
+            self._current_index : self._current_index + OVERLAY_LOOKAHEAD + 1
+        ]
+        self.overlay_widget.set_state(text, upcoming)
 
     def toggle_listener(self):
         """
@@ -138,13 +349,15 @@ class RandomKeyDialog(QMainWindow):
 
         if state:
             self.ui.stop_start_button.setText("Stop")
-            self.mouse_listener = mouse.Listener(on_click=self.on_click)
+            self.mouse_listener = self.input_backend.listener(self.on_place)
             self.mouse_listener.start()
         else:
             self.ui.stop_start_button.setText("Start")
-            self.mouse_listener.stop()
+            if self.mouse_listener:
+                self.mouse_listener.stop()
+            self.save_session()
 
-        for i in self._item_widgets:
+        for i in self._item_widgets.values():
             i.set_active(not state)
 
     def create_menu_bar(self):
@@ -156,19 +369,58 @@ class RandomKeyDialog(QMainWindow):
 
         file_menu = menu_bar.addMenu("File")
 
+        pack_action = file_menu.addAction("Add resource pack...")
+        pack_action.triggered.connect(self.on_add_resource_pack)
+
         save_action = file_menu.addAction("Save settings")
         save_action.triggered.connect(self._save_values)
 
         restore_action = file_menu.addAction("Restore last settings")
         restore_action.triggered.connect(self._restore_values)
 
+        file_menu.addSeparator()
+        export_action = file_menu.addAction("Export sequence...")
+        export_action.triggered.connect(self.export_sequence)
+
+        export_wall_action = file_menu.addAction("Export wall...")
+        export_wall_action.triggered.connect(self.export_wall)
+
+        plan_action = file_menu.addAction("Plan materials...")
+        plan_action.triggered.connect(self.plan_materials)
+        file_menu.addSeparator()
+
         exit_action = file_menu.addAction("Exit")
         exit_action.triggered.connect(self.close)
 
+        self.presets_menu = menu_bar.addMenu("Presets")
+        self.presets_menu.aboutToShow.connect(self._populate_presets_menu)
+        self.presets_menu.setEnabled(False)
+
         help_menu = menu_bar.addMenu("Help")
         about_action = help_menu.addAction("About")
         about_action.triggered.connect(self.show_about)
 
+        startup_action = help_menu.addAction("Startup report")
+        startup_action.triggered.connect(self.show_startup_report)
+
+        latency_action = help_menu.addAction("Latency...")
+        latency_action.triggered.connect(self.show_latency_panel)
+
+        record_action = help_menu.addAction("Record click trace")
+        record_action.setCheckable(True)
+        record_action.toggled.connect(self.on_record_clicks)
+
+        perf_action = help_menu.addAction("Record performance trace")
+        perf_action.setCheckable(True)
+        perf_action.toggled.connect(self.on_record_performance)
+
+        self.control_action = help_menu.addAction("Control API")
+        self.control_action.setCheckable(True)
+        self.control_action.setToolTip(
+            "Let local tools drive generation and the cursor, see the README"
+        )
+        self.control_action.toggled.connect(self.on_control_api)
+
     def resizeEvent(self, event):
         """
         Re-implement Qt resizeEvent
@@ -190,10 +442,15 @@ class RandomKeyDialog(QMainWindow):
         width = self.size().width()
         widget_width = 220
         columns = max(1, width // widget_width)
-        for index, widget in enumerate(self._item_widgets):
-            row = index // columns
-            col = index % columns
+        start = self._page * HOTBAR_SIZE
+        for index, widget in self._item_widgets.items():
+            if not start <= index < start + HOTBAR_SIZE:
+                widget.hide()
+                continue
+            row = (index - start) // columns
+            col = (index - start) % columns
             self.ui.sliders_layout.addWidget(widget, row, col)
+            widget.show()
 
     def setup_sequence_worker(self):
         """
@@ -214,8 +471,8 @@ class RandomKeyDialog(QMainWindow):
         self.block_sequence_thread.started.connect(self.block_sequence.run)
         self.block_sequence.item_added.connect(self.add_to_buffer)
 
-        self.block_sequence.finished.connect(self.block_sequence.deleteLater)
-
+        # The worker lives until it's replaced, items it queued are checked
+        # against it by sender() and are dropped if it was deleted first
         self.block_sequence_thread.finished.connect(
             self.block_sequence_thread.deleteLater
         )
@@ -230,36 +487,116 @@ class RandomKeyDialog(QMainWindow):
         """
         print("App Closing...")
         self._save_values()
+        self.save_session()
         self.block_sequence.stop()
         self.block_sequence_thread.quit()
+        self.block_sequence_thread.wait()
+        # Workers quit their threads through the event loop this is about to
+        # block, quit them here so the waits return once the work is done
+        self._icon_thread.quit()
+        self._icon_thread.wait()
+        if self._window_watcher:
+            self._window_watcher.stop()
+            self._window_thread.quit()
+            self._window_thread.wait()
+        if self._preset_worker:
+            self._preset_worker.stop()
+        self._preset_thread.quit()
+        self._preset_thread.wait()
+        if self._colour_thread:
+            self._colour_thread.quit()
+            self._colour_thread.wait()
+        if self._export_thread:
+            self._export_thread.quit()
+            self._export_thread.wait()
+        self.stop_control_api()
+        if self._plan_worker:
+            self._plan_worker.stop()
+        if self._plan_thread:
+            self._plan_thread.quit()
+            self._plan_thread.wait()
+        if self.presets:
+            self.presets.close()
+        self.journal.close()
+        self.on_game_window_lost()
         super().closeEvent(event)
 
     # Init methods
     @staticmethod
-    def _build_palette() -> dict[str, str]:
+    def _open_presets() -> "PresetLibrary | None":
+        import sqlite3
+
+        from .presets import PresetLibrary
+
+        try:
+            return PresetLibrary()
+        except (sqlite3.Error, ValueError) as e:
+            print("Could not open preset library: %s" % e)
+            return None
+
+    @staticmethod
+    def _build_palette() -> Palette:
+        """
+        Build a mapped palette from display name to texture, from the bundled
+        palette folder and any added resource packs.
+        :return:
         """
-        Build a mapped palette from display name to texture path.
+
+        resource_packs = settings.value("resource_packs", [], type=list)
+        return Palette(default_sources(resource_packs))
+
+    def on_add_resource_pack(self) -> None:
+        """
+        Add a resource pack or client jar to the palette.
         :return:
         """
 
-        # Path to palette
-        palette_dir = os.path.join(
-            os.path.dirname(__file__), os.pardir, "resources", "palette"
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Add resource pack", "", "Resource packs (*.zip *.jar)"
         )
-        palette = []
+        if not path:
+            return
 
-        for i in os.listdir(palette_dir):
-            f_name = i.split(".")[0]
-            f_name = REMAP_ITEMS.get(f_name, f_name)
-            f_name = f_name.replace("_", " ").title()
+        resource_packs = settings.value("resource_packs", [], type=list)
+        if path not in resource_packs:
+            resource_packs.append(path)
+        settings.setValue("resource_packs", resource_packs)
 
-            full_path = os.path.join(palette_dir, i)
-            palette.append((f_name, full_path))
+        sources = default_sources(resource_packs)
+        if self.palette_watcher:
+            self.palette_watcher.refresh(sources)
+        else:
+            self.on_palette_changed(self.palette.refresh(sources))
 
-        palette.sort(key=lambda x: x[0])
+    def on_palette_changed(self, change: PaletteChange) -> None:
+        """
+        Callback from the palette watcher, textures were added, removed or
+        changed on disk. The models and previews are updated in place, the
+        buffer and selections stay.
+        :param change:
+        :return:
+        """
+        self.palette_model.apply(change)
+
+        changed = set(change.changed)
+        if changed:
+            for i in range(min(self.ui.preview_layout.count(), len(self.buffer))):
+                label = self.ui.preview_layout.itemAt(i).widget()
+                if label and self.buffer[i] in changed:
+                    label.setPixmap(self.palette.pixmap(self.buffer[i], 64))
+            if self.overlay_widget:
+                self.overlay_widget.set_palette(self.palette)
+        self.ui.required_widget.update()
+        self.update_displays()
 
-        palette_dict = {name: path for name, path in palette}
-        return palette_dict
+        if self._rule_set:
+            self.show_diagnostics(
+                analyze(
+                    self._rule_set, self.palette, self.ui.max_height_spinbox.value()
+                )
+            )
+        self._start_colour_index()
+        self.statusBar().showMessage("Palette: %s" % change.summary(), 5000)
 
     def show_about(self):
         QMessageBox.about(
@@ -269,6 +606,59 @@ class RandomKeyDialog(QMainWindow):
             % __version__,
         )
 
+    def show_startup_report(self):
+        box = QMessageBox(self)
+        box.setWindowTitle("Startup")
+        box.setText("Time per startup phase, and since launch.")
+        box.setInformativeText("<pre>%s</pre>" % trace.report())
+        box.exec()
+
+    def on_record_clicks(self, state: bool) -> None:
+        """
+        Start or stop recording the timing of place clicks, the trace can be
+        replayed headless with random_key.replay.
+        :param state:
+        :return:
+        """
+
+        if state:
+            self._click_recorder = ClickRecorder()
+            return
+
+        recorder, self._click_recorder = self._click_recorder, None
+        if not recorder or not recorder.times:
+            return
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save click trace", "clicks.trace", "Click trace (*.trace)"
+        )
+        if path:
+            recorder.save(path)
+
+    def on_record_performance(self, state: bool) -> None:
+        """
+        Start or stop recording spans with a profile and memory use, the trace
+        opens in Perfetto and the profile is saved next to it.
+        :param state:
+        :return:
+        """
+
+        if state:
+            tracer.start(profile=True, memory=True)
+            return
+
+        trace = tracer.stop()
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save performance trace", "trace.json", "Chrome trace (*.json)"
+        )
+        if path:
+            save_trace(trace, path, tracer.last_profile)
+
+    def show_latency_panel(self):
+        if self._latency_panel is None:
+            self._latency_panel = LatencyPanel(self.latency, self)
+        self._latency_panel.show()
+        self._latency_panel.raise_()
+
     def on_icons_built(self):
         """
         Callback for UI Setup when icon previews have been built for the ItemWidget's
@@ -281,46 +671,166 @@ class RandomKeyDialog(QMainWindow):
         """
         Callback for Sequence generation completed from QThread.
         """
+        if self.sender() is not self.block_sequence:
+            return
+
         self.ui.progress.setRange(0, len(self.buffer))
-        self.display_item_requirments()
+        self.update_metrics_display()
+        self._buffer_complete = not self.block_sequence._stop_flag
+        self.save_session()
+        self._publish_buffer("complete" if self._buffer_complete else "stopped")
 
+    @traced("add_to_buffer", "ui")
     def add_to_buffer(self, item: str):
         """
         Callback from BlockSequence when the next item has been generated.
 
-        Add the item to buffer and add it to the display preview
+        Add the item to buffer, the display preview and the required tally.
         :param item:
         :return:
         """
 
-        self._block_counts[item] += 1
+        # Items queued by a worker that has since been replaced
+        if self.sender() is not self.block_sequence:
+            return
+        self.block_sequence.item_taken()
+
         self.buffer.append(item)
+        self._append_key(item)
+        self.metrics.add(item)
 
-        item_path = self.palette.get(item)
-        self.add_item_to_preview(item_path)
+        self.add_item_to_preview(item)
+        self.ui.required_widget.add_item(item)
 
-    def on_item_icons_generated(self, index: int, icon: QIcon) -> None:
+    def _append_key(self, item: str) -> None:
         """
-        Callback method for item icons generated in thread. Adds them to
-        each item's, Item selector.
-        :param index:
-        :param icon:
+        Bind the keys moving onto item to the next cursor position, with a
+        page switch first if item is on another hotbar page.
+        :param item:
         :return:
         """
+        binding = self._key_map[item]
+        self.cursor.append(self.keymap.keys(binding, self._cursor_page))
+        self._cursor_page = binding.page
+
+    # Items
+    def _default_values(self, index: int) -> dict:
+        names = self.palette_model.names
+        return {
+            "item": names[index % len(names)] if names else "",
+            "slider": 50,
+            "enabled": True,
+            "min": 1,
+            "max": 3,
+            "avoids": "",
+            "quota": 0,
+            "quota_stacks": False,
+        }
 
-        for widget in self._item_widgets:
-            widget.selector.set_icon(index, icon)
+    @property
+    def item_count(self) -> int:
+        return len(self._item_values)
 
-    def add_item_widget(self, row: int, column: int, index: int) -> None:
+    def set_item_count(self, count: int) -> None:
         """
-        Add item_widget.ItemParameterWidget widget to the Items Layout
+        Add or remove items, items past the first hotbar are spread over
+        pages.
+        :param count:
         :return:
         """
-        item_params_widget = ItemParameterWidget(index + 1)
-        item_params_widget.add_palette_items(self.palette)
+        count = max(1, count)
+        if count == self.item_count:
+            return
+
+        with self.rule_model.batch():
+            del self._item_values[count:]
+            for index in range(self.item_count, count):
+                self._item_values.append(self._default_values(index))
+            for index in [i for i in self._item_widgets if i >= count]:
+                self._item_widgets.pop(index).deleteLater()
+
+            self.ui.item_count_spinbox.blockSignals(True)
+            self.ui.item_count_spinbox.setValue(count)
+            self.ui.item_count_spinbox.blockSignals(False)
+
+            pages = (count - 1) // HOTBAR_SIZE + 1
+            tabs = self.ui.page_tabs
+            tabs.blockSignals(True)
+            while tabs.count() > pages:
+                tabs.removeTab(tabs.count() - 1)
+            while tabs.count() < pages:
+                tabs.addTab("Page %d" % (tabs.count() + 1))
+            tabs.blockSignals(False)
+            tabs.setVisible(pages > 1)
+
+            paged = pages > 1
+            for index, widget in self._item_widgets.items():
+                widget.set_label(binding_for(index).label(paged))
+
+            self.show_page(min(self._page, pages - 1))
+            self.rule_model.invalidate()
+
+    def show_page(self, page: int) -> None:
+        """
+        Show a hotbar page of items, creating its widgets the first time.
+        :param page:
+        :return:
+        """
+        self._page = max(0, page)
+        if self.ui.page_tabs.currentIndex() != self._page:
+            self.ui.page_tabs.setCurrentIndex(self._page)
+
+        start = self._page * HOTBAR_SIZE
+        for index in range(start, min(start + HOTBAR_SIZE, self.item_count)):
+            self._item_widget(index)
+        self.reposition_widgets()
+
+    def _item_widget(self, index: int) -> ItemParameterWidget:
+        widget = self._item_widgets.get(index)
+        if widget is not None:
+            return widget
+
+        binding = binding_for(index)
+        widget = ItemParameterWidget(binding.key)
+        widget.set_palette_model(self.palette_model)
+        widget.set_similar_provider(self.similar_items)
+        widget.set_label(binding.label(self.item_count > HOTBAR_SIZE))
+        widget.set_values(self._item_values[index])
+        widget.set_active(not self.active)
+        widget.values_changed.connect(
+            lambda w, i=index: self.on_item_values_changed(i, w)
+        )
+        self._item_widgets[index] = widget
+        return widget
 
-        self._item_widgets.append(item_params_widget)
-        self.ui.sliders_layout.addWidget(item_params_widget, row, column)
+    def on_item_values_changed(self, index: int, widget: ItemParameterWidget) -> None:
+        self._item_values[index] = widget.values()
+        self.rule_model.invalidate()
+
+    def set_item_values(self, values: list[dict]) -> None:
+        """
+        Replace the values of every item as one rule model batch.
+        :param values:
+        :return:
+        """
+        with self.rule_model.batch():
+            self.set_item_count(len(values))
+            for index, item_values in enumerate(values):
+                # The widget writes its values back as they change, update
+                # ours after so they end up complete
+                if index in self._item_widgets:
+                    self._item_widgets[index].set_values(item_values)
+                self._item_values[index].update(item_values)
+            self.rule_model.invalidate()
+
+    @staticmethod
+    def _values_from_state(state: dict) -> list[dict]:
+        count = max(len(v) for v in state.values())
+        values = [{} for _ in range(count)]
+        for state_key, key in STATE_KEYS.items():
+            for index, value in enumerate(state.get(state_key, [])):
+                values[index][key] = value
+        return values
 
     # User Settings
     def _save_values(self) -> None:
@@ -329,17 +839,20 @@ class RandomKeyDialog(QMainWindow):
         :return:
         """
 
-        settings.setValue("sliders", [x.slider.value() for x in self._item_widgets])
-        settings.setValue(
-            "enabled", [x.checkbox.isChecked() for x in self._item_widgets]
-        )
-        settings.setValue("mins", [x.min_amount.value() for x in self._item_widgets])
-        settings.setValue("max", [x.max_amount.value() for x in self._item_widgets])
-        settings.setValue("avoids", [x.no_next.text() for x in self._item_widgets])
+        state = self._widget_state()
+        settings.setValue("sliders", state["sliders"])
+        settings.setValue("enabled", state["enabled"])
+        settings.setValue("mins", state["mins"])
+        settings.setValue("max", state["max"])
+        settings.setValue("avoids", state["avoids"])
+        settings.setValue("quotas", state["quotas"])
+        settings.setValue("quota_stacks", state["quota_stacks"])
         settings.setValue("max_length", self.ui.max_height_spinbox.value())
-        settings.setValue(
-            "items", [x.selector.currentIndex() for x in self._item_widgets]
-        )
+        settings.setValue("item_names", state["items"])
+        settings.setValue("item_count", self.item_count)
+        settings.setValue("gradient", self.ui.gradient_checkbox.isChecked())
+        settings.setValue("gradient_from", self.ui.gradient_from.currentText())
+        settings.setValue("gradient_to", self.ui.gradient_to.currentText())
         print("Saved Sessions UI values")
 
     def _restore_values(self) -> None:
@@ -347,34 +860,575 @@ class RandomKeyDialog(QMainWindow):
         Restore the UI values from previous session.
         :return:
         """
-        self.ui.max_height_spinbox.setValue(settings.value("max_length", type=int))
-        for x, val in enumerate(settings.value("sliders", type=list)):
-            self._item_widgets[x].slider.setValue(int(val))
-        for x, val in enumerate(settings.value("enabled", type=list)):
-            val = val == "true"
-            self._item_widgets[x].checkbox.setChecked(val)
-            self._item_widgets[x].slider.setEnabled(val)
-        for x, val in enumerate(settings.value("mins", type=list)):
-            self._item_widgets[x].min_amount.setValue(int(val))
-        for x, val in enumerate(settings.value("max", type=list)):
-            self._item_widgets[x].max_amount.setValue(int(val))
-        for x, val in enumerate(settings.value("avoids")):
-            self._item_widgets[x].no_next.setText(val)
-        for x, val in enumerate(settings.value("items", type=list)):
-            self._item_widgets[x].selector.setCurrentIndex(int(val))
+        count = settings.value("item_count", HOTBAR_SIZE, type=int)
+        state = {
+            "sliders": [int(v) for v in settings.value("sliders", type=list)],
+            "enabled": [
+                v in ("true", True) for v in settings.value("enabled", type=list)
+            ],
+            "mins": [int(v) for v in settings.value("mins", type=list)],
+            "max": [int(v) for v in settings.value("max", type=list)],
+            "avoids": settings.value("avoids", type=list),
+            "quotas": [int(v) for v in settings.value("quotas", type=list)],
+            "quota_stacks": [
+                v in ("true", True) for v in settings.value("quota_stacks", type=list)
+            ],
+            "items": settings.value("item_names", type=list),
+        }
+        # Older settings saved the palette index of each item
+        if not state["items"]:
+            names = self.palette_model.names
+            state["items"] = [names[int(v)] for v in settings.value("items", type=list)]
+
+        values = self._values_from_state(state)[:count]
+        values += [{}] * (count - len(values))
+        with self.rule_model.batch():
+            self.ui.max_height_spinbox.setValue(settings.value("max_length", type=int))
+            self.set_item_values(values)
 
         print("Restored Settings")
 
+    def _widget_state(self) -> dict:
+        """
+        Item widget values, by item name rather than palette index.
+        :return:
+        """
+        return {
+            state_key: [values[key] for values in self._item_values]
+            for state_key, key in STATE_KEYS.items()
+        }
+
+    def _apply_widget_state(self, state: dict, length: int) -> None:
+        """
+        Set the item widgets and height as one rule model batch.
+        :param state: From _widget_state
+        :param length:
+        :return:
+        """
+        with self.rule_model.batch():
+            self.ui.max_height_spinbox.setValue(length)
+            self.set_item_values(self._values_from_state(state))
+
+    # Presets
+    def _populate_presets_menu(self) -> None:
+        """
+        Rebuild the presets menu from the library when shown.
+        :return:
+        """
+        self.presets_menu.clear()
+
+        save_action = self.presets_menu.addAction("Save as preset...")
+        save_action.triggered.connect(self.on_save_preset)
+
+        names = self.presets.names()
+        delete_menu = self.presets_menu.addMenu("Delete preset")
+        delete_menu.setEnabled(bool(names))
+        self.presets_menu.addSeparator()
+
+        for name in names:
+            action = self.presets_menu.addAction(name)
+            action.setCheckable(True)
+            action.setChecked(bool(self._preset) and self._preset.name == name)
+            action.triggered.connect(lambda _=False, n=name: self.load_preset(n))
+            delete_action = delete_menu.addAction(name)
+            delete_action.triggered.connect(
+                lambda _=False, n=name: self.delete_preset(n)
+            )
+
+    def on_save_preset(self) -> None:
+        current = self._preset.name if self._preset else ""
+        name, ok = QInputDialog.getText(self, "Save preset", "Name:", text=current)
+        name = name.strip()
+        if ok and name:
+            self.save_preset(name)
+
+    def save_preset(self, name: str) -> None:
+        """
+        Save the current rules as a preset, and generate its sequences for the
+        common heights in thread.
+        :param name:
+        :return:
+        """
+        rule_set = self.build_rule()
+        rules = rules_to_dicts(rule_set)
+        length = self.ui.max_height_spinbox.value()
+        preset_id = self.presets.save(name, length, rules, self._widget_state())
+
+        # The current buffer is already one of its sequences
+        if self._buffer_complete and rules_to_dicts(self._rule_set) == rules:
+            self.presets.add_sequence(preset_id, length, self._seed, self.buffer)
+        self._preset = self.presets.load(name)
+
+        if self._blocked_by_errors(
+            rule_set,
+            "Save preset",
+            "Saved, its sequences are generated once these are fixed:",
+        ):
+            return
+        heights = set(PRESET_HEIGHTS) - set(self.presets.heights(preset_id))
+        self._precompute_sequences(preset_id, rules, heights)
+
+    def _precompute_sequences(self, preset_id: int, rules: list[dict], heights) -> None:
+        """
+        Restart the preset worker thread for a preset's missing heights.
+        :param preset_id:
+        :param rules:
+        :param heights:
+        :return:
+        """
+        if self._preset_worker:
+            self._preset_worker.stop()
+        self._preset_thread.quit()
+        self._preset_thread.wait()
+        if not heights:
+            return
+
+        from .presets import PresetSequenceWorker
+
+        self._preset_thread = QThread()
+        self._preset_worker = PresetSequenceWorker(
+            self.presets.path, preset_id, rules, heights
+        )
+        self._preset_worker.moveToThread(self._preset_thread)
+        self._preset_thread.started.connect(self._preset_worker.run)
+        self._preset_worker.sequence_added.connect(self.on_preset_sequence_added)
+        self._preset_worker.finished.connect(self._preset_worker.deleteLater)
+        self._preset_thread.finished.connect(self._preset_thread.deleteLater)
+        self._preset_thread.start()
+
+    def on_preset_sequence_added(self, preset_id: int, height: int) -> None:
+        print("Preset sequence ready, height %s" % height)
+
+    def load_preset(self, name: str) -> None:
+        """
+        Switch to a preset, the rule model picks up its precomputed sequence
+        if the rules changed.
+        :param name:
+        :return:
+        """
+        preset = self.presets.load(name)
+        if preset is None:
+            return
+        self._preset = preset
+        self._apply_widget_state(preset.state, preset.length)
+
+    def delete_preset(self, name: str) -> None:
+        self.presets.delete(name)
+        if self._preset and self._preset.name == name:
+            self._preset = None
+
+    def _preset_sequence(
+        self, rule_set: list[ItemSequence], height: int
+    ) -> tuple[int, list[str]] | None:
+        """
+        The current preset's sequence for height, if the rules are still the
+        preset's.
+        :param rule_set:
+        :param height:
+        :return: seed, buffer
+        """
+        preset = self._preset
+        # Preset sequences are generated without a gradient
+        if not preset or preset.rule_set() != rule_set or self.gradient_enabled:
+            return None
+        if preset.buffer is not None and height == preset.length:
+            return preset.seed, preset.buffer
+        return self.presets.sequence(preset.id, height)
+
+    # Export
+    def _export_path(self, title: str) -> str:
+        path, _ = QFileDialog.getSaveFileName(
+            self,
+            title,
+            "",
+            "Sponge schematic (*.schem);;Function (*.mcfunction)",
+        )
+        return path
+
+    def export_sequence(self) -> None:
+        """
+        Export the buffer as one column.
+        :return:
+        """
+        if not self.buffer:
+            return
+        path = self._export_path("Export sequence")
+        if not path:
+            return
+        from .blocks import block_ids
+        from .export import sequence_rows
+
+        buffer = list(self.buffer)
+        ids = block_ids(self.palette, set(buffer))
+        self._start_export(path, sequence_rows(buffer), 1, len(buffer), ids)
+
+    def export_wall(self) -> None:
+        """
+        Export a wall of columns generated from the current rules, each
+        column is its own sequence.
+        :return:
+        """
+        rule_set = self.build_rule()
+        if self._blocked_by_errors(
+            rule_set, "Export wall", "Can't export a wall of these rules:"
+        ):
+            return
+        columns, ok = QInputDialog.getInt(self, "Export wall", "Columns:", 16, 1, 4096)
+        if not ok:
+            return
+        path = self._export_path("Export wall")
+        if not path:
+            return
+
+        from .blocks import block_ids
+        from .export import plan_columns, plan_rows
+
+        height = self.ui.max_height_spinbox.value()
+        generators = plan_columns(
+            rule_set, height, columns, self._seed, self._gradient(rule_set)
+        )
+        ids = block_ids(self.palette, {rule.item_name for rule in rule_set})
+        self._start_export(path, plan_rows(generators, height), columns, height, ids)
+
+    def _start_export(self, path: str, rows, width: int, height: int, ids) -> None:
+        if self._export_thread and self._export_thread.isRunning():
+            QMessageBox.information(self, "Export", "An export is already running.")
+            return
+        from .export import ExportWorker
+
+        self._export_thread = QThread()
+        self._export_worker = ExportWorker(path, rows, width, height, ids)
+        self._export_worker.moveToThread(self._export_thread)
+        self._export_thread.started.connect(self._export_worker.run)
+        self._export_worker.finished.connect(self.on_export_finished)
+        self._export_worker.failed.connect(self.on_export_failed)
+        self._export_worker.finished.connect(self._export_thread.quit)
+        self._export_worker.failed.connect(self._export_thread.quit)
+        self._export_thread.finished.connect(self._export_worker.deleteLater)
+        self._export_thread.start()
+        self.statusBar().showMessage("Exporting %s..." % path)
+
+    def on_export_finished(self, path: str) -> None:
+        self.statusBar().showMessage("Exported %s" % path, 5000)
+
+    def on_export_failed(self, message: str) -> None:
+        self.statusBar().clearMessage()
+        QMessageBox.warning(self, "Export", "Could not export: %s" % message)
+
+    # Planning
+    def plan_materials(self) -> None:
+        """
+        Simulate sequences of the current rules to find how many stacks of
+        each item a build is likely to need.
+        :return:
+        """
+        if self._plan_thread and self._plan_thread.isRunning():
+            QMessageBox.information(
+                self, "Plan materials", "A plan is already running."
+            )
+            return
+        rule_set = self.build_rule()
+        if self._blocked_by_errors(
+            rule_set, "Plan materials", "Can't plan materials for these rules:"
+        ):
+            return
+        simulations, ok = QInputDialog.getInt(
+            self, "Plan materials", "Sequences to simulate:", 10000, 100, 1000000, 1000
+        )
+        if not ok:
+            return
+        from .planning import PlanWorker
+
+        self._plan_thread = QThread()
+        self._plan_worker = PlanWorker(
+            rule_set,
+            self.ui.max_height_spinbox.value(),
+            simulations,
+            self._seed,
+            self._gradient(rule_set),
+        )
+        self._plan_worker.moveToThread(self._plan_thread)
+        self._plan_thread.started.connect(self._plan_worker.run)
+        self._plan_worker.progress.connect(self.on_plan_progress)
+        self._plan_worker.finished.connect(self.on_plan_finished)
+        self._plan_worker.failed.connect(self.on_plan_failed)
+        self._plan_worker.finished.connect(self._plan_thread.quit)
+        self._plan_worker.failed.connect(self._plan_thread.quit)
+        self._plan_thread.finished.connect(self._plan_worker.deleteLater)
+        self._plan_thread.start()
+        self.statusBar().showMessage("Planning materials...")
+
+    def on_plan_progress(self, done: int) -> None:
+        if self._plan_worker:
+            self.statusBar().showMessage(
+                "Planning materials... %d/%d" % (done, self._plan_worker.simulations)
+            )
+
+    def on_plan_finished(self, plan: "MaterialPlan | None") -> None:
+        """
+        Callback from the plan worker.
+        :param plan: None when it was stopped
+        :return:
+        """
+        self._plan_worker = None
+        self.statusBar().clearMessage()
+        if plan is None:
+            return
+        box = QMessageBox(self)
+        box.setWindowTitle("Plan materials")
+        box.setText(
+            "Stacks needed by %d sequences of %d blocks, the mean and the count "
+            "50%%, 95%% and 99%% of them stay within." % (plan.simulations, plan.height)
+        )
+        box.setInformativeText("<pre>%s</pre>" % html.escape(plan.report()))
+        box.exec()
+
+    def on_plan_failed(self, message: str) -> None:
+        self._plan_worker = None
+        self.statusBar().clearMessage()
+        QMessageBox.warning(self, "Plan materials", "Could not plan: %s" % message)
+
+    # Control API
+    def on_control_api(self, state: bool) -> None:
+        """
+        Callback for the Control API toggle.
+        :param state:
+        :return:
+        """
+        settings.setValue("control_api", state)
+        if state:
+            self.start_control_api()
+        else:
+            self.stop_control_api()
+
+    def start_control_api(self) -> None:
+        if self.control_server:
+            return
+        from .control_api import DEFAULT_PORT, ControlServer, GuiCalls
+
+        if self._gui_calls is None:
+            self._gui_calls = GuiCalls()
+        port = settings.value("control_port", DEFAULT_PORT, type=int)
+        server = ControlServer(
+            {
+                "status": self._api_status,
+                "generate": self._api_generate,
+                "load_preset": self._api_load_preset,
+                "advance": self._api_advance,
+                "rewind": self._api_rewind,
+                "next": self._api_next,
+            },
+            port=port,
+        )
+        try:
+            server.start()
+        except OSError as e:
+            QMessageBox.warning(
+                self, "Control API", "Could not start on port %d: %s" % (port, e)
+            )
+            self.control_action.setChecked(False)
+            return
+        self.control_server = server
+        self.statusBar().showMessage("Control API on 127.0.0.1:%d" % server.port, 5000)
+
+    def stop_control_api(self) -> None:
+        if self.control_server:
+            self.control_server.stop()
+            self.control_server = None
+
+    def _publish_buffer(self, state: str) -> None:
+        if self.control_server:
+            self.control_server.publish(
+                "buffer", state=state, length=len(self.buffer), seed=self._seed
+            )
+
+    # Handlers are called on the control server's thread, reads and cursor
+    # moves are safe there, anything touching widgets goes through _gui_calls
+    def _api_position(self, index: int, key: str | None) -> dict:
+        buffer = self.buffer
+        item = buffer[index] if index < len(buffer) else None
+        return {"index": index, "item": item, "key": key}
+
+    def _api_status(self, params: dict) -> dict:
+        return {
+            "index": self.cursor.index,
+            "length": len(self.buffer),
+            "complete": self._buffer_complete,
+            "active": self.active,
+            "seed": self._seed,
+            "preset": self._preset.name if self._preset else None,
+        }
+
+    def _api_generate(self, params: dict):
+        def generate():
+            self._generate_buffer()
+            return {"seed": self._seed}
+
+        return self._gui_calls.call(generate)
+
+    def _api_load_preset(self, params: dict):
+        from .control_api import ControlError
+
+        name = params.get("name")
+        if not isinstance(name, str):
+            raise ControlError("name must be a preset name")
+
+        def load():
+            if not self.presets or name not in self.presets.names():
+                raise ControlError("no preset %r" % name)
+            self.load_preset(name)
+            return {"seed": self._seed, "length": len(self.buffer)}
+
+        return self._gui_calls.call(load)
+
+    def _api_advance(self, params: dict) -> dict:
+        from .control_api import int_param
+
+        steps = int_param(params, "steps", 1, 1, 1000000)
+        index, key = self.cursor.advance(steps)
+        if params.get("press") and key is not None:
+            self.simulate_keypress(key)
+        self.journal.record(index)
+        self.request_refresh()
+        return self._api_position(index, key)
+
+    def _api_rewind(self, params: dict) -> dict:
+        from .control_api import int_param
+
+        steps = int_param(params, "steps", 1, 1, 1000000)
+        index, key = self.cursor.rewind(steps)
+        self.journal.record(index)
+        self.request_refresh()
+        return self._api_position(index, key)
+
+    def _api_next(self, params: dict) -> list[dict]:
+        from .control_api import int_param
+
+        start = int_param(params, "start", self.cursor.index, 0, 2**31)
+        count = int_param(params, "count", 1, 1, 4096)
+        buffer = self.buffer
+        return [
+            {"index": i, "item": buffer[i], "key": self.cursor.key_at(i)}
+            for i in range(start, min(start + count, len(buffer)))
+        ]
+
+    # Colours
+    @property
+    def gradient_enabled(self) -> bool:
+        return self.ui.gradient_checkbox.isChecked()
+
+    def _gradient(self, rule_set: list[ItemSequence]) -> "ColourGradient | None":
+        """
+        Gradient for the engine from the Gradient row, None when it's off or
+        the palette's colours aren't known yet.
+        :param rule_set:
+        :return:
+        """
+        if not self.gradient_enabled:
+            return None
+        if self.colour_index is None:
+            # Generate again once the colours are in
+            self._gradient_pending = True
+            return None
+
+        start = self.colour_index.lab(self.ui.gradient_from.currentText())
+        end = self.colour_index.lab(self.ui.gradient_to.currentText())
+        if start is None or end is None:
+            return None
+        colours = {}
+        for rule in rule_set:
+            lab = self.colour_index.lab(rule.item_name)
+            if lab is not None:
+                colours[rule.item_name] = lab
+        from .colours import ColourGradient
+
+        return ColourGradient(start, end, colours)
+
+    def on_gradient_changed(self, *args) -> None:
+        """
+        Callback for the Gradient row, the colours only matter while it's on.
+        :param args:
+        :return:
+        """
+        if self.colour_index is None:
+            return
+        if self.sender() is not self.ui.gradient_checkbox and not self.gradient_enabled:
+            return
+        self._generate_buffer()
+
+    def _start_colour_index(self) -> None:
+        """
+        Measure the palette's colours in thread, the gradient and similar
+        block suggestions need them. Only new or changed textures are
+        measured, the rest come from the manifest.
+        :return:
+        """
+        if self._colour_thread and self._colour_thread.isRunning():
+            # Again once the running one is done
+            self._colours_stale = True
+            return
+        from .colours import ColourIndexWorker
+
+        self._colours_stale = False
+        self._colour_thread = QThread()
+        self._colour_worker = ColourIndexWorker(self.palette)
+        self._colour_worker.moveToThread(self._colour_thread)
+        self._colour_thread.started.connect(self._colour_worker.run)
+        self._colour_worker.ready.connect(self.on_colour_index_ready)
+        self._colour_worker.finished.connect(self._colour_thread.quit)
+        self._colour_thread.finished.connect(self._colour_worker.deleteLater)
+        self._colour_thread.finished.connect(self._on_colour_thread_finished)
+        self._colour_thread.start()
+
+    def _on_colour_thread_finished(self) -> None:
+        if self._colours_stale:
+            self._start_colour_index()
+
+    def on_colour_index_ready(self, index: "ColourIndex") -> None:
+        """
+        Callback from the colour worker with the palette's colour index.
+        :param index:
+        :return:
+        """
+        self.colour_index = index
+        self.ui.gradient_checkbox.setEnabled(True)
+        self.ui.gradient_checkbox.setToolTip(
+            "Steer the sequence from one block's colour to the other's"
+        )
+        if self._gradient_pending:
+            self._gradient_pending = False
+            self._generate_buffer()
+
+    def similar_items(self, name: str) -> list[str]:
+        """
+        Blocks that look like name, for the item widgets suggestions.
+        :param name:
+        :return:
+        """
+        if self.colour_index is None:
+            return []
+        return self.colour_index.similar(name, 8)
+
+    def _restore_gradient(self) -> None:
+        names = self.palette_model.names
+        for combo, key, default in (
+            (self.ui.gradient_from, "gradient_from", names[0] if names else ""),
+            (self.ui.gradient_to, "gradient_to", names[-1] if names else ""),
+        ):
+            row = combo.findText(settings.value(key, default), Qt.MatchFixedString)
+            combo.setCurrentIndex(max(0, row))
+        self.ui.gradient_checkbox.setChecked(
+            settings.value("gradient", False, type=bool)
+        )
+
     # Display
+    @traced("draw_palette_from_buffer", "ui")
     def draw_palette_from_buffer(self, image_size: int = 64):
         """
         Displays the buffer as A block sequence using the palette resources.
         :return:
         """
 
-        # Generate Paths
-        images: list[str] = [self.palette.get(block) for block in self.buffer]
-
         # Clear the layout
         while self.ui.preview_layout.count():
             item = self.ui.preview_layout.takeAt(0)
@@ -382,13 +1436,12 @@ class RandomKeyDialog(QMainWindow):
             if widget:
                 widget.deleteLater()
 
-        for path in images:
-            if not path:
+        for block in self.buffer:
+            if block not in self.palette:
                 continue
             label = QLabel()
             label.setFixedSize(image_size, image_size)
-            pixmap = QPixmap(path).scaled(image_size, image_size, Qt.IgnoreAspectRatio)
-            label.setPixmap(pixmap)
+            label.setPixmap(self.palette.pixmap(block, image_size))
             self.ui.preview_layout.addWidget(label)
 
     def clear_preview(self):
@@ -404,116 +1457,180 @@ class RandomKeyDialog(QMainWindow):
             if widget:
                 widget.deleteLater()
 
-    def add_item_to_preview(
-        self, path: str, image_size: int = 64, layout=None, text=None
-    ) -> None:
+    @traced("add_item_to_preview", "ui")
+    def add_item_to_preview(self, item: str, image_size: int = 64) -> None:
         """
         Add an Image to the Block Previews Layout.
-        :param path:
+        :param item: Palette name
         :param image_size:
         :return:
         """
 
-        if not layout:
-            layout = self.ui.preview_layout
-
         label = QLabel()
         label.setFixedSize(image_size, image_size)
-        pixmap = QPixmap(path).scaled(image_size, image_size, Qt.IgnoreAspectRatio)
-
-        if text:
-
-            font = QFont("Arial", 12, QFont.Bold)
-
-            height = 0
+        label.setPixmap(self.palette.pixmap(item, image_size))
+        self.ui.preview_layout.addWidget(label)
 
-            for i in text:
-
-                draw_text_with_outline_on_pixmap(
-                    pixmap, i, pos=(0, 16 + height), font=font
-                )
-
-                height += 16
-
-            # painter.setRenderHint(QPainter.Antialiasing)
-            # painter.setPen(QColor("white"))
-            # painter.setFont(QFont("Arial", 12, QFont.Bold))
-            # rect = pixmap.rect()
-            # painter.drawText(rect, Qt.AlignCenter, str(text))
-            # painter.end()
+    def on_rules_changed(self, rule_set: list[ItemSequence], height: int) -> None:
+        """
+        Callback for the rule model, the effective rules or height changed.
+        :param rule_set:
+        :param height:
+        :return:
+        """
 
-        label.setPixmap(pixmap)
-        layout.addWidget(label)
+        sequence = self._preset_sequence(rule_set, height)
+        if sequence:
+            seed, buffer = sequence
+            self.load_buffer(rule_set, buffer, 0, seed)
+        else:
+            self._generate_buffer()
 
-    def on_values_changed(self, widget: ItemParameterWidget):
+    def _generate_buffer(self, *args) -> None:
         """
-        Callback method for any items widget values changed.
-        :param widget:
+        Build the buffer and update the UI with new values.
+        :param args:
         :return:
         """
 
-        self._generate_buffer()
+        self.setup_sequence_worker()
 
-    def display_item_requirments(self):
+        # Define new rule set
+        rule_set = self.build_rule()
+        max_length = self.ui.max_height_spinbox.value()
+        self._reset_buffer(rule_set, random.randrange(2**32))
 
-        while self.ui.required_layout.count():
-            item = self.ui.required_layout.takeAt(0)
-            widget = item.widget()
-            if widget:
-                widget.deleteLater()
+        # Only start the engine on rules it can finish
+        diagnostics = analyze(rule_set, self.palette, max_length)
+        self.show_diagnostics(diagnostics)
+        if errors(diagnostics):
+            self.ui.progress.setRange(0, 0)
+            self.update_displays()
+            return
 
-        # Re order to match counts with UI order
-        key_order = [item.item_name for item in self._item_widgets]
-        ordered_by_value = OrderedDict(
-            (key, self._block_counts[key])
-            for key in key_order
-            if key in self._block_counts
+        # Start the processing on thread
+        self.block_sequence.set_params(
+            rule_set, max_length, self._seed, self._gradient(rule_set)
         )
 
-        for k, count in ordered_by_value.items():
-            item_path = self.palette.get(k)
-            percent = int((count / len(self.buffer)) * 100)
+        self.block_sequence_thread.start()
 
-            whole = count // 64
-            remainder = count % 64
-            stack = f"{whole} Stacks"
-            if whole == 1:
-                stack = f"{whole} Stack"
+        self.ui.progress.setRange(0, len(self.buffer))
 
-            text = [stack, f"& {remainder}", f"{percent}%"]
-            self.add_item_to_preview(
-                item_path, image_size=64, layout=self.ui.required_layout, text=text
-            )
+        self.update_displays()
 
-    def _generate_buffer(self, *args) -> None:
+    def _reset_buffer(self, rule_set: list[ItemSequence], seed: int | None) -> None:
         """
-        Build the buffer and update the UI with new values.
-        :param args:
+        Clear the buffer, previews and cursor for a new rule set.
+        :param rule_set:
+        :param seed:
         :return:
         """
 
-        self.setup_sequence_worker()
-
-        # Reset the buffers and previews
         self.clear_preview()
+        # Moves on the new buffer are journaled once it's complete and saved
+        self.journal.suspend()
         self.buffer = []
+        self.cursor.reset()
+        self._buffer_complete = False
+        self._rule_set = rule_set
+        self._seed = seed
+        self._key_map = {
+            item.item_name: KeyBinding(item.page, int(item.bound_key) - 1)
+            for item in rule_set
+        }
+        self._cursor_page = 0
+        self._publish_buffer("reset")
+        self.metrics = SequenceMetrics(rule_set)
+        self.ui.metrics_label.clear()
+        self.ui.required_widget.reset([item.item_name for item in rule_set])
+
+    def load_buffer(
+        self,
+        rule_set: list[ItemSequence],
+        buffer: list[str],
+        cursor: int = 0,
+        seed: int | None = None,
+    ) -> None:
+        """
+        Show an already generated buffer without running the generator.
+        :param rule_set: Rules the buffer was generated with.
+        :param buffer:
+        :param cursor:
+        :param seed:
+        :return:
+        """
 
-        print(self._block_counts)
-        self._block_counts = defaultdict(int)
+        self.setup_sequence_worker()
+        self._reset_buffer(rule_set, seed)
+
+        self.buffer = list(buffer)
+        for item in self.buffer:
+            self._append_key(item)
+        for item in self.buffer:
+            self.add_item_to_preview(item)
+        self.ui.required_widget.set_counts(Counter(self.buffer))
+        self.show_diagnostics(
+            analyze(rule_set, self.palette, self.ui.max_height_spinbox.value())
+        )
+        self.metrics = buffer_metrics(self.buffer, rule_set)
+        self.update_metrics_display()
+        self._buffer_complete = True
 
-        # Define new rule set
-        rule_set = self.build_rule()
-        max_length = self.ui.max_height_spinbox.value()
+        self._current_index = min(cursor, len(self.buffer))
+        self.ui.progress.setRange(0, len(self.buffer))
+        self.update_displays()
+        self.update_overlay()
+        self.save_session()
 
-        # Start the processing on thread
-        self.block_sequence.set_params(rule_set, max_length)
+    def _resume_session(self) -> bool:
+        """
+        Load the last session's buffer and cursor if it was generated with
+        the current rules.
+        :return: True if resumed.
+        """
 
-        self.block_sequence_thread.start()
+        session = load_session()
+        rule_set = self.build_rule()
+        if not session or not session.matches(
+            rule_set, self.ui.max_height_spinbox.value()
+        ):
+            return False
+
+        # The journal has the moves since the session was last saved
+        cursor = replay(session)
+        if cursor is None:
+            cursor = session.cursor
+        self.load_buffer(rule_set, session.buffer_names(), cursor, session.seed)
+        print(
+            "Resumed session at %s/%s, saved at %s"
+            % (cursor, len(self.buffer), session.cursor)
+        )
+        return True
 
-        self._current_index = 0
-        self.ui.progress.setRange(0, len(self.buffer))
+    def save_session(self) -> None:
+        """
+        Save the compiled rules, buffer and cursor, only complete buffers
+        are saved.
+        :return:
+        """
 
-        self.update_displays()
+        if not self._buffer_complete:
+            return
+        session = Session.from_buffer(
+            self._rule_set,
+            self.ui.max_height_spinbox.value(),
+            self._seed,
+            self.buffer,
+            self._current_index,
+        )
+        try:
+            save_session(session)
+        except OSError as e:
+            print("Could not save session: %s" % e)
+            return
+        # The session has the cursor now, the journal starts again from it
+        self.journal.begin(session)
 
     def build_rule(self) -> list[int]:
         """
@@ -523,27 +1640,38 @@ class RandomKeyDialog(QMainWindow):
 
         items_list = []
 
-        for x, item_widget in enumerate(self._item_widgets):
-            if not item_widget.is_active:
+        for index, values in enumerate(self._item_values):
+            if not values["enabled"]:
                 continue
 
-            item_name = item_widget.item_name
-            min_count = item_widget.min_amount.value()
-            max_count = item_widget.max_amount.value()
-            no_next = [avoid for avoid in item_widget.no_next.text().split(",")]
+            binding = binding_for(index)
+            no_next = [
+                avoid.strip() for avoid in values["avoids"].split(",") if avoid.strip()
+            ]
+            quota = values["quota"] * (STACK_SIZE if values["quota_stacks"] else 1)
 
             item = ItemSequence(
-                item_name,
-                item_widget._key,
-                item_widget.slider.value(),
-                max_count,
-                min_count,
+                values["item"],
+                binding.key,
+                values["slider"],
+                values["max"],
+                values["min"],
                 no_next,
+                binding.page,
+                quota,
             )
             items_list.append(item)
 
         return items_list
 
+    @property
+    def _current_index(self) -> int:
+        return self.cursor.index
+
+    @_current_index.setter
+    def _current_index(self, value: int) -> None:
+        self.cursor.set_index(value)
+
     @property
     def last_item(self) -> (str, int):
 
@@ -568,107 +1696,158 @@ class RandomKeyDialog(QMainWindow):
         else:
             return self.buffer[self._current_index + 1]
 
+    def show_diagnostics(self, diagnostics: list[Diagnostic]) -> None:
+        """
+        Show the rule analyzers errors and warnings, hidden when there are
+        none.
+        :param diagnostics:
+        :return:
+        """
+
+        lines = []
+        for diagnostic in diagnostics:
+            color = "#e06c6c" if diagnostic.severity == ERROR else "#e0b050"
+            lines.append(
+                '<span style="color:%s">%s</span>'
+                % (color, html.escape(str(diagnostic)))
+            )
+        self.ui.diagnostics_label.setText("<br>".join(lines))
+        self.ui.form_layout.setRowVisible(self.ui.diagnostics_label, bool(lines))
+
+    def _blocked_by_errors(
+        self, rule_set: list[ItemSequence], title: str, text: str
+    ) -> bool:
+        """
+        Analyze a rule set as generating does and show its diagnostics. Any
+        errors are listed in a message box too, as the action is blocked.
+        :param rule_set:
+        :param title: Message box title
+        :param text: What the errors block, shown above them
+        :return: Whether there were errors
+        """
+        diagnostics = analyze(
+            rule_set, self.palette, self.ui.max_height_spinbox.value()
+        )
+        self.show_diagnostics(diagnostics)
+        blocking = errors(diagnostics)
+        if blocking:
+            QMessageBox.warning(
+                self, title, "\n".join([text] + [str(d) for d in blocking])
+            )
+        return bool(blocking)
+
+    def update_metrics_display(self) -> None:
+        """
+        Show the buffers quality metrics, per item details in the tooltip.
+        :return:
+        """
+
+        self.ui.metrics_label.setText(self.metrics.text())
+
+        runs = self.metrics.runs()
+        lines = ["Item: share / Prob share, mean run"]
+        for name, (actual, expected) in sorted(self.metrics.proportions().items()):
+            lengths = runs.get(name)
+            mean_run = (
+                sum(k * v for k, v in lengths.items()) / sum(lengths.values())
+                if lengths
+                else 0.0
+            )
+            lines.append(
+                "%s: %.1f%% / %.1f%%, %.1f"
+                % (name, actual * 100, expected * 100, mean_run)
+            )
+        self.ui.metrics_label.setToolTip("\n".join(lines))
+
+    @traced("update_displays", "ui")
     def update_displays(self) -> None:
 
         current_item = self.current_item
         next_item = self.next_item
 
-        icon = QIcon(self.palette.get(current_item))
-        pixmap = icon.pixmap(32, 32)
+        pixmap = self.palette.pixmap(current_item, 32)
 
         if current_item == next_item:
             self.ui.current_key.setPixmap(pixmap)
             self.ui.next_key.setPixmap(pixmap)
         else:
-            next_icon = QIcon(self.palette.get(next_item))
-            next_pixmap = next_icon.pixmap(32, 32)
+            next_pixmap = self.palette.pixmap(next_item, 32)
 
             self.ui.current_key.setPixmap(pixmap)
             self.ui.next_key.setPixmap(next_pixmap)
 
         self.ui.progress.setValue(self._current_index)
+        self.ui.required_widget.set_cursor(self._current_index, self.buffer)
 
-    def on_click(self, x: int, y: int, button: mouse.Button, pressed: bool) -> None:
+    def on_place(self) -> None:
         """
-        Event callback from mouse listener
-        :param x:
-        :param y:
-        :param button:
-        :param pressed:
+        Event callback from the input listener when an item was placed
+        (right click released).
         :return:
         """
 
-        if not pressed and button == mouse.Button.right and self.active:
-            self.increment_buffer()
-            self.update_overlay()
+        start = time.perf_counter_ns() if self.latency.enabled else 0
 
-    def increment_buffer(self) -> None:
+        if self._click_recorder is not None:
+            self._click_recorder.times.append(time.perf_counter_ns())
+
+        if self.active:
+            self.increment_buffer(start)
+
+    def increment_buffer(self, start: int = 0) -> None:
         """
         Triggered when a right click has been registered, Increment the current
-        index in the buffer. Update the displays
+        index in the buffer and press its key. Runs on the listener thread, the
+        displays are refreshed later on the GUI thread.
 
+        :param start: perf_counter_ns of the mouse event when measuring latency
         :return:
         """
 
-        self._current_index += 1
-
-        if self._current_index > len(self.buffer) - 1:
-            pass
-        else:
-            key = self.get_key_for_item(self.buffer[self._current_index])
+        index, key = self.cursor.advance()
+        if start:
+            self.latency.record("advance", start)
+        if key is not None:
             self.simulate_keypress(key)
-        self.update_displays()
+            if start:
+                self.latency.record("keypress", start)
+        self.journal.record(index)
+        if start:
+            self.latency.mark_pending(start)
+        self.request_refresh()
+
+    def request_refresh(self) -> None:
+        """
+        Ask the GUI thread to refresh the displays, any number of requests
+        before it gets to it result in a single refresh.
+        :return:
+        """
 
-    def get_key_for_item(self, item: str) -> str | None:
-        for i in self._item_widgets:
-            if i.item_name == item:
-                return str(i._key)
-        return None
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            self.cursor_moved.emit()
 
-    @staticmethod
-    def simulate_keypress(key: str) -> None:
+    def on_cursor_moved(self) -> None:
+        """
+        Callback on the GUI thread after the cursor moved.
+        :return:
+        """
+
+        self._refresh_pending = False
+        self.update_displays()
+        self.update_overlay()
+        if self.control_server:
+            index = self.cursor.index
+            self.control_server.publish(
+                "cursor", **self._api_position(index, self.cursor.key_at(index))
+            )
+        if self.latency.enabled:
+            self.latency.record_pending("ui")
+
+    def simulate_keypress(self, key: str) -> None:
         """
         Presses a key on the keyboard.
         :param key:
         :return:
         """
-        keyboard.press(key)
-        keyboard.release(key)
-
-
-def draw_text_with_outline_on_pixmap(
-    pixmap,
-    text,
-    pos=(20, 50),
-    font=QFont("Arial", 20, QFont.Bold),
-    text_color="white",
-    outline_color="black",
-    outline_width=2,
-    shadow_offset=(2, 2),
-    shadow_color="gray",
-):
-    painter = QPainter(pixmap)
-    painter.setRenderHint(QPainter.Antialiasing)
-    painter.setFont(font)
-
-    x, y = pos
-    path = QPainterPath()
-    path.addText(QPointF(x, y), font, text)
-
-    # Draw shadow
-    painter.setPen(QColor(shadow_color))
-    painter.drawText(x + shadow_offset[0], y + shadow_offset[1], text)
-
-    # Draw outline using QPen
-    outline_pen = QPen(QColor(outline_color))
-    outline_pen.setWidth(outline_width)
-    painter.setPen(outline_pen)
-    painter.setBrush(Qt.NoBrush)
-    painter.drawPath(path)
-
-    # Draw text fill
-    painter.setPen(QColor(text_color))
-    painter.drawText(x, y, text)
-
-    painter.end()
-    return pixmap
+        self.key_sink.press(key)
@@ -0,0 +1,292 @@
+"""
+Export sequences to files Minecraft tools can place.
+
+A sequence is one column of blocks, a plan is several columns side by side
+making a wall along X. Columns are pulled a row at a time, so a plan only
+ever holds one row and the writers stream each row to the file as it comes,
+a 256 x 2048 wall exports in the memory of 256 blocks.
+
++ Sponge schematic v2 (.schem), gzipped NBT as read by WorldEdit and most
+  other tools. The NBT is written tag by tag rather than built as a tree.
++ Function (.mcfunction), setblock and fill commands relative to where it's
+  run from.
+"""
+
+import gzip
+import itertools
+import random
+import shutil
+import struct
+import tempfile
+
+from PySide6.QtCore import QObject, Signal
+
+from .sequences import BlockSequence, ItemSequence
+from .storage import atomic_open
+from .tracing import traced
+
+AIR = "minecraft:air"
+
+# Minecraft 1.21
+DATA_VERSION = 3953
+
+_TAG_END = 0
+_TAG_SHORT = 2
+_TAG_INT = 3
+_TAG_BYTE_ARRAY = 7
+_TAG_STRING = 8
+_TAG_COMPOUND = 10
+_TAG_INT_ARRAY = 11
+
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+class NbtStream:
+    """
+    Writes NBT tags straight to a file.
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def _name(self, tag: int, name: str) -> None:
+        data = name.encode("utf-8")
+        self.f.write(struct.pack(">BH", tag, len(data)) + data)
+
+    def begin_compound(self, name: str) -> None:
+        self._name(_TAG_COMPOUND, name)
+
+    def end_compound(self) -> None:
+        self.f.write(bytes((_TAG_END,)))
+
+    def short(self, name: str, value: int) -> None:
+        self._name(_TAG_SHORT, name)
+        # Sponge sizes are unsigned shorts
+        self.f.write(struct.pack(">H", value))
+
+    def int(self, name: str, value: int) -> None:
+        self._name(_TAG_INT, name)
+        self.f.write(struct.pack(">i", value))
+
+    def string(self, name: str, value: str) -> None:
+        self._name(_TAG_STRING, name)
+        data = value.encode("utf-8")
+        self.f.write(struct.pack(">H", len(data)) + data)
+
+    def int_array(self, name: str, values: list[int]) -> None:
+        self._name(_TAG_INT_ARRAY, name)
+        self.f.write(struct.pack(">i%di" % len(values), len(values), *values))
+
+    def begin_byte_array(self, name: str, length: int) -> None:
+        """
+        Start a byte array, the caller writes length bytes after.
+        :param name:
+        :param length:
+        :return:
+        """
+        self._name(_TAG_BYTE_ARRAY, name)
+        self.f.write(struct.pack(">i", length))
+
+
+def plan_rows(columns, height: int):
+    """
+    Rows of a plan from the bottom up, columns that end early are padded
+    with None (air). Rows stop once every column has ended.
+    :param columns: Iterators of item names, one per column
+    :param height:
+    :return: Iterator of rows, a list of item names per row
+    """
+    rows = itertools.zip_longest(*columns, fillvalue=None)
+    for row in itertools.islice(rows, height):
+        yield list(row)
+
+
+def sequence_rows(buffer: list[str]):
+    """
+    Rows of a single column sequence.
+    :param buffer:
+    :return:
+    """
+    for item in buffer:
+        yield [item]
+
+
+def plan_columns(
+    rules: list[ItemSequence],
+    height: int,
+    columns: int,
+    seed: int | None = None,
+    gradient=None,
+):
+    """
+    Generators of the columns of a plan, each seeded from seed so a plan is
+    reproducible. Limits apply to each column.
+    :param rules:
+    :param height:
+    :param columns:
+    :param seed:
+    :param gradient: See BlockSequence.set_params
+    :return:
+    """
+    rng = random.Random(seed)
+    generators = []
+    for _ in range(columns):
+        sequence = BlockSequence()
+        sequence.set_params(rules, height, rng.randrange(2**32), gradient)
+        generators.append(sequence.generate())
+    return generators
+
+
+@traced("write_schematic", "export")
+def write_schematic(
+    path: str,
+    rows,
+    width: int,
+    height: int,
+    ids: dict[str, str],
+    progress=None,
+) -> None:
+    """
+    Stream rows to a Sponge schematic. The block palette is known up front
+    from ids, so with fewer than 128 blocks each block is one byte and the
+    block data length is width x height, otherwise the data is spooled to a
+    temp file to measure it first.
+    :param path:
+    :param rows: From plan_rows or sequence_rows
+    :param width:
+    :param height:
+    :param ids: Item name to block id
+    :param progress: Called with the number of rows written
+    :return:
+    """
+    palette = {AIR: 0}
+    for block in ids.values():
+        palette.setdefault(block, len(palette))
+    codes = {None: varint(0)}
+    codes.update({name: varint(palette[block]) for name, block in ids.items()})
+
+    def encode(row: list) -> bytes:
+        row = row + [None] * (width - len(row))
+        return b"".join(codes.get(item, codes[None]) for item in row)
+
+    with atomic_open(path) as f, gzip.GzipFile(fileobj=f, mode="wb") as out:
+        nbt = NbtStream(out)
+        nbt.begin_compound("Schematic")
+        nbt.int("Version", 2)
+        nbt.int("DataVersion", DATA_VERSION)
+        nbt.short("Width", width)
+        nbt.short("Height", height)
+        nbt.short("Length", 1)
+        nbt.int_array("Offset", [0, 0, 0])
+
+        nbt.int("PaletteMax", len(palette))
+        nbt.begin_compound("Palette")
+        for block, index in palette.items():
+            nbt.int(block, index)
+        nbt.end_compound()
+
+        # Blocks are ordered x fastest, then z, then y, so a row at a time
+        written = 0
+        if len(palette) <= 128:
+            nbt.begin_byte_array("BlockData", width * height)
+            for row in rows:
+                out.write(encode(row))
+                written += 1
+                if progress:
+                    progress(written)
+            # Rows the columns didn't fill are air
+            out.write(codes[None] * (width * (height - written)))
+        else:
+            with tempfile.TemporaryFile() as spool:
+                for row in rows:
+                    spool.write(encode(row))
+                    written += 1
+                    if progress:
+                        progress(written)
+                spool.write(codes[None] * (width * (height - written)))
+                nbt.begin_byte_array("BlockData", spool.tell())
+                spool.seek(0)
+                shutil.copyfileobj(spool, out)
+
+        nbt.end_compound()
+
+
+@traced("write_mcfunction", "export")
+def write_mcfunction(path: str, rows, ids: dict[str, str], progress=None) -> None:
+    """
+    Stream rows to a function, runs of the same block along a row are one
+    fill command.
+    :param path:
+    :param rows: From plan_rows or sequence_rows
+    :param ids: Item name to block id
+    :param progress: Called with the number of rows written
+    :return:
+    """
+    with atomic_open(path) as f:
+        for y, row in enumerate(rows):
+            lines = []
+            x = 0
+            for item, run in itertools.groupby(row):
+                count = len(list(run))
+                if item is not None:
+                    block = ids.get(item, AIR)
+                    if count == 1:
+                        lines.append("setblock ~%d ~%d ~ %s\n" % (x, y, block))
+                    else:
+                        lines.append(
+                            "fill ~%d ~%d ~ ~%d ~%d ~ %s\n"
+                            % (x, y, x + count - 1, y, block)
+                        )
+                x += count
+            f.write("".join(lines).encode("utf-8"))
+            if progress:
+                progress(y + 1)
+
+
+class ExportWorker(QObject):
+    """
+    Writes an export in thread.
+    """
+
+    progress = Signal(int)
+    """Rows written"""
+    finished = Signal(str)
+    """Path written"""
+    failed = Signal(str)
+
+    def __init__(self, path: str, rows, width: int, height: int, ids: dict[str, str]):
+        super().__init__()
+
+        self.path = path
+        self.rows = rows
+        self.width = width
+        self.height = height
+        self.ids = ids
+
+    def run(self) -> None:
+        try:
+            if self.path.lower().endswith(".mcfunction"):
+                write_mcfunction(self.path, self.rows, self.ids, self.progress.emit)
+            else:
+                write_schematic(
+                    self.path,
+                    self.rows,
+                    self.width,
+                    self.height,
+                    self.ids,
+                    self.progress.emit,
+                )
+        except OSError as e:
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(self.path)
@@ -0,0 +1,243 @@
+"""
+Input and output backends for the click to keypress path.
+
+Input backends deliver "place" events (right click released) and global
+hotkeys, key sinks press the hotbar keys. The live backends wrap pynput and
+keyboard, the replay backend and fake sink run headless so the path can be
+tested and benchmarked without a desktop session.
+"""
+
+import threading
+import time
+from typing import Callable
+
+TRACE_HEADER = "# random-key click trace v1"
+
+
+class InputSource:
+    """
+    Delivers place events to a callback until stopped.
+    """
+
+    def __init__(self, on_place: Callable[[], None]):
+        self.on_place = on_place
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class InputBackend:
+    """
+    Creates input sources and registers hotkeys.
+    """
+
+    def listener(self, on_place: Callable[[], None]) -> InputSource:
+        raise NotImplementedError
+
+    def add_hotkey(self, hotkey: str, callback: Callable[[], None]) -> None:
+        raise NotImplementedError
+
+
+class KeySink:
+    """
+    Sends hotbar key presses. Keys are in the keyboard module's hotkey
+    format, a page switch is sent as steps e.g. "c+2, 3".
+    """
+
+    def press(self, key: str) -> None:
+        raise NotImplementedError
+
+
+# Live backends
+class PynputInputSource(InputSource):
+    def __init__(self, on_place: Callable[[], None]):
+        super().__init__(on_place)
+        from pynput import mouse
+
+        self._right = mouse.Button.right
+        self._listener = mouse.Listener(on_click=self.on_click)
+
+    def on_click(self, x: int, y: int, button, pressed: bool) -> None:
+        if not pressed and button == self._right:
+            self.on_place()
+
+    def start(self) -> None:
+        self._listener.start()
+
+    def stop(self) -> None:
+        self._listener.stop()
+
+
+class PynputInputBackend(InputBackend):
+    """
+    Mouse events from pynput, hotkeys from the keyboard module.
+    """
+
+    def listener(self, on_place: Callable[[], None]) -> InputSource:
+        return PynputInputSource(on_place)
+
+    def add_hotkey(self, hotkey: str, callback: Callable[[], None]) -> None:
+        import keyboard
+
+        keyboard.add_hotkey(hotkey, callback)
+
+
+class KeyboardSink(KeySink):
+    def __init__(self):
+        import keyboard
+
+        self._keyboard = keyboard
+
+    def press(self, key: str) -> None:
+        # send presses and releases each step of e.g. "c+2, 3" in turn
+        self._keyboard.send(key)
+
+
+# Headless backends
+class FakeKeySink(KeySink):
+    """
+    Records pressed keys with a perf_counter_ns timestamp.
+    """
+
+    def __init__(self):
+        self.keys: list[str] = []
+        self.times: list[int] = []
+        self._lock = threading.Lock()
+
+    def press(self, key: str) -> None:
+        now = time.perf_counter_ns()
+        with self._lock:
+            self.keys.append(key)
+            self.times.append(now)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.keys = []
+            self.times = []
+
+
+class ReplayInputSource(InputSource):
+    """
+    Feeds a click trace to the callback from its own thread, keeping to the
+    trace's timing. Lateness of each event against its schedule is kept in
+    `lateness` (ns).
+    """
+
+    def __init__(self, on_place: Callable[[], None], trace: list[int], speed=1.0):
+        super().__init__(on_place)
+        self.trace = trace
+        self.speed = speed
+        self.sent = 0
+        self.lateness: list[int] = []
+        self.finished = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.finished.wait(timeout)
+
+    def _run(self) -> None:
+        start = time.perf_counter_ns()
+        for offset in self.trace:
+            if self._stop_event.is_set():
+                break
+            due = start + int(offset / self.speed)
+            remaining = due - time.perf_counter_ns()
+            # Sleep most of the wait, spin the last ms for accuracy
+            if remaining > 2_000_000:
+                time.sleep((remaining - 1_000_000) / 1e9)
+            while time.perf_counter_ns() < due:
+                pass
+            self.lateness.append(time.perf_counter_ns() - due)
+            self.on_place()
+            self.sent += 1
+        self.finished.set()
+
+
+class ReplayInputBackend(InputBackend):
+    """
+    Input backend replaying a click trace, hotkeys are triggered by hand.
+    """
+
+    def __init__(self, trace: list[int], speed: float = 1.0):
+        self.trace = trace
+        self.speed = speed
+        self.sources: list[ReplayInputSource] = []
+        self.hotkeys: dict[str, Callable[[], None]] = {}
+
+    def listener(self, on_place: Callable[[], None]) -> ReplayInputSource:
+        source = ReplayInputSource(on_place, self.trace, self.speed)
+        self.sources.append(source)
+        return source
+
+    def add_hotkey(self, hotkey: str, callback: Callable[[], None]) -> None:
+        self.hotkeys[hotkey] = callback
+
+    def trigger_hotkey(self, hotkey: str) -> None:
+        self.hotkeys[hotkey]()
+
+
+# Traces
+class ClickRecorder:
+    """
+    Records the timing of place events, the dialog appends to times from its
+    place callback while recording.
+    """
+
+    def __init__(self):
+        self.times: list[int] = []
+
+    def trace(self) -> list[int]:
+        if not self.times:
+            return []
+        first = self.times[0]
+        return [t - first for t in self.times]
+
+    def save(self, path: str) -> None:
+        save_trace(path, self.trace())
+
+
+def save_trace(path: str, trace: list[int]) -> None:
+    """
+    Write a click trace, one ns offset from the first click per line.
+    :param path:
+    :param trace:
+    :return:
+    """
+    with open(path, "w") as f:
+        f.write(TRACE_HEADER + "\n")
+        f.writelines("%d\n" % offset for offset in trace)
+
+
+def load_trace(path: str) -> list[int]:
+    with open(path) as f:
+        return [int(line) for line in f if line.strip() and not line.startswith("#")]
+
+
+def synthetic_trace(clicks: int, rate: float, jitter: float = 0.0) -> list[int]:
+    """
+    Evenly spaced clicks at rate per second, with optional random jitter as
+    a fraction of the interval.
+    :param clicks:
+    :param rate:
+    :param jitter:
+    :return:
+    """
+    import random
+
+    interval = 1e9 / rate
+    trace = []
+    for i in range(clicks):
+        offset = i * interval + random.uniform(-jitter, jitter) * interval
+        trace.append(max(0, int(offset)))
+    trace.sort()
+    return trace
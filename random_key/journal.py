@@ -0,0 +1,294 @@
+"""
+Append only journal of cursor moves, so a crash of the app or the game
+mid build doesn't lose the place. The session only holds the cursor it was
+last saved with, the journal holds every move since.
+
+The file is a header naming the session's buffer followed by fixed size
+records, each the new index, the id of the item there, the time and a
+check of the record:
+
+    header  "RKJ" version u8, buffer fingerprint u32, start time f64,
+            start index u32
+    record  index u32, ms since start u32, item id u16, check u16
+
+Moves are queued by record(), from any thread, without touching the file.
+A writer thread writes the queue in batches and fsyncs them by policy. A
+crash can lose the last unwritten batch and leave a torn record at the end,
+replay stops at the first record that doesn't check out. Saving the
+session starts a new journal from the saved cursor, and a journal that
+grows long is compacted to its last record. A new buffer suspends the
+journal, moves on it aren't written until its session is saved and starts
+a journal with its fingerprint.
+"""
+
+import collections
+import os
+import struct
+import threading
+import time
+import zlib
+
+from .session import Session, pack_ids
+from .storage import atomic_write, data_dir
+
+JOURNAL_VERSION = 1
+MAGIC = b"RKJ"
+
+_HEADER = struct.Struct("<3sBIdI")
+_RECORD = struct.Struct("<IIHH")
+# The part of a record its check covers
+_BODY = struct.Struct("<IIH")
+
+# Item id of positions past the end of the buffer
+PAST_END = 0xFFFF
+
+FSYNC_ALWAYS = "always"
+"""Every batch"""
+FSYNC_INTERVAL = "interval"
+"""At most once a sync interval"""
+FSYNC_NEVER = "never"
+"""When the OS gets to it"""
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+# Records before the journal is compacted
+COMPACT_RECORDS = 4096
+
+
+def journal_path() -> str:
+    return os.path.join(data_dir(), "session.journal")
+
+
+def fingerprint(session: Session) -> int:
+    """
+    Identifies the buffer of a session, a journal only replays onto it.
+    :param session:
+    :return:
+    """
+    data = pack_ids(session.buffer) + repr(
+        (session.items, session.length, session.seed)
+    ).encode("utf-8")
+    return zlib.crc32(data)
+
+
+def _check(body: bytes) -> int:
+    return zlib.crc32(body) & 0xFFFF
+
+
+def pack_record(index: int, ms: int, item: int) -> bytes:
+    body = _BODY.pack(index, ms, item)
+    return body + struct.pack("<H", _check(body))
+
+
+def replay(session: Session, path: str | None = None) -> int | None:
+    """
+    The cursor the journal ends at.
+    :param session: The journal is ignored unless it was written for this
+        session's buffer
+    :param path:
+    :return: None if there's no journal for the session
+    """
+    try:
+        with open(path or journal_path(), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    magic, version, buffer, _, cursor = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != JOURNAL_VERSION or buffer != fingerprint(session):
+        return None
+
+    ids = session.buffer
+    end = _HEADER.size + (len(data) - _HEADER.size) // _RECORD.size * _RECORD.size
+    for index, ms, item, check in _RECORD.iter_unpack(
+        memoryview(data)[_HEADER.size : end]
+    ):
+        expected = ids[index] if index < len(ids) else PAST_END
+        if item != expected or check != _check(_BODY.pack(index, ms, item)):
+            # Torn or stale from here on
+            break
+        cursor = index
+    return min(cursor, len(ids))
+
+
+class Journal:
+    """
+    Writes cursor moves to the journal from its own thread.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        fsync: str = FSYNC_INTERVAL,
+        interval: float = 0.1,
+        sync_interval: float = 1.0,
+        compact_records: int = COMPACT_RECORDS,
+    ):
+        """
+        :param path:
+        :param fsync: One of FSYNC_POLICIES
+        :param interval: Seconds between batches
+        :param sync_interval: Seconds between fsyncs with FSYNC_INTERVAL
+        :param compact_records: Records kept before compacting
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("fsync must be one of %s" % ", ".join(FSYNC_POLICIES))
+        self.path = path
+        self.fsync = fsync
+        self.interval = interval
+        self.sync_interval = sync_interval
+        self.compact_records = compact_records
+
+        # deque appends and pops are thread safe, the hot path takes no lock
+        self._pending: collections.deque = collections.deque()
+        self._lock = threading.Lock()
+        self._file = None
+        self._ids: list[int] = []
+        self._start = 0.0
+        self._records = 0
+        self._last = b""
+        self._header = b""
+        self._synced = 0.0
+        self._dirty = False
+        self._closing = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def record(self, index: int) -> None:
+        """
+        Queue a cursor move, safe to call from any thread.
+        :param index: The new cursor
+        :return:
+        """
+        self._pending.append((index, time.time()))
+
+    def begin(self, session: Session) -> None:
+        """
+        Start a new journal for a session that was just saved, moves queued
+        before are written to the old one.
+        :param session:
+        :return:
+        """
+        with self._lock:
+            self._write_pending()
+            self._close_file()
+            self._ids = list(session.buffer)
+            self._start = time.time()
+            self._header = _HEADER.pack(
+                MAGIC,
+                JOURNAL_VERSION,
+                fingerprint(session),
+                self._start,
+                session.cursor,
+            )
+            self._last = b""
+            self._records = 0
+            self._open(self._header)
+        if self._thread is None:
+            self._closing.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="journal", daemon=True
+            )
+            self._thread.start()
+
+    def suspend(self) -> None:
+        """
+        Stop writing moves until the next begin, for a buffer that's being
+        replaced. Moves queued before are written to the current journal,
+        later ones are dropped, the new buffer's session saves its cursor.
+        :return:
+        """
+        with self._lock:
+            self._write_pending()
+            self._sync()
+            self._close_file()
+            self._ids = []
+
+    def flush(self) -> None:
+        """
+        Write and fsync the queued moves now.
+        :return:
+        """
+        with self._lock:
+            self._write_pending()
+            self._sync()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._closing.set()
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._write_pending()
+            self._sync()
+            self._close_file()
+
+    # Writer thread
+    def _run(self) -> None:
+        while not self._closing.wait(self.interval):
+            with self._lock:
+                self._write_pending()
+                if self.fsync == FSYNC_ALWAYS or (
+                    self.fsync == FSYNC_INTERVAL
+                    and time.monotonic() - self._synced >= self.sync_interval
+                ):
+                    self._sync()
+                if self._records >= self.compact_records:
+                    self._compact()
+
+    def _write_pending(self) -> None:
+        pending = self._pending
+        if not pending:
+            return
+        ids = self._ids
+        records = []
+        while pending:
+            index, when = pending.popleft()
+            item = ids[index] if index < len(ids) else PAST_END
+            ms = min(max(0, int((when - self._start) * 1000)), 0xFFFFFFFF)
+            records.append(pack_record(index, ms, item))
+        if self._file is None:
+            return
+        data = b"".join(records)
+        try:
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            print("Could not write journal: %s" % e)
+            return
+        self._records += len(records)
+        self._last = records[-1]
+        self._dirty = True
+
+    def _sync(self) -> None:
+        self._synced = time.monotonic()
+        if self._file is None or not self._dirty or self.fsync == FSYNC_NEVER:
+            return
+        try:
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            print("Could not sync journal: %s" % e)
+        self._dirty = False
+
+    def _compact(self) -> None:
+        """
+        Replace the journal with its header and last record.
+        :return:
+        """
+        self._close_file()
+        self._records = 1
+        self._open(self._header + self._last)
+
+    def _open(self, data: bytes) -> None:
+        path = self.path or journal_path()
+        try:
+            atomic_write(path, data)
+            self._file = open(path, "ab")
+        except OSError as e:
+            print("Could not start journal: %s" % e)
+            self._file = None
+        self._dirty = False
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,51 @@
+"""
+Maps items to hotbar slots. The first HOTBAR_SIZE items are on the first
+page and bound to keys 1-9, with more items the rest are spread over saved
+hotbars and moving to an item on another page first sends that page's chord.
+"""
+
+from dataclasses import dataclass
+
+from .constants import HOTBAR_SIZE, PAGE_CHORD
+
+
+@dataclass(frozen=True)
+class KeyBinding:
+    page: int
+    slot: int
+
+    @property
+    def key(self) -> str:
+        return str(self.slot + 1)
+
+    def label(self, paged: bool = False) -> str:
+        if paged:
+            return "Page %d Key %s" % (self.page + 1, self.key)
+        return "Key %s" % self.key
+
+
+def binding_for(index: int) -> KeyBinding:
+    page, slot = divmod(index, HOTBAR_SIZE)
+    return KeyBinding(page, slot)
+
+
+class KeyMap:
+    """
+    Keys sent to move onto an item, given the page the previous item was on.
+    """
+
+    def __init__(self, page_chord: str = PAGE_CHORD):
+        self.page_chord = page_chord
+
+    def page_key(self, page: int) -> str:
+        return self.page_chord.format(page=page + 1)
+
+    def keys(self, binding: KeyBinding, page: int) -> str:
+        """
+        :param binding: Item moved onto
+        :param page: Page currently loaded
+        :return: Key, or page chord and key as keyboard steps
+        """
+        if binding.page == page:
+            return binding.key
+        return "%s, %s" % (self.page_key(binding.page), binding.key)
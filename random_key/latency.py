@@ -0,0 +1,172 @@
+"""
+Latency instrumentation for the click to keypress path.
+
+Each stage records the time since the mouse event was received into a
+log bucketed histogram. Recording is guarded by `enabled` at the call
+site, so when off the cost is a single attribute check per stage.
+"""
+
+import csv
+import threading
+import time
+
+# Stages measured from the mouse event being received in on_click
+STAGES = ("advance", "keypress", "ui")
+
+# Sub buckets per power of two, ~12% bucket width
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_BITS = 40  # ~18 minutes in ns
+
+
+def _bucket(ns: int) -> int:
+    bits = ns.bit_length()
+    if bits <= SUB_BUCKET_BITS:
+        return ns
+    bits = min(bits, MAX_BITS)
+    offset = (ns >> (bits - SUB_BUCKET_BITS - 1)) & (SUB_BUCKETS - 1)
+    return (bits - SUB_BUCKET_BITS) * SUB_BUCKETS + offset
+
+
+def _bucket_bounds(index: int) -> tuple[int, int]:
+    """
+    Lower and upper bound in ns of a bucket.
+    :param index:
+    :return:
+    """
+    if index < SUB_BUCKETS:
+        return index, index + 1
+    bits = index // SUB_BUCKETS + SUB_BUCKET_BITS
+    offset = index % SUB_BUCKETS
+    width = 1 << (bits - SUB_BUCKET_BITS - 1)
+    lower = (SUB_BUCKETS + offset) * width
+    return lower, lower + width
+
+
+class LatencyHistogram:
+    """
+    Fixed size log bucketed histogram of durations in ns.
+    """
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_BITS - SUB_BUCKET_BITS + 1) * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns: int) -> None:
+        self.counts[_bucket(ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def percentile(self, percent: float) -> int:
+        """
+        Upper bound in ns of the bucket holding the percentile.
+        :param percent: 0-100
+        :return:
+        """
+        if not self.count:
+            return 0
+        target = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(_bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def buckets(self):
+        for index, count in enumerate(self.counts):
+            if count:
+                lower, upper = _bucket_bounds(index)
+                yield lower, upper, count
+
+
+class LatencyRecorder:
+    """
+    Histograms per stage of the click to keypress path. Stages are recorded
+    from the listener and GUI threads, a lock guards the histograms and the
+    pending click.
+
+    Call sites check `enabled` before taking timestamps:
+
+        start = time.perf_counter_ns() if recorder.enabled else 0
+        ...
+        if start:
+            recorder.record("advance", start)
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, start: int) -> None:
+        elapsed = time.perf_counter_ns() - start
+        with self._lock:
+            self.histograms[stage].record(elapsed)
+
+    def mark_pending(self, start: int) -> None:
+        """
+        Remember the oldest click not yet shown, UI refreshes are coalesced
+        so the UI stage is measured from it.
+        :param start:
+        :return:
+        """
+        with self._lock:
+            if not self._pending:
+                self._pending = start
+
+    def record_pending(self, stage: str = "ui") -> None:
+        with self._lock:
+            start, self._pending = self._pending, 0
+        if start:
+            self.record(stage, start)
+
+    def reset(self) -> None:
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self._pending = 0
+
+    def summary(self) -> list[tuple]:
+        """
+        :return: [(stage, count, p50, p95, p99, max)] with times in µs
+        """
+        rows = []
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                rows.append(
+                    (
+                        stage,
+                        histogram.count,
+                        histogram.percentile(50) / 1000,
+                        histogram.percentile(95) / 1000,
+                        histogram.percentile(99) / 1000,
+                        histogram.max / 1000,
+                    )
+                )
+        return rows
+
+    def export_csv(self, path: str) -> None:
+        """
+        Write the histogram buckets of every stage.
+        :param path:
+        :return:
+        """
+        with self._lock:
+            rows = [
+                [stage, lower / 1000, upper / 1000, count]
+                for stage, histogram in self.histograms.items()
+                for lower, upper, count in histogram.buckets()
+            ]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage", "lower_us", "upper_us", "count"])
+            writer.writerows(rows)
@@ -0,0 +1,215 @@
+"""
+Quality metrics of a generated sequence against its rules: proportion error
+against Prob, run lengths against Min/Max, Avoid violations, the adjacency
+of items and the entropy of the item distribution.
+
+SequenceMetrics updates in O(1) per item as the sequence streams in,
+buffer_metrics computes the same over a finished buffer in one pass.
+"""
+
+import itertools
+import math
+from collections import Counter, defaultdict
+
+from .avoid_rules import AvoidAutomaton
+from .sequences import ItemSequence
+
+
+class SequenceMetrics:
+    def __init__(self, rules: list[ItemSequence]):
+        self.rules = {rule.item_name: rule for rule in rules}
+        self.avoid_rules = AvoidAutomaton(rules)
+        self._avoids = self.avoid_rules.tracker()
+
+        weights = Counter()
+        for rule in rules:
+            weights[rule.item_name] += rule.probability
+        total = sum(weights.values())
+        self.expected = {
+            name: (weight / total if total else 0.0) for name, weight in weights.items()
+        }
+
+        self.length = 0
+        self.counts = Counter()
+        self.run_lengths: dict[str, Counter] = defaultdict(Counter)
+        self.adjacency = Counter()
+        self.min_violations = 0
+        self.max_violations = 0
+        self.avoid_violations = 0
+
+        self._last: str | None = None
+        self._run = 0
+        self._runs = 0
+        # Sum of c*log(c) over the counts, for the entropy in O(1)
+        self._clogc = 0.0
+
+    def add(self, item: str) -> None:
+        """
+        Add the next item of the sequence.
+        :param item:
+        :return:
+        """
+        count = self.counts[item]
+        if count:
+            self._clogc -= count * math.log(count)
+        self._clogc += (count + 1) * math.log(count + 1)
+        self.counts[item] = count + 1
+        self.length += 1
+        violated = self._avoids.place(self.avoid_rules.index.get(item))
+
+        last = self._last
+        if item == last:
+            self._run += 1
+            self._check_max(item, self._run)
+            return
+
+        if last is not None:
+            self._end_run(last, self._run)
+            self.adjacency[(last, item)] += 1
+            if violated:
+                self.avoid_violations += 1
+        self._last = item
+        self._run = 1
+        self._check_max(item, 1)
+
+    def track(self, items):
+        """
+        Wrap an item iterator, e.g. BlockSequence.generate(), adding each
+        item as it passes through.
+        :param items:
+        :return:
+        """
+        for item in items:
+            self.add(item)
+            yield item
+
+    def _check_max(self, item: str, run: int) -> None:
+        rule = self.rules.get(item)
+        # Count a run once, when it first goes past Max
+        if rule and run == rule.max_entropy + 1:
+            self.max_violations += 1
+
+    def _end_run(self, item: str, run: int) -> None:
+        self.run_lengths[item][run] += 1
+        self._runs += 1
+        rule = self.rules.get(item)
+        if rule and run < rule.min_entropy:
+            self.min_violations += 1
+
+    def runs(self) -> dict[str, Counter]:
+        """
+        Run length histogram per item, including the run still open at the
+        end. The open run isn't checked against Min, it may be cut short.
+        :return:
+        """
+        runs = {item: Counter(lengths) for item, lengths in self.run_lengths.items()}
+        if self._last is not None:
+            runs.setdefault(self._last, Counter())[self._run] += 1
+        return runs
+
+    def proportions(self) -> dict[str, tuple[float, float]]:
+        """
+        :return: Item to (actual, expected) share of the sequence
+        """
+        names = set(self.expected) | set(self.counts)
+        length = self.length or 1
+        return {
+            name: (self.counts[name] / length, self.expected.get(name, 0.0))
+            for name in names
+        }
+
+    def proportion_error(self) -> float:
+        """
+        Largest absolute difference between an items share and its Prob share.
+        :return:
+        """
+        return max(
+            (
+                abs(actual - expected)
+                for actual, expected in self.proportions().values()
+            ),
+            default=0.0,
+        )
+
+    def entropy(self) -> float:
+        """
+        Shannon entropy of the item distribution in bits.
+        :return:
+        """
+        if not self.length:
+            return 0.0
+        n = self.length
+        return max(0.0, (math.log(n) - self._clogc / n) / math.log(2))
+
+    def max_entropy(self) -> float:
+        return math.log2(len(self.expected)) if len(self.expected) > 1 else 0.0
+
+    def mean_run(self) -> float:
+        runs = self._runs + (1 if self._last is not None else 0)
+        return self.length / runs if runs else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "length": self.length,
+            "proportion_error": self.proportion_error(),
+            "proportions": self.proportions(),
+            "mean_run": self.mean_run(),
+            "run_lengths": self.runs(),
+            "min_violations": self.min_violations,
+            "max_violations": self.max_violations,
+            "avoid_violations": self.avoid_violations,
+            "adjacency": dict(self.adjacency),
+            "entropy": self.entropy(),
+            "max_entropy": self.max_entropy(),
+        }
+
+    def text(self) -> str:
+        """
+        One line summary for the UI.
+        :return:
+        """
+        return (
+            "Prob error %.1f%%, runs %.1f, Min/Max/Avoid %d/%d/%d, %.2f/%.2f bits"
+            % (
+                self.proportion_error() * 100,
+                self.mean_run(),
+                self.min_violations,
+                self.max_violations,
+                self.avoid_violations,
+                self.entropy(),
+                self.max_entropy(),
+            )
+        )
+
+
+def buffer_metrics(buffer: list[str], rules: list[ItemSequence]) -> SequenceMetrics:
+    """
+    Metrics of a finished buffer, computed run by run rather than item by
+    item. Gives the same results as adding every item to SequenceMetrics.
+    :param buffer:
+    :param rules:
+    :return:
+    """
+    metrics = SequenceMetrics(rules)
+    if not buffer:
+        return metrics
+
+    metrics.length = len(buffer)
+    metrics.counts = Counter(buffer)
+    metrics._clogc = sum(c * math.log(c) for c in metrics.counts.values())
+
+    runs = [(item, len(list(group))) for item, group in itertools.groupby(buffer)]
+    for item, run in runs[:-1]:
+        metrics._end_run(item, run)
+    for item, run in runs:
+        rule = metrics.rules.get(item)
+        if rule and run > rule.max_entropy:
+            metrics.max_violations += 1
+
+    metrics.adjacency = Counter((a, b) for (a, _), (b, _) in zip(runs, runs[1:]))
+    index = metrics.avoid_rules.index
+    metrics.avoid_violations = sum(
+        metrics._avoids.place(index.get(item), run) for item, run in runs
+    )
+    metrics._last, metrics._run = runs[-1]
+    return metrics
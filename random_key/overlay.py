@@ -1,56 +1,144 @@
-import win32gui
-
 from PySide6.QtWidgets import QWidget
-from PySide6.QtCore import Qt, QTimer, QRect
-from PySide6.QtGui import QPainter, QFont, QColor
+from PySide6.QtCore import Qt, QRect, QPoint
+from PySide6.QtGui import QPainter, QFont, QColor, QFontMetrics, QPixmap, QPen
 
-from window_location import get_window_rect, find_minecraft_window
+from .tracing import traced
+from .window_geometry import WindowGeometryProvider
 
 
 class OverlayWindow(QWidget):
-    def __init__(self, text, hwnd, padding=(20, 30)):
+    """
+    Transparent window kept on top of the game window. Follows the window
+    through a WindowGeometryProvider.
+
+    The text and the icons of the current and upcoming blocks are composited
+    into an offscreen layer whenever they change, paintEvent only blits it.
+    """
+
+    current_size = 64
+    next_size = 40
+    spacing = 6
+
+    def __init__(
+        self, text, provider: WindowGeometryProvider, padding=(20, 30), palette=None
+    ):
         super().__init__()
         self.text = text
+        self.items: list[str] = []
         self.color = QColor(230, 230, 230)
         self.font = QFont("Arial", 24, QFont.Bold)
-        self.hwnd = hwnd
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
         self.setAttribute(Qt.WA_TranslucentBackground)
         self.setAttribute(Qt.WA_TransparentForMouseEvents)
         self.padding = padding
-        self.update_position()
+        self.palette = palette
+
+        self._rect = QRect()
+        self._layer = QPixmap()
+        self._layer_rect = QRect()
+        self._render_layer()
+
+        self.provider = provider
+        self.provider.setParent(self)
+        self.provider.geometry_changed.connect(self.update_position)
+        self.provider.closed.connect(self.close)
+        self.update_position(self.provider.geometry())
+        self.provider.start()
 
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_position)
-        self.timer.start(80)
+    def set_palette(self, palette) -> None:
+        self.palette = palette
+        self._refresh_layer()
 
     def set_text(self, text):
+        if text == self.text:
+            return
         self.text = text
+        self._refresh_layer()
 
-    def update_position(self):
-        if not win32gui.IsWindow(self.hwnd):
-            self.close()
+    def set_state(self, text: str, items: list[str]) -> None:
+        """
+        Show the text with the current item and upcoming items as icons.
+        :param text:
+        :param items: Current item followed by the next items.
+        :return:
+        """
+        if text == self.text and items == self.items:
             return
-        rect = get_window_rect(self.hwnd)
-        x, y, r, b = rect
-        self.setGeometry(x, y, r - x, b - y)
-        self.update()
+        self.text = text
+        self.items = list(items)
+        self._refresh_layer()
 
-    def paintEvent(self, event):
-        painter = QPainter(self)
+    def _refresh_layer(self) -> None:
+        old_rect = self._layer_rect
+        self._render_layer()
+        self.update(old_rect.united(self._layer_rect))
+
+    def _render_layer(self) -> None:
+        """
+        Composite text and icons into the offscreen layer. Icons come from
+        the palette's pixmap cache so only the first use decodes.
+        :return:
+        """
+        metrics = QFontMetrics(self.font)
+        text_rect = metrics.boundingRect(
+            QRect(0, 0, 10000, 10000), Qt.AlignLeft | Qt.AlignTop, self.text
+        )
+
+        icons = []
+        if self.palette is not None:
+            for index, item in enumerate(self.items):
+                size = self.current_size if index == 0 else self.next_size
+                pixmap = self.palette.pixmap(item, size)
+                if not pixmap.isNull():
+                    icons.append(pixmap)
+
+        icons_width = sum(i.width() + self.spacing for i in icons)
+        icons_height = self.current_size if icons else 0
+        width = max(text_rect.width(), icons_width) + 4
+        height = text_rect.height() + self.spacing + icons_height + 4
+
+        ratio = self.devicePixelRatioF()
+        layer = QPixmap(int(width * ratio), int(height * ratio))
+        layer.setDevicePixelRatio(ratio)
+        layer.fill(Qt.transparent)
+
+        painter = QPainter(layer)
         painter.setPen(self.color)
         painter.setFont(self.font)
+        painter.drawText(
+            QRect(2, 2, width, text_rect.height()),
+            Qt.AlignLeft | Qt.AlignTop,
+            self.text,
+        )
+
+        x = 2
+        y = text_rect.height() + self.spacing + 2
+        for index, pixmap in enumerate(icons):
+            top = y + (icons_height - pixmap.height()) // 2
+            painter.drawPixmap(x, top, pixmap)
+            if index == 0:
+                painter.setPen(QPen(self.color, 2))
+                painter.drawRect(x, top, pixmap.width(), pixmap.height())
+            x += pixmap.width() + self.spacing
+        painter.end()
+
         pad_x, pad_y = self.padding
-        text_rect = QRect(pad_x, pad_y, self.width() - pad_x, self.height() - pad_y)
-        painter.drawText(text_rect, Qt.AlignLeft | Qt.AlignTop, self.text)
-
-    @staticmethod
-    def find_game_window():
-
-        results = find_minecraft_window()
-        if results:
-            overlay = OverlayWindow("", results[0][0])
-            overlay.show()
-            return overlay
-        else:
-            print("Window not found.")
+        self._layer = layer
+        self._layer_rect = QRect(
+            QPoint(pad_x, pad_y), layer.deviceIndependentSize().toSize()
+        )
+
+    def update_position(self, rect: QRect):
+        if rect.isNull() or rect == self._rect:
+            return
+        self._rect = QRect(rect)
+        self.setGeometry(rect)
+
+    def closeEvent(self, event):
+        self.provider.stop()
+        super().closeEvent(event)
+
+    @traced("overlay paint", "overlay")
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawPixmap(self._layer_rect.topLeft(), self._layer)
@@ -0,0 +1,530 @@
+"""
+Block palette loaded from a folder of loose PNGs and/or Minecraft resource
+packs and client jars (zip files).
+
+Scanning a source is cached in a manifest on disk keyed on the source's
+size and mtime, so only new or changed sources are ever listed. Archive
+members are read straight out of a memory map of the zip using the offsets
+stored in the manifest and decoded on first use.
+
+A palette can be refreshed in place, PaletteWatcher does so when a source
+changes on disk. Only textures that were added, removed or changed are
+reported and only their cached images and colours are dropped.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zipfile
+import zlib
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+
+from PySide6.QtCore import QFileSystemWatcher, QObject, Qt, QTimer, Signal
+from PySide6.QtGui import QIcon, QImage, QPixmap
+
+from .constants import REMAP_ITEMS
+from .storage import atomic_write, cache_dir, resource_path
+
+MANIFEST_VERSION = 1
+
+# Folders holding block textures inside a resource pack or client jar,
+# "blocks" is the pre 1.13 layout.
+TEXTURE_FOLDERS = (
+    "assets/minecraft/textures/block/",
+    "assets/minecraft/textures/blocks/",
+)
+
+# Zip local file header, the name and extra field lengths are the last two.
+_LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+
+
+def display_name(key: str) -> str:
+    """
+    Convert a texture file name into the name shown in the UI.
+    :param key: Texture file name without extension e.g. "stone_andesite"
+    :return:
+    """
+    key = REMAP_ITEMS.get(key, key)
+    return key.replace("_", " ").title()
+
+
+def default_sources(resource_packs: list[str] | None = None) -> list[str]:
+    """
+    Sources in load order, later sources override textures of earlier ones
+    the same way Minecraft stacks resource packs.
+    :param resource_packs: Paths to resource pack or jar files.
+    :return:
+    """
+    return [resource_path("palette")] + list(resource_packs or [])
+
+
+@dataclass(frozen=True)
+class Texture:
+    """Where a palette texture lives."""
+
+    name: str
+    key: str
+    source: str
+    member: str
+    offset: int = -1
+    method: int = zipfile.ZIP_STORED
+    size: int = 0
+
+    @property
+    def in_archive(self) -> bool:
+        return self.offset >= 0
+
+    @property
+    def location(self) -> str:
+        return os.path.join(self.source, self.member)
+
+
+def _scan_folder(path: str) -> list[list]:
+    entries = []
+    for file_name in os.listdir(path):
+        key, ext = os.path.splitext(file_name)
+        if ext.lower() != ".png":
+            continue
+        entries.append([key, file_name, -1, zipfile.ZIP_STORED, 0])
+    return entries
+
+
+def _folder_textures(path: str) -> list[str]:
+    """
+    Paths of the loose textures in a folder, without a stat of each.
+    :param path:
+    :return:
+    """
+    with os.scandir(path) as files:
+        return [entry.path for entry in files if entry.name.lower().endswith(".png")]
+
+
+def _scan_archive(path: str) -> list[list]:
+    entries = []
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            folder, _, file_name = info.filename.rpartition("/")
+            if folder + "/" not in TEXTURE_FOLDERS:
+                continue
+            key, ext = os.path.splitext(file_name)
+            if ext.lower() != ".png":
+                continue
+            entries.append(
+                [
+                    key,
+                    info.filename,
+                    info.header_offset,
+                    info.compress_type,
+                    info.compress_size,
+                ]
+            )
+    return entries
+
+
+class PaletteManifest:
+    """
+    On disk cache of texture entries per source.
+
+    The colour index is built in a worker thread while the GUI may refresh
+    the palette, so the sources are only read or changed under a lock.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.path.join(cache_dir(), "palette_manifest.json")
+        self._sources: dict[str, dict] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path, "rb") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self._sources = data["sources"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def stamp(source: str) -> list[int]:
+        stat = os.stat(source)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def entries(self, source: str) -> list[list]:
+        """
+        Texture entries of a source, rescanning only when the source has
+        changed since it was cached.
+        :param source: Folder or zip path
+        :return: [key, member, offset, method, compressed size]
+        """
+        stamp = self.stamp(source)
+        with self._lock:
+            cached = self._sources.get(source)
+        if cached and cached["stamp"] == stamp:
+            return cached["entries"]
+
+        if os.path.isdir(source):
+            entries = _scan_folder(source)
+            # A folder's stamp changes when files are added or removed, the
+            # colours of the files still there stay valid
+            colours = cached.get("colours", {}) if cached else {}
+            keys = {entry[0] for entry in entries}
+            with self._lock:
+                colours = {k: v for k, v in colours.items() if k in keys}
+        else:
+            entries = _scan_archive(source)
+            colours = {}
+
+        with self._lock:
+            self._sources[source] = {
+                "stamp": stamp,
+                "entries": entries,
+                "colours": colours,
+            }
+            self._dirty = True
+        return entries
+
+    def colour(self, source: str, key: str) -> list | None:
+        """
+        Cached colour of a texture, dropped with the entries when the source
+        changes.
+        :param source:
+        :param key:
+        :return: See colours.TextureColour.to_list
+        """
+        with self._lock:
+            cached = self._sources.get(source)
+            return cached.get("colours", {}).get(key) if cached else None
+
+    def set_colour(self, source: str, key: str, colour: list) -> None:
+        with self._lock:
+            cached = self._sources.get(source)
+            if cached is None:
+                return
+            cached.setdefault("colours", {})[key] = colour
+            self._dirty = True
+
+    def drop_colour(self, source: str, key: str) -> None:
+        with self._lock:
+            cached = self._sources.get(source)
+            if cached and cached.get("colours", {}).pop(key, None) is not None:
+                self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"version": MANIFEST_VERSION, "sources": self._sources}
+            encoded = json.dumps(data).encode("utf-8")
+            self._dirty = False
+        try:
+            atomic_write(self.path, encoded)
+        except OSError as e:
+            with self._lock:
+                self._dirty = True
+            print("Could not write palette manifest: %s" % e)
+
+
+@dataclass
+class PaletteChange:
+    """Names of the textures a refresh added, removed or changed"""
+
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self) -> str:
+        return "%d added, %d removed, %d changed" % (
+            len(self.added),
+            len(self.removed),
+            len(self.changed),
+        )
+
+
+class Palette(Mapping):
+    """
+    Maps display name to texture location, sorted by name.
+
+    Images are decoded on first use and cached, `image` is safe to call
+    from worker threads. `pixmap` and `icon` must be called from the GUI
+    thread.
+    """
+
+    def __init__(self, sources: list[str], manifest: PaletteManifest | None = None):
+        self.requested_sources = list(sources)
+        self.sources = [s for s in sources if os.path.exists(s)]
+
+        self._archives: dict[str, mmap.mmap] = {}
+        self._images: dict[str, QImage] = {}
+        self._pixmaps: dict[tuple[str, int], QPixmap] = {}
+        self._icons: dict[str, QIcon] = {}
+        self._lock = threading.Lock()
+
+        self.manifest = manifest or PaletteManifest()
+        self._textures, self._stamps = self._scan()
+
+    def _scan(self) -> tuple[dict[str, Texture], dict[str, tuple]]:
+        """
+        Only the sources themselves are stat'ed, not every loose texture,
+        a folder's stamp changes when files are added or removed.
+        :return: Textures sorted by name, the stamps of the sources
+        """
+        textures = {}
+        stamps = {}
+        for source in self.sources:
+            try:
+                stamps[source] = tuple(self.manifest.stamp(source))
+                entries = self.manifest.entries(source)
+            except (OSError, zipfile.BadZipFile) as e:
+                print("Skipping palette source %s: %s" % (source, e))
+                continue
+            for key, member, offset, method, size in entries:
+                name = display_name(key)
+                textures[name] = Texture(
+                    name, key, source, member, offset, method, size
+                )
+        self.manifest.save()
+        return dict(sorted(textures.items())), stamps
+
+    def refresh(
+        self, sources: list[str] | None = None, paths: set[str] | None = None
+    ) -> PaletteChange:
+        """
+        Rescan the sources, textures that didn't change keep their cached
+        images and colours. Safe while worker threads read the palette, they
+        carry on with the textures from before.
+        :param sources: New sources, the same sources when None
+        :param paths: Files known to have changed, editing a loose texture
+            in place doesn't change its folder's stamp
+        :return:
+        """
+        paths = {os.path.normpath(path) for path in paths or ()}
+        if sources is not None:
+            self.requested_sources = list(sources)
+        old_sources = set(self.sources)
+        self.sources = [s for s in self.requested_sources if os.path.exists(s)]
+
+        old, old_stamps = self._textures, self._stamps
+        textures, stamps = self._scan()
+        change = PaletteChange(
+            added=[name for name in textures if name not in old],
+            removed=[name for name in old if name not in textures],
+            changed=[
+                name
+                for name, texture in textures.items()
+                if name in old
+                and (
+                    texture != old[name]
+                    or (
+                        texture.in_archive
+                        and stamps.get(texture.source) != old_stamps.get(texture.source)
+                    )
+                    or (
+                        not texture.in_archive
+                        and os.path.normpath(texture.location) in paths
+                    )
+                )
+            ],
+        )
+
+        # Archives that changed or went are mapped again on next read
+        stale = {s for s in old_sources if stamps.get(s) != old_stamps.get(s)}
+        with self._lock:
+            self._textures, self._stamps = textures, stamps
+            for source in stale:
+                view = self._archives.pop(source, None)
+                if view is not None:
+                    view.close()
+            for name in change.removed + change.changed:
+                self._images.pop(name, None)
+        for name in change.removed + change.changed:
+            self._icons.pop(name, None)
+            for key in [key for key in self._pixmaps if key[0] == name]:
+                del self._pixmaps[key]
+        for name in change.changed:
+            texture = textures[name]
+            self.manifest.drop_colour(texture.source, texture.key)
+        self.manifest.save()
+        return change
+
+    # Mapping
+    def __getitem__(self, name: str) -> str:
+        return self._textures[name].location
+
+    def __iter__(self):
+        return iter(self._textures)
+
+    def __len__(self) -> int:
+        return len(self._textures)
+
+    def texture(self, name: str) -> Texture | None:
+        return self._textures.get(name)
+
+    def read(self, name: str) -> bytes:
+        """
+        Raw PNG data of a texture.
+        :param name:
+        :return:
+        """
+        texture = self._textures[name]
+        if not texture.in_archive:
+            with open(texture.location, "rb") as f:
+                return f.read()
+
+        view = self._archive(texture.source)
+        header = _LOCAL_HEADER.unpack_from(view, texture.offset)
+        if header[0] != b"PK\x03\x04":
+            raise zipfile.BadZipFile("Bad local header for %s" % texture.location)
+        start = texture.offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+        data = view[start : start + texture.size]
+
+        if texture.method == zipfile.ZIP_STORED:
+            return data
+        if texture.method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+
+        with zipfile.ZipFile(texture.source) as archive:
+            return archive.read(texture.member)
+
+    def _archive(self, source: str) -> mmap.mmap:
+        with self._lock:
+            view = self._archives.get(source)
+            if view is None:
+                with open(source, "rb") as f:
+                    view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._archives[source] = view
+            return view
+
+    def image(self, name: str) -> QImage:
+        """
+        Decoded texture, animated textures are cropped to their first frame.
+        Returns a null image for names not in the palette.
+        :param name:
+        :return:
+        """
+        with self._lock:
+            image = self._images.get(name)
+        if image is not None:
+            return image
+        if name not in self._textures:
+            return QImage()
+
+        try:
+            image = QImage.fromData(self.read(name))
+        except (OSError, ValueError, zlib.error, zipfile.BadZipFile) as e:
+            print("Could not load texture %s: %s" % (name, e))
+            image = QImage()
+
+        if image.height() > image.width():
+            image = image.copy(0, 0, image.width(), image.width())
+
+        with self._lock:
+            self._images[name] = image
+        return image
+
+    def pixmap(self, name: str, size: int | None = None) -> QPixmap:
+        """
+        Cached pixmap of a texture, scaled to size x size when given. Copy the
+        pixmap before painting on it.
+        :param name:
+        :param size:
+        :return:
+        """
+        key = (name, size or 0)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is None:
+            image = self.image(name)
+            if image.isNull():
+                return QPixmap()
+            pixmap = QPixmap.fromImage(image)
+            if size:
+                pixmap = pixmap.scaled(size, size, Qt.IgnoreAspectRatio)
+            self._pixmaps[key] = pixmap
+        return pixmap
+
+    def icon(self, name: str) -> QIcon:
+        icon = self._icons.get(name)
+        if icon is None:
+            icon = QIcon(self.pixmap(name))
+            self._icons[name] = icon
+        return icon
+
+    def close(self) -> None:
+        with self._lock:
+            for view in self._archives.values():
+                view.close()
+            self._archives.clear()
+
+
+class PaletteWatcher(QObject):
+    """
+    Refreshes a palette when its sources change on disk. Events are
+    coalesced, saving a texture or copying in a folder of them is one
+    refresh.
+    """
+
+    changed = Signal(object)
+    """PaletteChange"""
+
+    def __init__(self, palette: Palette, delay: int = 300, parent=None):
+        """
+        :param palette:
+        :param delay: ms to wait for events to settle
+        :param parent:
+        """
+        super().__init__(parent)
+
+        self.palette = palette
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._schedule)
+        self._watcher.fileChanged.connect(self._schedule)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay)
+        self._timer.timeout.connect(self.refresh)
+        # Files reported since the last refresh
+        self._paths: set[str] = set()
+        self._watch()
+
+    def _watch(self) -> None:
+        """
+        Watch the folders, their textures and the archives, a folder alone
+        only tells when files are added or removed.
+        :return:
+        """
+        wanted = set()
+        for source in self.palette.requested_sources:
+            if os.path.isdir(source):
+                wanted.add(source)
+                wanted.update(_folder_textures(source))
+            elif os.path.exists(source):
+                wanted.add(source)
+        watched = set(self._watcher.files()) | set(self._watcher.directories())
+        if watched - wanted:
+            self._watcher.removePaths(list(watched - wanted))
+        if wanted - watched:
+            self._watcher.addPaths(list(wanted - watched))
+
+    def _schedule(self, path: str) -> None:
+        self._paths.add(path)
+        self._timer.start()
+
+    def refresh(self, sources: list[str] | None = None) -> PaletteChange:
+        """
+        Refresh the palette now.
+        :param sources: See Palette.refresh
+        :return:
+        """
+        self._timer.stop()
+        paths, self._paths = self._paths, set()
+        change = self.palette.refresh(sources, paths)
+        # Editors often save by replacing the file, which drops its watch
+        self._watch()
+        if change:
+            print("Palette: %s" % change.summary())
+            self.changed.emit(change)
+        return change
@@ -0,0 +1,207 @@
+"""
+Material plans, how many of each block a build needs.
+
+One generated buffer is one sample of the required counts, the real build is
+another sequence from the same rules and can need more. A plan generates
+thousands of sequences with the sequence engine and reports the counts each
+item reaches in 50%, 95% and 99% of them. Sequences are generated in batches
+on a process pool, one batch per task, and a batch comes back as one array
+of counts per item rather than a Counter per sequence.
+"""
+
+import math
+import os
+import random
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from PySide6.QtCore import QObject, Signal
+
+from .constants import STACK_SIZE
+from .sequences import BlockSequence, ItemSequence
+
+PERCENTILES = (50, 95, 99)
+
+# Sequences per task, big enough that a task outweighs sending it
+BATCH_SIZE = 250
+
+
+def simulate_batch(
+    rules: list[ItemSequence], height: int, seeds: list[int], gradient=None
+) -> dict[str, array]:
+    """
+    Generate a sequence per seed and count the blocks of each item. Runs in
+    the pool's processes.
+    :param rules:
+    :param height:
+    :param seeds:
+    :param gradient: See BlockSequence.set_params
+    :return: Item name to the count in each sequence, in seed order
+    """
+    names = list(dict.fromkeys(rule.item_name for rule in rules))
+    counts = {name: array("I") for name in names}
+    sequence = BlockSequence()
+    for seed in seeds:
+        sequence.set_params(rules, height, seed, gradient)
+        tally = Counter()
+        for name, count in sequence.runs():
+            tally[name] += count
+        for name in names:
+            counts[name].append(tally[name])
+    return counts
+
+
+def percentile(ordered, p: float) -> int:
+    """
+    Nearest rank percentile.
+    :param ordered: Sorted values
+    :param p: 0-100
+    :return:
+    """
+    if not ordered:
+        return 0
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+@dataclass
+class MaterialPlan:
+    height: int
+    simulations: int
+    blocks: dict[str, tuple[int, ...]]
+    """Item name to blocks needed at each of PERCENTILES"""
+    mean: dict[str, float]
+
+    def stacks(self, name: str) -> tuple[int, ...]:
+        return tuple(math.ceil(count / STACK_SIZE) for count in self.blocks[name])
+
+    @classmethod
+    def from_counts(cls, height: int, counts: dict[str, array]) -> "MaterialPlan":
+        blocks = {}
+        mean = {}
+        simulations = 0
+        for name, values in counts.items():
+            ordered = sorted(values)
+            simulations = len(ordered)
+            blocks[name] = tuple(percentile(ordered, p) for p in PERCENTILES)
+            mean[name] = sum(ordered) / len(ordered) if ordered else 0.0
+        return cls(height, simulations, blocks, mean)
+
+    def report(self) -> str:
+        """
+        Plain text table, items needing the most first.
+        :return:
+        """
+        headers = ["Item", "Mean"] + ["p%d" % p for p in PERCENTILES]
+        rows = [headers]
+        for name in sorted(self.blocks, key=lambda n: self.blocks[n][-1], reverse=True):
+            rows.append(
+                [name, "%.1f" % (self.mean[name] / STACK_SIZE)]
+                + [str(stacks) for stacks in self.stacks(name)]
+            )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+        lines = [
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        ]
+        return "\n".join(lines)
+
+
+def plan_materials(
+    rules: list[ItemSequence],
+    height: int,
+    simulations: int,
+    seed: int | None = None,
+    gradient=None,
+    workers: int | None = None,
+    progress=None,
+    cancelled=None,
+) -> MaterialPlan | None:
+    """
+    Simulate sequences of the rules on a process pool.
+    :param rules:
+    :param height:
+    :param simulations:
+    :param seed: Seed for a reproducible plan
+    :param gradient: See BlockSequence.set_params
+    :param workers: Processes, one per CPU by default
+    :param progress: Called with the number of sequences done
+    :param cancelled: Returns True to stop early
+    :return: None if cancelled
+    """
+    rng = random.Random(seed)
+    seeds = [rng.randrange(2**32) for _ in range(simulations)]
+    batches = [seeds[i : i + BATCH_SIZE] for i in range(0, len(seeds), BATCH_SIZE)]
+    workers = min(workers or os.cpu_count() or 1, len(batches)) or 1
+
+    # Batches finish out of order, they're put back in order so a seed gives
+    # the same plan however many processes ran it
+    results: list[dict[str, array] | None] = [None] * len(batches)
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(simulate_batch, rules, height, batch, gradient): i
+            for i, batch in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            if cancelled and cancelled():
+                pool.shutdown(wait=True, cancel_futures=True)
+                return None
+            i = futures[future]
+            results[i] = future.result()
+            done += len(batches[i])
+            if progress:
+                progress(done)
+
+    counts = {name: array("I") for name in dict.fromkeys(r.item_name for r in rules)}
+    for result in results:
+        for name, values in result.items():
+            counts[name].extend(values)
+    return MaterialPlan.from_counts(height, counts)
+
+
+class PlanWorker(QObject):
+    """
+    Runs plan_materials in thread, the thread waits on the pool.
+    """
+
+    progress = Signal(int)
+    """Sequences done"""
+    finished = Signal(object)
+    """MaterialPlan, None when stopped"""
+    failed = Signal(str)
+
+    def __init__(self, rules, height: int, simulations: int, seed=None, gradient=None):
+        super().__init__()
+
+        self.rules = rules
+        self.height = height
+        self.simulations = simulations
+        self.seed = seed
+        self.gradient = gradient
+        self._stop_flag = False
+
+    def stop(self) -> None:
+        self._stop_flag = True
+
+    def run(self) -> None:
+        try:
+            plan = plan_materials(
+                self.rules,
+                self.height,
+                self.simulations,
+                self.seed,
+                self.gradient,
+                progress=self.progress.emit,
+                cancelled=lambda: self._stop_flag,
+            )
+        except Exception as e:
+            # A worker process that dies takes the pool with it
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(plan)
@@ -0,0 +1,218 @@
+"""
+Preset library, named rule sets stored in SQLite together with sequences
+generated ahead of time for common heights, so switching presets is a single
+indexed lookup instead of regenerating.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+
+from PySide6 import QtCore
+
+from .sequences import BlockSequence
+from .session import item_table, pack_ids, rules_from_dicts, unpack_ids
+from .storage import data_dir
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS presets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    length INTEGER NOT NULL,
+    rules TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    preset_id INTEGER NOT NULL REFERENCES presets(id) ON DELETE CASCADE,
+    height INTEGER NOT NULL,
+    seed INTEGER,
+    items TEXT NOT NULL,
+    buffer BLOB NOT NULL,
+    PRIMARY KEY (preset_id, height)
+) WITHOUT ROWID;
+"""
+
+
+def library_path() -> str:
+    return os.path.join(data_dir(), "presets.sqlite")
+
+
+@dataclass
+class Preset:
+    id: int
+    name: str
+    length: int
+    rules: list[dict]
+    state: dict
+    seed: int | None = None
+    buffer: list[str] | None = None
+    """Precomputed sequence for the requested height, None if there isn't one"""
+
+    def rule_set(self):
+        return rules_from_dicts(self.rules)
+
+
+class PresetLibrary:
+    """
+    Connection to the preset database. Connections aren't shared between
+    threads, workers open their own on the same path.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or library_path()
+        self._db = sqlite3.connect(self.path, timeout=10)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError("Unsupported preset library version %s" % version)
+        with self._db:
+            self._db.executescript(SCHEMA)
+            self._db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def names(self) -> list[str]:
+        rows = self._db.execute("SELECT name FROM presets ORDER BY name COLLATE NOCASE")
+        return [row[0] for row in rows]
+
+    def save(self, name: str, length: int, rules: list[dict], state: dict) -> int:
+        """
+        Add or replace a preset, replacing drops its precomputed sequences.
+        :param name:
+        :param length: Height the preset was saved with
+        :param rules: Compiled rule set as dicts
+        :param state: Item widget values
+        :return: Preset id
+        """
+        with self._db:
+            self._db.execute(
+                "INSERT INTO presets (name, length, rules, state, updated) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                "length = excluded.length, rules = excluded.rules, "
+                "state = excluded.state, updated = excluded.updated",
+                (name, length, json.dumps(rules), json.dumps(state), time.time()),
+            )
+            preset_id = self._db.execute(
+                "SELECT id FROM presets WHERE name = ?", (name,)
+            ).fetchone()[0]
+            self._db.execute("DELETE FROM sequences WHERE preset_id = ?", (preset_id,))
+        return preset_id
+
+    def delete(self, name: str) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM presets WHERE name = ?", (name,))
+
+    def load(self, name: str, height: int | None = None) -> Preset | None:
+        """
+        Load a preset with its precomputed sequence for height.
+        :param name:
+        :param height: Defaults to the height the preset was saved with
+        :return:
+        """
+        row = self._db.execute(
+            "SELECT p.id, p.length, p.rules, p.state, s.seed, s.items, s.buffer "
+            "FROM presets p LEFT JOIN sequences s "
+            "ON s.preset_id = p.id AND s.height = coalesce(?, p.length) "
+            "WHERE p.name = ?",
+            (height, name),
+        ).fetchone()
+        if row is None:
+            return None
+        preset_id, length, rules, state, seed, items, buffer = row
+        preset = Preset(preset_id, name, length, json.loads(rules), json.loads(state))
+        if buffer is not None:
+            items = json.loads(items)
+            preset.seed = seed
+            preset.buffer = [items[i] for i in unpack_ids(buffer)]
+        return preset
+
+    def sequence(self, preset_id: int, height: int) -> tuple[int, list[str]] | None:
+        """
+        Precomputed sequence of a preset.
+        :param preset_id:
+        :param height:
+        :return: seed, buffer
+        """
+        row = self._db.execute(
+            "SELECT seed, items, buffer FROM sequences "
+            "WHERE preset_id = ? AND height = ?",
+            (preset_id, height),
+        ).fetchone()
+        if row is None:
+            return None
+        seed, items, buffer = row
+        items = json.loads(items)
+        return seed, [items[i] for i in unpack_ids(buffer)]
+
+    def heights(self, preset_id: int) -> list[int]:
+        rows = self._db.execute(
+            "SELECT height FROM sequences WHERE preset_id = ? ORDER BY height",
+            (preset_id,),
+        )
+        return [row[0] for row in rows]
+
+    def add_sequence(
+        self, preset_id: int, height: int, seed: int | None, buffer: list[str]
+    ) -> None:
+        items, ids = item_table(buffer)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sequences "
+                "(preset_id, height, seed, items, buffer) VALUES (?, ?, ?, ?, ?)",
+                (preset_id, height, seed, json.dumps(items), pack_ids(ids)),
+            )
+
+
+class PresetSequenceWorker(QtCore.QObject):
+    """
+    Generates and stores the sequences of a preset for the given heights,
+    run in a QThread.
+    """
+
+    sequence_added = QtCore.Signal(int, int)
+    """preset id, height"""
+    finished = QtCore.Signal()
+
+    def __init__(self, path: str, preset_id: int, rules: list[dict], heights):
+        super().__init__()
+        self.path = path
+        self.preset_id = preset_id
+        self.rules = rules
+        self.heights = sorted(set(heights))
+        self._stop_flag = False
+        self._sequence: BlockSequence | None = None
+
+    def stop(self) -> None:
+        self._stop_flag = True
+        if self._sequence:
+            self._sequence.stop()
+
+    def run(self) -> None:
+        library = None
+        try:
+            library = PresetLibrary(self.path)
+            for height in self.heights:
+                if self._stop_flag:
+                    break
+                seed = random.randrange(2**32)
+                self._sequence = BlockSequence()
+                self._sequence.set_params(rules_from_dicts(self.rules), height, seed)
+                buffer = list(self._sequence.generate())
+                if self._stop_flag:
+                    break
+                library.add_sequence(self.preset_id, height, seed, buffer)
+                self.sequence_added.emit(self.preset_id, height)
+        except (sqlite3.Error, ValueError) as e:
+            print("Could not store preset sequences: %s" % e)
+        finally:
+            if library is not None:
+                library.close()
+            self.finished.emit()
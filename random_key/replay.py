@@ -0,0 +1,144 @@
+"""
+Headless replay of click traces through the click to keypress path.
+
+Opens RandomKeyDialog on the offscreen Qt platform with a ReplayInputBackend
+and a FakeKeySink, lets it generate a buffer, then starts it and replays a
+recorded or synthetic click trace into it. The keys the dialog pressed are
+checked against the keys its buffer should press, with throughput and
+dropped clicks reported. Settings and data go to a temp folder, see
+benchmarks.isolate.
+
+    python -m random_key.replay --rate 120 --clicks 2000
+    python -m random_key.replay --trace clicks.trace --speed 2
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from .benchmarks import isolate
+from .input_backends import load_trace, synthetic_trace
+
+# Longest wait for the dialog to finish something before the replay fails
+TIMEOUT = 60.0
+# Highest Max Height the dialog takes
+MAX_LENGTH = 2048
+
+
+def pump(app, done, what: str) -> None:
+    """
+    Process events until done() is true.
+    :param app:
+    :param done:
+    :param what: For the timeout error
+    :return:
+    """
+    end = time.perf_counter() + TIMEOUT
+    while not done():
+        if time.perf_counter() > end:
+            raise RuntimeError("Timed out waiting for %s" % what)
+        app.processEvents()
+
+
+def expected_keys(dialog) -> list[str]:
+    """
+    Keys moving onto each position of the dialog's buffer, worked out from the
+    buffer and the item bindings rather than read back from its cursor.
+    :param dialog:
+    :return:
+    """
+    from .keymap import KeyMap
+
+    keymap = KeyMap()
+    keys = []
+    page = 0
+    for item in dialog.buffer:
+        binding = dialog._key_map[item]
+        keys.append(keymap.keys(binding, page))
+        page = binding.page
+    return keys
+
+
+def replay(app, trace: list[int], items: int, speed: float = 1.0) -> dict:
+    """
+    Replay a trace into a new dialog.
+    :param app: QApplication
+    :param trace: Click offsets in ns
+    :param items: Number of items, spread over hotbar pages past 9
+    :param speed: Trace speed multiplier
+    :return: Results
+    """
+    from .dialog import RandomKeyDialog
+    from .input_backends import FakeKeySink, ReplayInputBackend
+    from .window_location import FakeBackend
+
+    backend = ReplayInputBackend(trace, speed)
+    sink = FakeKeySink()
+    dialog = RandomKeyDialog(backend, sink, FakeBackend())
+    dialog.show()
+    try:
+        pump(app, lambda: dialog._initialized, "the dialog")
+        dialog.ui.item_count_spinbox.setValue(items)
+        pump(app, lambda: dialog._buffer_complete, "the buffer")
+
+        start = time.perf_counter()
+        dialog.ui.stop_start_button.click()
+        source = backend.sources[-1]
+        pump(app, source.finished.is_set, "the trace")
+        duration = time.perf_counter() - start
+        dialog.ui.stop_start_button.click()
+        app.processEvents()
+
+        # Clicks past the end of the buffer don't press anything
+        expected = expected_keys(dialog)[1 : 1 + source.sent]
+        lateness = sorted(source.lateness) or [0]
+        return {
+            "clicks": source.sent,
+            "buffer": len(dialog.buffer),
+            "keys": len(sink.keys),
+            "dropped": len(expected) - len(sink.keys),
+            "matches_buffer": sink.keys == expected,
+            "cursor": dialog.cursor.index,
+            "duration_s": round(duration, 4),
+            "clicks_per_s": round(source.sent / duration, 1) if duration else 0,
+            "lateness_p50_us": lateness[len(lateness) // 2] / 1000,
+            "lateness_p99_us": lateness[int(len(lateness) * 0.99)] / 1000,
+        }
+    finally:
+        dialog.close()
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--trace", help="Click trace file to replay")
+    parser.add_argument("--clicks", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100, help="Clicks per second")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--items", type=int, default=9)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.clicks, args.rate, args.jitter)
+
+    with tempfile.TemporaryDirectory(prefix="random_key_replay_") as folder:
+        isolate(folder, min(len(trace) + 1, MAX_LENGTH))
+
+        from PySide6.QtWidgets import QApplication
+
+        app = QApplication.instance() or QApplication([])
+        results = replay(app, trace, args.items, args.speed)
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
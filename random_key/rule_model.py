@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from typing import Callable
+
+from PySide6 import QtCore
+
+from .sequences import ItemSequence
+from .session import rules_to_dicts
+
+
+class RuleSetModel(QtCore.QObject):
+    """
+    Sits between the item widgets and the sequence engine. Widgets invalidate
+    the model on every edit, the model compiles the rule set and only emits
+    rules_changed when the effective rules or height differ from the last
+    ones. Edits inside batch() are compiled once when the batch ends.
+    """
+
+    rules_changed = QtCore.Signal(object, int)
+    """Compiled rule set, height"""
+
+    def __init__(
+        self, compile_rules: Callable[[], tuple[list[ItemSequence], int]], parent=None
+    ):
+        super().__init__(parent)
+        self._compile_rules = compile_rules
+        self._depth = 0
+        self._dirty = False
+        self._rules: list[dict] = []
+        self._length = 0
+
+    def begin(self) -> None:
+        self._depth += 1
+
+    def commit(self) -> bool:
+        """
+        End a batch, the outermost commit compiles the rules if anything was
+        edited.
+        :return: True if the rules changed
+        """
+        self._depth = max(0, self._depth - 1)
+        if self._depth or not self._dirty:
+            return False
+        self._dirty = False
+        return self.refresh()
+
+    @contextmanager
+    def batch(self):
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def invalidate(self, *args) -> None:
+        """
+        Slot for widget edits.
+        :param args:
+        :return:
+        """
+        self._dirty = True
+        if not self._depth:
+            self.commit()
+
+    def refresh(self) -> bool:
+        """
+        Compile the rules and emit rules_changed if they differ.
+        :return: True if the rules changed
+        """
+        rules, length = self._compile_rules()
+        compiled = rules_to_dicts(rules)
+        if compiled == self._rules and length == self._length:
+            return False
+        self._rules = compiled
+        self._length = length
+        self.rules_changed.emit(rules, length)
+        return True
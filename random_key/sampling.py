@@ -0,0 +1,175 @@
+import bisect
+import itertools
+import random
+
+
+class WeightedSampler:
+    """
+    Weighted random choice over indexes in O(log n), weights are kept in a
+    Fenwick tree so changing one is O(log n) too instead of rebuilding a
+    cumulative list.
+
+    While the weights stay the same, sample_without keeps a cumulative list
+    per set of left out indexes, a sequence only ever leaves out a handful
+    of different sets so after the first few picks each is one bisect.
+    """
+
+    def __init__(self, weights):
+        self._weights = [float(w) for w in weights]
+        self._size = len(self._weights)
+        self._tree = [0.0] * (self._size + 1)
+        for i, weight in enumerate(self._weights, 1):
+            self._tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[i]
+
+        self._top = 1
+        while self._top * 2 <= self._size:
+            self._top *= 2
+
+        # Left out indexes to the indexes left and their cumulative weights
+        self._excluding: dict[frozenset, tuple[list[int], list[float]]] = {}
+        # No weight has changed since the last sample_without
+        self._settled = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def weight(self, index: int) -> float:
+        return self._weights[index]
+
+    def prefix(self, index: int) -> float:
+        """
+        Total weight of the indexes before index.
+        :param index:
+        :return:
+        """
+        total = 0.0
+        i = index
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    @property
+    def total(self) -> float:
+        total = 0.0
+        i = self._size
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def set_weight(self, index: int, weight: float) -> None:
+        delta = float(weight) - self._weights[index]
+        if not delta:
+            return
+        self._weights[index] = float(weight)
+        self._excluding.clear()
+        self._settled = False
+        i = index + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, value: float) -> int:
+        """
+        Index whose cumulative weight range contains value.
+        :param value: 0 <= value < total
+        :return: -1 if no index has any weight
+        """
+        index = 0
+        step = self._top
+        while step:
+            nxt = index + step
+            if nxt <= self._size and self._tree[nxt] <= value:
+                index = nxt
+                value -= self._tree[nxt]
+            step //= 2
+        # Float error can land past the last index with weight, or leave a
+        # total above 0 with no weight at all
+        while index >= 0 and (index >= self._size or not self._weights[index]):
+            index -= 1
+        return index
+
+    def sample(self, rng=random) -> int:
+        """
+        :param rng:
+        :return: Random index, weighted. -1 if every weight is zero.
+        """
+        total = self.total
+        if total <= 0:
+            return -1
+        return self.find(rng.random() * total)
+
+    def sample_excluding(self, index: int, rng=random) -> int:
+        """
+        Sample with one index left out, falls back to that index if it's the
+        only one with any weight.
+        :param index:
+        :param rng:
+        :return:
+        """
+        choice = self.sample_without((index,), rng)
+        return index if choice < 0 else choice
+
+    def sample_without(self, indexes, rng=random) -> int:
+        """
+        Sample with some indexes left out.
+        :param indexes:
+        :param rng:
+        :return: Random index, weighted. -1 if nothing else has any weight.
+        """
+        key = frozenset(indexes)
+        if self._settled:
+            entry = self._excluding.get(key)
+            if entry is None:
+                if len(self._excluding) >= 512:
+                    self._excluding.clear()
+                allowed = [i for i, w in enumerate(self._weights) if w and i not in key]
+                cumulative = list(
+                    itertools.accumulate(self._weights[i] for i in allowed)
+                )
+                entry = self._excluding[key] = (allowed, cumulative)
+            allowed, cumulative = entry
+            if not allowed:
+                return -1
+            i = bisect.bisect_right(cumulative, rng.random() * cumulative[-1])
+            return allowed[min(i, len(allowed) - 1)]
+        # Weights that just changed may well change again before the next
+        # pick, e.g. an item with a quota, so the tree is used once first
+        self._settled = True
+
+        # The draw is over the weight that's left, then moved past the range
+        # of each left out index below it, rather than zeroing their weights
+        # in the tree and putting them back.
+        excluded = sorted(
+            index
+            for index in key
+            if index is not None and 0 <= index < self._size and self._weights[index]
+        )
+        whole = self.total
+        total = whole - sum(self._weights[index] for index in excluded)
+        # What's left of the total after taking every weight off is float error
+        if total <= whole * 1e-9:
+            return -1
+        value = rng.random() * total
+        for index in excluded:
+            if self.prefix(index) <= value:
+                value += self._weights[index]
+        choice = self.find(value)
+        if choice in excluded:
+            # Float error on the edge of a left out range
+            return self._sample_zeroed(excluded, rng)
+        return choice
+
+    def _sample_zeroed(self, excluded, rng=random) -> int:
+        saved = [(index, self._weights[index]) for index in excluded]
+        for index, _ in saved:
+            self.set_weight(index, 0.0)
+        try:
+            return self.sample(rng)
+        finally:
+            for index, weight in saved:
+                self.set_weight(index, weight)
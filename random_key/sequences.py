@@ -1,10 +1,25 @@
 import random
-import time
+import threading
 from collections import defaultdict, Counter
 import math
 from dataclasses import dataclass, field
 from PySide6 import QtCore
 
+from .avoid_rules import AvoidAutomaton
+from .sampling import WeightedSampler
+from .tracing import span
+
+# Times over the height a gradient re-weights the items
+GRADIENT_STEPS = 32
+
+# Starting window of items run may emit ahead of the GUI taking them, so the
+# GUI paints between batches instead of working through the whole buffer
+# first. The window isn't fixed, each item taken frees its own place and
+# WINDOW_GROWTH more, so the batches grow as the buffer does and the preview
+# strip is laid out a few times rather than once a batch.
+START_QUEUED = 32
+WINDOW_GROWTH = 2
+
 
 class WFC1D:
     def __init__(self, length, rules, probabilities):
@@ -116,15 +131,18 @@ class ItemSequence:
     max_entropy: int
     min_entropy: int
     avoids: list
+    page: int = 0
+    quota: int = 0
+    """Most blocks of the item in the sequence, 0 for no limit"""
 
     def avoid(self, other):
         self.avoids.append(other)
 
 
-def weighted_bool_from_range(start: int, end: int) -> bool:
+def weighted_bool_from_range(start: int, end: int, rng=random) -> bool:
     length = end - start + 1
     probability = 1 / length
-    return random.random() < probability
+    return rng.random() < probability
 
 
 class BlockSequence(QtCore.QObject):
@@ -138,94 +156,213 @@ class BlockSequence(QtCore.QObject):
         self.items: list[ItemSequence] = []
         self.length: int = 1
         self._items: dict[str, ItemSequence] = {}
+        self.seed: int | None = None
+        self.gradient = None
+        self._random = random.Random()
 
         self._running = False
         self._stop_flag = False
-
-    def set_params(self, items, length):
+        self._queued = threading.Semaphore(START_QUEUED)
+
+    def set_params(self, items, length, seed: int | None = None, gradient=None):
+        """
+        :param items: Rule set
+        :param length:
+        :param seed: Seed for a reproducible sequence, random when None.
+        :param gradient: colours.ColourGradient to steer the items by
+        :return:
+        """
         self.items = items
         self.length = length
         self._items: dict[str, ItemSequence] = {i.item_name: i for i in items}
+        self.seed = seed
+        self.gradient = gradient
+        self._random = random.Random(seed)
 
     def stop(self):
 
         self._stop_flag = True
 
+    def item_taken(self) -> None:
+        """
+        Called by the receiver of item_added for each item it handled, run
+        waits while too many haven't been. Widens the window, see
+        START_QUEUED.
+        :return:
+        """
+        self._queued.release(1 + WINDOW_GROWTH)
+
     @property
     def running(self):
 
         return self._running
 
-    def run(self):
-
-        self._stop_flag = False
-        self._running = True
-
-        sequence = []
-        index = 1
-
-        # Initialise a starting item
-        target_keys = [i.item_name for i in self.items]
-        weights = [i.probability for i in self.items]
-        current_item = random.choices(target_keys, weights=weights, k=1)[0]
+    def generate(self):
+        """
+        Generate the sequence one item at a time.
+        :return: Iterator of item names
+        """
+        for item, count in self.runs():
+            for _ in range(count):
+                if self._stop_flag:
+                    return
+                yield item
+
+    def runs(self):
+        """
+        Generate the sequence a run at a time, for counting blocks without
+        going through every one.
+        :return: Iterator of (item name, blocks in the run)
+        """
+
+        # Initialise a starting item. Sampling is O(log n) in the number of
+        # items and the Avoid rules are one automaton, so the next item is
+        # picked from the allowed ones without retries.
+        target_keys = list(self._items)
+        key_index = {name: i for i, name in enumerate(target_keys)}
+        weights = [0] * len(target_keys)
+        for item in self.items:
+            weights[key_index[item.item_name]] += item.probability
+        # An item that can't be placed would be picked and dropped forever
+        for name, item in self._items.items():
+            if item.max_entropy <= 0 and item.min_entropy <= 0:
+                weights[key_index[name]] = 0
+        sampler = WeightedSampler(weights)
+        if sampler.total <= 0:
+            return
+        avoids = AvoidAutomaton(self.items, target_keys).tracker()
+
+        # Items with a quota are drawn without replacement, their weight is
+        # scaled by the share of the quota left so it reaches 0 with it.
+        quotas = {
+            key_index[name]: item.quota
+            for name, item in self._items.items()
+            if item.quota > 0
+        }
+        remaining = dict(quotas)
+        bias = [1.0] * len(target_keys)
+
+        def weight(i: int) -> float:
+            w = weights[i] * bias[i]
+            if i in quotas:
+                w *= remaining[i] / quotas[i]
+            return w
+
+        # A gradient re-weights every item a few times over the height
+        # rather than on every pick
+        gradient = self.gradient
+        gradient_step = -1
+
+        def steer(placed: int) -> None:
+            nonlocal gradient_step
+            step = placed * GRADIENT_STEPS // max(1, self.length)
+            if gradient is None or step == gradient_step:
+                return
+            gradient_step = step
+            t = placed / max(1, self.length - 1)
+            for i, name in enumerate(target_keys):
+                bias[i] = gradient.bias(name, t)
+                sampler.set_weight(i, weight(i))
+
+        def place(i: int, count: int) -> None:
+            """
+            Track a run of placed blocks.
+            :param i:
+            :param count:
+            :return:
+            """
+            avoids.place(i, count)
+            left = remaining.get(i)
+            if left is not None:
+                remaining[i] = left - count
+                sampler.set_weight(i, weight(i))
+
+        rng = self._random
+        steer(0)
+        current_index = sampler.sample(rng)
+        current_item = target_keys[current_index]
 
         min_item_entropy = self._items[current_item].min_entropy
         max_item_entropy = self._items[current_item].max_entropy
-        current_avoids = self._items[current_item].avoids
-
-        last_item = None
-        last_item_avoids = []
-
-        # slight delay so the UI Responds nicely
-        signal_delay = 0.0001
-
-        sequence.append(current_item)
-        self.item_added.emit(current_item)
-        while len(sequence) <= self.length - 1 and not self._stop_flag:
-
-            # Check that current item does not neighbour last item
-            if last_item not in current_avoids and current_item not in last_item_avoids:
-
-                # add item if we below min entropy
-                if index <= min_item_entropy:
-                    sequence.append(current_item)
-                    self.item_added.emit(current_item)
+        # Chance a run ends at each block between its min and max, the same
+        # draw as weighted_bool_from_range without a call per block
+        end_chance = 1 / max(1, max_item_entropy - min_item_entropy + 1)
+
+        # Blocks of the current run not placed yet, and the quota left when
+        # the run started, the run ends early when it's used up
+        run = 1
+        quota_left = remaining.get(current_index)
+        length = 1
+        index = 2 if quota_left is None or run < quota_left else 1000000
+        while length <= self.length - 1 and not self._stop_flag:
+
+            # add item if we below min entropy
+            if index <= min_item_entropy or (
+                index <= max_item_entropy and rng.random() >= end_chance
+            ):
+                length += 1
+                run += 1
+                if quota_left is None or run < quota_left:
                     index += 1
-                    time.sleep(signal_delay)
-                    continue
-
-                elif index <= max_item_entropy:
-
-                    if weighted_bool_from_range(min_item_entropy, max_item_entropy):
-                        index = 1000000
-                        last_item = current_item
-                        last_item_avoids = current_avoids
-                    else:
-                        sequence.append(current_item)
-                        self.item_added.emit(current_item)
-                        index += 1
-                        time.sleep(signal_delay)
-                    continue
-
                 else:
-                    last_item = current_item
-                    last_item_avoids = current_avoids
+                    index = 1000000
+                continue
 
-            # Reset current item so it's not the same as the last item
-            # Also Respect the items probability too.
-            while current_item := random.choices(target_keys, weights=weights, k=1)[0]:
-                if current_item != last_item:
-                    break
+            if run:
+                yield current_item, run
+                place(current_index, run)
+                run = 0
+
+            # Pick the next item, not the same as the last item and not one
+            # the Avoid rules block. Also Respect the items probability too.
+            steer(length)
+            blocked = avoids.blocked()
+            blocked.add(current_index)
+            blocked.add(avoids.last)
+            next_index = sampler.sample_without(blocked, rng)
+
+            if next_index < 0:
+                # Nothing may follow yet, e.g. a distance rule that clears
+                # after a few more blocks, so the last run carries on.
+                # Nothing at all is left once every quota is used up.
+                current_index = avoids.last
+                if remaining.get(current_index, 1) <= 0:
+                    return
+                current_item = target_keys[current_index]
+                quota_left = remaining.get(current_index)
+                length += 1
+                run = 1
+                continue
+
+            current_index = next_index
+            current_item = target_keys[current_index]
+            quota_left = remaining.get(current_index)
 
             min_item_entropy = self._items[current_item].min_entropy
             max_item_entropy = self._items[current_item].max_entropy
-            current_avoids = self._items[current_item].avoids
+            end_chance = 1 / max(1, max_item_entropy - min_item_entropy + 1)
             index = 1
 
+        if run:
+            yield current_item, run
+
+    def run(self):
+
+        # A stop before the thread got here still counts, the GUI may be
+        # waiting on it and won't take items
+        self._running = True
+
+        with span("generate", "sequence", length=self.length):
+            for item in self.generate():
+                while not self._queued.acquire(timeout=0.05):
+                    if self._stop_flag:
+                        break
+                else:
+                    self.item_added.emit(item)
+
         if self._stop_flag:
             self.stopped.emit()
 
         self._running = False
 
         self.finished.emit()
-        print("Finished")
@@ -0,0 +1,158 @@
+"""
+Session file holding the compiled rule set, the generated buffer, its seed
+and the cursor, so a launch can resume mid build without regenerating.
+"""
+
+import base64
+import json
+import os
+import sys
+from array import array
+from dataclasses import asdict, dataclass, field
+
+from .sequences import ItemSequence
+from .storage import atomic_write, data_dir
+
+SESSION_VERSION = 1
+
+
+def rules_to_dicts(rules: list[ItemSequence]) -> list[dict]:
+    return [asdict(rule) for rule in rules]
+
+
+def rules_from_dicts(rules: list[dict]) -> list[ItemSequence]:
+    return [ItemSequence(**rule) for rule in rules]
+
+
+def pack_ids(ids: list[int]) -> bytes:
+    """
+    Pack item ids as little endian uint16.
+    :param ids:
+    :return:
+    """
+    packed = array("H", ids)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_ids(data: bytes) -> list[int]:
+    packed = array("H")
+    packed.frombytes(data)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tolist()
+
+
+def encode_ids(ids: list[int]) -> str:
+    return base64.b64encode(pack_ids(ids)).decode("ascii")
+
+
+def decode_ids(data: str) -> list[int]:
+    return unpack_ids(base64.b64decode(data))
+
+
+def item_table(buffer: list[str]) -> tuple[list[str], list[int]]:
+    """
+    Split a buffer of item names into a table of unique names and ids into it.
+    :param buffer:
+    :return: items, ids
+    """
+    items = list(dict.fromkeys(buffer))
+    index = {name: i for i, name in enumerate(items)}
+    return items, [index[name] for name in buffer]
+
+
+@dataclass
+class Session:
+    rules: list[dict]
+    length: int
+    seed: int | None
+    items: list[str] = field(default_factory=list)
+    buffer: list[int] = field(default_factory=list)
+    cursor: int = 0
+
+    @classmethod
+    def from_buffer(
+        cls,
+        rules: list[ItemSequence],
+        length: int,
+        seed: int | None,
+        buffer: list[str],
+        cursor: int,
+    ) -> "Session":
+        """
+        Build a session storing the buffer as ids into an item table.
+        :param rules:
+        :param length:
+        :param seed:
+        :param buffer: Item names
+        :param cursor:
+        :return:
+        """
+        items, ids = item_table(buffer)
+        return cls(rules_to_dicts(rules), length, seed, items, ids, cursor)
+
+    def buffer_names(self) -> list[str]:
+        return [self.items[index] for index in self.buffer]
+
+    def matches(self, rules: list[ItemSequence], length: int) -> bool:
+        """
+        Whether the session was generated for this rule set and height.
+        :param rules:
+        :param length:
+        :return:
+        """
+        return self.length == length and rules_from_dicts(self.rules) == rules
+
+    def to_json(self) -> bytes:
+        data = {
+            "version": SESSION_VERSION,
+            "rules": self.rules,
+            "length": self.length,
+            "seed": self.seed,
+            "items": self.items,
+            "buffer": encode_ids(self.buffer),
+            "cursor": self.cursor,
+        }
+        return json.dumps(data).encode("utf-8")
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "Session":
+        data = json.loads(data)
+        if data.get("version") != SESSION_VERSION:
+            raise ValueError("Unsupported session version %s" % data.get("version"))
+        # Rules the sequence engine can't take raise TypeError here, where
+        # load_session falls back, rather than when the session is matched
+        rules_from_dicts(data["rules"])
+        return cls(
+            data["rules"],
+            data["length"],
+            data["seed"],
+            data["items"],
+            decode_ids(data["buffer"]),
+            data["cursor"],
+        )
+
+
+def session_path() -> str:
+    return os.path.join(data_dir(), "session.json")
+
+
+def save_session(session: Session, path: str | None = None) -> None:
+    atomic_write(path or session_path(), session.to_json())
+
+
+def load_session(path: str | None = None) -> Session | None:
+    """
+    Load the last session, None if there isn't one or it can't be read.
+    :param path:
+    :return:
+    """
+    try:
+        with open(path or session_path(), "rb") as f:
+            return Session.from_json(f.read())
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print("Could not load session: %s" % e)
+        return None
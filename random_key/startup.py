@@ -0,0 +1,57 @@
+"""
+Startup timing. Phases are marked as they finish, the report shows the time
+spent in each and the time since the process started loading the app.
+"""
+
+import time
+
+_origin = time.perf_counter()
+
+
+class StartupTrace:
+    def __init__(self, origin: float | None = None):
+        self.origin = _origin if origin is None else origin
+        self.phases: list[tuple[str, float]] = []
+        self._last = self.origin
+
+    def mark(self, phase: str) -> float:
+        """
+        End a phase.
+        :param phase:
+        :return: Seconds spent in the phase
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self.phases.append((phase, elapsed))
+        self._last = now
+        return elapsed
+
+    def total(self) -> float:
+        return self._last - self.origin
+
+    def elapsed(self, phase: str) -> float | None:
+        """
+        Seconds from the start to the end of a phase.
+        :param phase:
+        :return:
+        """
+        total = 0.0
+        for name, elapsed in self.phases:
+            total += elapsed
+            if name == phase:
+                return total
+        return None
+
+    def report(self) -> str:
+        lines = []
+        total = 0.0
+        for name, elapsed in self.phases:
+            total += elapsed
+            lines.append(
+                "%-24s %8.1f ms %8.1f ms" % (name, elapsed * 1000, total * 1000)
+            )
+        return "\n".join(lines)
+
+
+trace = StartupTrace()
+"""Trace of the running app"""
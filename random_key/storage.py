@@ -0,0 +1,81 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+from .constants import APP_NAME, GROUP_NAME
+
+
+def resource_path(*parts: str) -> str:
+    """
+    Path to a file or folder shipped in the resources directory.
+    :param parts:
+    :return:
+    """
+    return os.path.normpath(
+        os.path.join(os.path.dirname(__file__), os.pardir, "resources", *parts)
+    )
+
+
+def cache_dir() -> str:
+    """
+    Per user folder for files that can be rebuilt, e.g. the palette manifest.
+    Created on first use.
+    :return:
+    """
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    path = os.path.join(base, GROUP_NAME, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def data_dir() -> str:
+    """
+    Per user folder for the apps own data, e.g. the last session.
+    Created on first use.
+    :return:
+    """
+    base = os.environ.get("APPDATA") or os.path.join(
+        os.path.expanduser("~"), ".local", "share"
+    )
+    path = os.path.join(base, GROUP_NAME, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def atomic_open(path: str):
+    """
+    Binary file to stream into, written to a temp file next to path and
+    swapped into place when the block exits without error, so a crash mid
+    write never leaves a truncated file behind.
+    :param path:
+    :return:
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """
+    Write data to path, see atomic_open.
+    :param path:
+    :param data:
+    :return:
+    """
+    with atomic_open(path) as f:
+        f.write(data)
@@ -0,0 +1,231 @@
+"""
+Spans for finding where time goes, saved as Chrome trace JSON that opens in
+Perfetto (ui.perfetto.dev) or chrome://tracing.
+
+Code paths mark themselves with `with span("name"):` or `@traced("name")`.
+While nothing is recording span() returns a shared no-op context, the cost
+is a global lookup and an attribute check. A recording collects the spans
+of every thread and optionally a cProfile of the thread that started it and
+tracemalloc memory, the memory is a counter track plus the top allocations
+between the start and end of the recording.
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from .storage import atomic_write
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(
+            self.name, self.category, self.start, time.perf_counter_ns(), self.args
+        )
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events: list[dict] = []
+        self._origin = 0
+        self._profile: cProfile.Profile | None = None
+        self._memory = False
+        self._stop_tracemalloc = False
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._threads: dict[int, str] = {}
+        self.last_profile: cProfile.Profile | None = None
+        """Profile of the last recording, for pstats or snakeviz"""
+
+    def add(self, name: str, category: str, start: int, end: int, args=None) -> None:
+        """
+        Record a finished span.
+        :param name:
+        :param category:
+        :param start: perf_counter_ns
+        :param end: perf_counter_ns
+        :param args: Shown with the span
+        :return:
+        """
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        self._threads.setdefault(thread.ident, thread.name)
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = {k: str(v) for k, v in args.items()}
+        # list.append is atomic, spans from any thread go in the one list
+        self.events.append(event)
+        if self._memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.events.append(
+                {
+                    "name": "memory",
+                    "ph": "C",
+                    "ts": event["ts"] + event["dur"],
+                    "pid": event["pid"],
+                    "args": {"current": current, "peak": peak},
+                }
+            )
+
+    def start(self, profile: bool = False, memory: bool = False) -> None:
+        """
+        Start recording.
+        :param profile: Also cProfile the calling thread
+        :param memory: Also track allocations with tracemalloc
+        :return:
+        """
+        self.events = []
+        self._threads = {}
+        self._origin = time.perf_counter_ns()
+        self._memory = memory
+        if memory:
+            self._stop_tracemalloc = not tracemalloc.is_tracing()
+            if self._stop_tracemalloc:
+                tracemalloc.start()
+            self._snapshot = tracemalloc.take_snapshot()
+        if profile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self.enabled = True
+
+    def stop(self) -> dict:
+        """
+        Stop recording.
+        :return: Chrome trace
+        """
+        self.enabled = False
+        other = {"duration_ms": (time.perf_counter_ns() - self._origin) / 1e6}
+
+        self.last_profile = self._profile
+        if self._profile is not None:
+            self._profile.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=stream)
+            stats.sort_stats("cumulative").print_stats(40)
+            other["profile"] = stream.getvalue()
+            self._profile = None
+
+        if self._memory:
+            snapshot = tracemalloc.take_snapshot()
+            top = snapshot.compare_to(self._snapshot, "lineno")[:30]
+            other["memory_top"] = [str(stat) for stat in top]
+            if self._stop_tracemalloc:
+                tracemalloc.stop()
+            self._snapshot = None
+            self._memory = False
+
+        pid = os.getpid()
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in self._threads.items()
+        ]
+        trace = {
+            "traceEvents": metadata + self.events,
+            "displayTimeUnit": "ms",
+            "otherData": other,
+        }
+        self.events = []
+        return trace
+
+
+def save_trace(trace: dict, path: str, profile: cProfile.Profile | None = None) -> None:
+    """
+    Write a trace, and its profile next to it with a .prof extension.
+    :param trace: From Tracer.stop
+    :param path:
+    :param profile:
+    :return:
+    """
+    atomic_write(path, json.dumps(trace).encode("utf-8"))
+    if profile is not None:
+        profile.dump_stats(os.path.splitext(path)[0] + ".prof")
+
+
+tracer = Tracer()
+"""Tracer of the running app"""
+
+
+def span(name: str, category: str = "app", **args):
+    """
+    Context manager timing a block while a recording is running.
+    :param name:
+    :param category:
+    :param args: Shown with the span
+    :return:
+    """
+    if not tracer.enabled:
+        return _NULL_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def traced(name: str | None = None, category: str = "app"):
+    """
+    Decorator timing every call of a function while a recording is running.
+    :param name: Span name, the functions qualified name by default
+    :param category:
+    :return:
+    """
+
+    def decorate(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.add(label, category, start, time.perf_counter_ns())
+
+        return wrapper
+
+    return decorate
@@ -10,11 +10,17 @@ from PySide6.QtWidgets import (
     QFrame,
     QScrollArea,
     QGridLayout,
+    QTabBar,
+    QCheckBox,
 )
 
 from PySide6.QtCore import Qt, QPoint
 from PySide6.QtCore import QSettings
 
+from .tally_widget import MaterialTallyWidget
+from .widgets import SearchableStrictComboBox
+from ..constants import HOTBAR_SIZE, MAX_ITEMS
+
 settings = QSettings("MCTools", "RandomKeys")
 
 
@@ -25,6 +31,11 @@ class AppDialog(QWidget):
         # Main vertical layout
         self.outer_layout = QVBoxLayout()
 
+        # Hotbar pages of items, hidden with a single page
+        self.page_tabs = QTabBar()
+        self.page_tabs.setVisible(False)
+        self.outer_layout.addWidget(self.page_tabs)
+
         # Horizontal layout for sliders and labels
         self.sliders_layout = QGridLayout()
 
@@ -40,7 +51,27 @@ class AppDialog(QWidget):
         self.max_height_spinbox.setRange(0, 2048)
         self.max_height_spinbox.setValue(32)
 
-        self.required_layout = QHBoxLayout()
+        self.item_count_spinbox = QSpinBox()
+        self.item_count_spinbox.setRange(1, MAX_ITEMS)
+        self.item_count_spinbox.setValue(HOTBAR_SIZE)
+
+        # Colour gradient from one block's colour to another's over the
+        # height, enabled once the palette's colours are known
+        self.gradient_checkbox = QCheckBox()
+        self.gradient_checkbox.setEnabled(False)
+        self.gradient_checkbox.setToolTip("Measuring the palette's colours...")
+        self.gradient_from = SearchableStrictComboBox()
+        self.gradient_to = SearchableStrictComboBox()
+        self.gradient_layout = QHBoxLayout()
+        self.gradient_layout.addWidget(self.gradient_checkbox)
+        self.gradient_layout.addWidget(self.gradient_from, 1)
+        self.gradient_layout.addWidget(QLabel("to"))
+        self.gradient_layout.addWidget(self.gradient_to, 1)
+
+        self.required_widget = MaterialTallyWidget()
+        self.metrics_label = QLabel()
+        self.diagnostics_label = QLabel()
+        self.diagnostics_label.setWordWrap(True)
 
         self._drag_active = False
         self._drag_start_pos = QPoint()
@@ -54,9 +85,14 @@ class AppDialog(QWidget):
         self.stop_start_button.setCheckable(True)
 
         self.form_layout.addRow("Max Height:", self.max_height_spinbox)
+        self.form_layout.addRow("Items:", self.item_count_spinbox)
+        self.form_layout.addRow("Gradient:", self.gradient_layout)
         self.form_layout.addRow("Current Key:", self.current_key)
         self.form_layout.addRow("Next Key:", self.next_key)
-        self.form_layout.addRow("Required:", self.required_layout)
+        self.form_layout.addRow("Required:", self.required_widget)
+        self.form_layout.addRow("Quality:", self.metrics_label)
+        self.form_layout.addRow("Rules:", self.diagnostics_label)
+        self.form_layout.setRowVisible(self.diagnostics_label, False)
         self.form_layout.addRow("Progress:", self.progress)
         self.form_layout.addRow("", self.buffer_button)
         self.form_layout.addRow("", self.stop_start_button)
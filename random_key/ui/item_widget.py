@@ -5,23 +5,29 @@ from PySide6.QtWidgets import (
     QCheckBox,
     QLineEdit,
     QFrame,
+    QLabel,
+    QComboBox,
+    QHBoxLayout,
+    QMenu,
+    QToolButton,
 )
 
 from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QColor, QPainter, QPen
 
 from .widgets import SearchableStrictComboBox
 
 
 class ItemParameterWidget(QFrame):
+    """
+    Parameters of one item. The rounded frame is painted directly rather than
+    with a style sheet, style sheets on every item widget made polishing
+    them the slowest part of startup.
+    """
 
-    default_style = """
-        #formFrame {
-            border: 2px solid #6894b0;
-            border-radius: 8px;
-            padding: 1px;
-            background-color: #474747;
-        }
-        """
+    border_color = QColor("#6894b0")
+    active_border_color = QColor("#e8e6e6")
+    background_color = QColor("#474747")
 
     values_changed = Signal(object)
     """When any of the widgets values change emits the object and its value"""
@@ -29,9 +35,11 @@ class ItemParameterWidget(QFrame):
     def __init__(self, key, parent=None):
         super().__init__(parent)
 
-        self.setFrameShape(QFrame.StyledPanel)
+        self.setFrameShape(QFrame.NoFrame)
         self.setObjectName("formFrame")
+        self.setContentsMargins(3, 3, 3, 3)
         self._key = str(key)
+        self._border_color = self.border_color
 
         self._is_disabled = False
         self._is_active = True
@@ -39,6 +47,20 @@ class ItemParameterWidget(QFrame):
         item_form_layout = QFormLayout()
 
         self.selector = SearchableStrictComboBox()
+
+        # Blocks that look like the selected one, from the colour index
+        self._similar = None
+        self.similar_menu = QMenu(self)
+        self.similar_menu.aboutToShow.connect(self._populate_similar_menu)
+        self.similar_button = QToolButton()
+        self.similar_button.setText("\u2248")
+        self.similar_button.setToolTip("Similar blocks")
+        self.similar_button.setPopupMode(QToolButton.InstantPopup)
+        self.similar_button.setMenu(self.similar_menu)
+        selector_layout = QHBoxLayout()
+        selector_layout.setContentsMargins(0, 0, 0, 0)
+        selector_layout.addWidget(self.selector, 1)
+        selector_layout.addWidget(self.similar_button)
         self.slider = QSlider(Qt.Horizontal)
         self.slider.setRange(1, 100)
         self.slider.setValue(50)
@@ -56,18 +78,35 @@ class ItemParameterWidget(QFrame):
         self.max_amount.setMinimumWidth(70)
 
         self.no_next = QLineEdit()
+        self.no_next.setToolTip(
+            "Comma separated, Name: never next to Name, Name@3: never within "
+            "3 blocks of Name, A>B>A: never a run of A, then B, then A"
+        )
+
+        self.quota = QSpinBox()
+        self.quota.setRange(0, 99999)
+        self.quota.setSpecialValueText("None")
+        self.quota.setToolTip(
+            "Most of the item the sequence may use, e.g. what you have"
+        )
+        self.quota_unit = QComboBox()
+        self.quota_unit.addItems(["Blocks", "Stacks"])
+        quota_layout = QHBoxLayout()
+        quota_layout.setContentsMargins(0, 0, 0, 0)
+        quota_layout.addWidget(self.quota, 1)
+        quota_layout.addWidget(self.quota_unit)
+
+        self.key_label = QLabel("Key %s" % self._key)
 
-        item_form_layout.addRow("Key %s" % self._key, self.selector)
+        item_form_layout.addRow(self.key_label, selector_layout)
         item_form_layout.addRow("Prob", self.slider)
         item_form_layout.addRow("Min", self.min_amount)
         item_form_layout.addRow("Max", self.max_amount)
         item_form_layout.addRow("Avoid:", self.no_next)
+        item_form_layout.addRow("Limit", quota_layout)
         item_form_layout.addRow("", self.checkbox)
 
         self.setLayout(item_form_layout)
-        self.setFrameShape(QFrame.StyledPanel)
-
-        self.setStyleSheet(self.default_style)
 
         self.checkbox.stateChanged.connect(
             lambda state, s=self.slider: s.setEnabled(state == 2)
@@ -75,11 +114,76 @@ class ItemParameterWidget(QFrame):
 
         self._setup_signals()
 
-    def add_palette_items(self, palette: dict[str, str]) -> None:
+    def set_palette_model(self, model) -> None:
+
+        self.selector.set_palette_model(model)
+
+    def set_similar_provider(self, provider) -> None:
+        """
+        :param provider: Callable of an item name returning similar item
+            names, an empty list while there are none to offer
+        :return:
+        """
+        self._similar = provider
+
+    def _populate_similar_menu(self) -> None:
+        self.similar_menu.clear()
+        names = self._similar(self.item_name) if self._similar else []
+        if not names:
+            self.similar_menu.addAction("No suggestions yet").setEnabled(False)
+            return
+        for name in names:
+            row = self.selector.findText(name, Qt.MatchFixedString)
+            action = self.similar_menu.addAction(self.selector.itemIcon(row), name)
+            action.triggered.connect(
+                lambda checked=False, n=name: self.set_values({"item": n})
+            )
+
+    def set_label(self, text: str) -> None:
 
-        for display_name, path in palette.items():
-            self.selector.add_item(display_name, path)
-            # combo->setItemIcon(0, *icon);
+        self.key_label.setText(text)
+
+    def values(self) -> dict:
+        """
+        The widgets values, see set_values.
+        :return:
+        """
+        return {
+            "item": self.item_name,
+            "slider": self.slider.value(),
+            "enabled": self.checkbox.isChecked(),
+            "min": self.min_amount.value(),
+            "max": self.max_amount.value(),
+            "avoids": self.no_next.text(),
+            "quota": self.quota.value(),
+            "quota_stacks": self.quota_unit.currentIndex() == 1,
+        }
+
+    def set_values(self, values: dict) -> None:
+        """
+        Set the widgets from a values dict, keys missing are left as is.
+        :param values:
+        :return:
+        """
+        if "item" in values:
+            index = self.selector.findText(values["item"], Qt.MatchFixedString)
+            if index >= 0:
+                self.selector.setCurrentIndex(index)
+        if "slider" in values:
+            self.slider.setValue(values["slider"])
+        if "enabled" in values:
+            self.checkbox.setChecked(values["enabled"])
+            self.slider.setEnabled(values["enabled"])
+        if "min" in values:
+            self.min_amount.setValue(values["min"])
+        if "max" in values:
+            self.max_amount.setValue(values["max"])
+        if "avoids" in values:
+            self.no_next.setText(values["avoids"])
+        if "quota" in values:
+            self.quota.setValue(values["quota"])
+        if "quota_stacks" in values:
+            self.quota_unit.setCurrentIndex(1 if values["quota_stacks"] else 0)
 
     def _setup_signals(self):
 
@@ -88,6 +192,9 @@ class ItemParameterWidget(QFrame):
         self.slider.valueChanged.connect(self.dummy)
         self.selector.currentTextChanged.connect(self.dummy)
         self.checkbox.clicked.connect(self.dummy)
+        self.no_next.editingFinished.connect(self.dummy)
+        self.quota.valueChanged.connect(self.dummy)
+        self.quota_unit.currentIndexChanged.connect(self.dummy)
 
     @property
     def item_name(self):
@@ -100,28 +207,15 @@ class ItemParameterWidget(QFrame):
 
     def display_active(self, value):
 
-        if value:
-            self.setStyleSheet(
-                """
-        #formFrame {
-            border: 2px solid #e8e6e6;
-            border-radius: 8px;
-            padding: 1px;
-            background-color: #474747;
-        }
-        """
-            )
-        else:
-            self.setStyleSheet(
-                """
-        #formFrame {
-            border: 2px solid #6894b0;
-            border-radius: 8px;
-            padding: 1px;
-            background-color: #474747;
-        }
-        """
-            )
+        self._border_color = self.active_border_color if value else self.border_color
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(self._border_color, 2))
+        painter.setBrush(self.background_color)
+        painter.drawRoundedRect(self.rect().adjusted(1, 1, -1, -1), 8, 8)
 
     @property
     def is_active(self):
@@ -0,0 +1,88 @@
+from PySide6.QtWidgets import (
+    QCheckBox,
+    QFileDialog,
+    QHBoxLayout,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+from PySide6.QtCore import Qt, QTimer
+
+
+class LatencyPanel(QWidget):
+    """
+    Debug panel showing the click to keypress latency percentiles of a
+    latency.LatencyRecorder.
+    """
+
+    columns = ["Count", "p50 µs", "p95 µs", "p99 µs", "Max µs"]
+
+    def __init__(self, recorder, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Latency")
+        self.setWindowFlag(Qt.Window)
+        self.recorder = recorder
+
+        self.record_checkbox = QCheckBox("Record")
+        self.record_checkbox.setChecked(recorder.enabled)
+        self.reset_button = QPushButton("Reset")
+        self.export_button = QPushButton("Export CSV...")
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.record_checkbox)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.reset_button)
+        buttons_layout.addWidget(self.export_button)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(buttons_layout)
+        layout.addWidget(self.table)
+
+        self.record_checkbox.toggled.connect(self.on_record_toggled)
+        self.reset_button.clicked.connect(self.on_reset)
+        self.export_button.clicked.connect(self.on_export)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+        self.refresh()
+        self.resize(520, 200)
+
+    def on_record_toggled(self, state: bool) -> None:
+        self.recorder.enabled = state
+
+    def on_reset(self) -> None:
+        self.recorder.reset()
+        self.refresh()
+
+    def on_export(self) -> None:
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export latency", "latency.csv", "CSV (*.csv)"
+        )
+        if path:
+            self.recorder.export_csv(path)
+
+    def refresh(self) -> None:
+        rows = self.recorder.summary()
+        self.table.setRowCount(len(rows))
+        for row, (stage, *values) in enumerate(rows):
+            self.table.setVerticalHeaderItem(row, QTableWidgetItem(stage))
+            for column, value in enumerate(values):
+                text = str(value) if column == 0 else "%.1f" % value
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.timer.start(500)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
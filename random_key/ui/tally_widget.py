@@ -0,0 +1,248 @@
+from PySide6.QtWidgets import QWidget, QSizePolicy
+from PySide6.QtGui import (
+    QColor,
+    QFont,
+    QFontMetrics,
+    QPainter,
+    QPainterPath,
+    QPen,
+    QPixmap,
+)
+from PySide6.QtCore import Qt, QPointF, QRect, QSize
+
+from ..constants import STACK_SIZE
+from ..tracing import traced
+
+
+def format_stacks(count: int) -> tuple[str, str]:
+    """
+    Split a block count into stacks and the remainder for display.
+    :param count:
+    :return:
+    """
+    whole, remainder = divmod(count, STACK_SIZE)
+    stack = f"{whole} Stack" if whole == 1 else f"{whole} Stacks"
+    return stack, f"& {remainder}"
+
+
+class MaterialTallyWidget(QWidget):
+    """
+    Live running tally of the blocks required by the buffer. One cell per
+    item showing the stacks still to place, its share of the buffer and a
+    bar of how much has been placed.
+
+    Counts are updated incrementally as items stream in and the cursor
+    moves. Text is rendered once per distinct string with its outline and
+    shadow into a cached layer, so repaints only blit pixmaps.
+    """
+
+    def __init__(self, parent=None, cell_size: int = 64, spacing: int = 4):
+        super().__init__(parent)
+
+        self.cell_size = cell_size
+        self.spacing = spacing
+        self.text_font = QFont("Arial", 12, QFont.Bold)
+        self.line_height = 16
+        self.text_color = QColor("white")
+        self.outline_color = QColor("black")
+        self.shadow_color = QColor("gray")
+        self.bar_color = QColor(104, 148, 176)
+
+        self._palette = None
+        self._order: list[str] = []
+        self._cells: dict[str, int] = {}
+        self._totals: dict[str, int] = {}
+        self._placed: dict[str, int] = {}
+        self._total = 0
+        self._cursor = 0
+        self._text_layers: dict[str, QPixmap] = {}
+
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
+    def set_palette(self, palette) -> None:
+        self._palette = palette
+        self.update()
+
+    # Counts
+    def reset(self, order: list[str] | None = None) -> None:
+        """
+        Clear the tally, cells will be shown in the given order.
+        :param order: Item names in display order.
+        :return:
+        """
+        self._order = []
+        self._cells = {}
+        self._totals = {}
+        self._placed = {}
+        self._total = 0
+        self._cursor = 0
+        for name in order or []:
+            if name not in self._totals:
+                self._totals[name] = 0
+                self._placed[name] = 0
+        self.updateGeometry()
+        self.update()
+
+    @traced("tally add_item", "tally")
+    def add_item(self, name: str) -> None:
+        """
+        Count an item appended to the buffer.
+        :param name:
+        :return:
+        """
+        self._total += 1
+        self._totals[name] = self._totals.get(name, 0) + 1
+        self._placed.setdefault(name, 0)
+
+        if name not in self._cells:
+            self._rebuild_cells()
+        self.update()
+
+    def set_counts(self, counts: dict[str, int]) -> None:
+        """
+        Replace the totals in one go, e.g. when a finished buffer is loaded.
+        :param counts:
+        :return:
+        """
+        for name, count in counts.items():
+            self._totals[name] = count
+            self._placed.setdefault(name, 0)
+        self._total = sum(self._totals.values())
+        self._rebuild_cells()
+        self.update()
+
+    def set_cursor(self, index: int, buffer: list[str]) -> None:
+        """
+        Move the placed counts to a cursor position, only the items between
+        the old and new position are visited.
+        :param index: Items before this index have been placed.
+        :param buffer:
+        :return:
+        """
+        index = max(0, min(index, len(buffer)))
+        if index == self._cursor:
+            return
+
+        if index > self._cursor:
+            for name in buffer[self._cursor : index]:
+                self._placed[name] = self._placed.get(name, 0) + 1
+        else:
+            for name in buffer[index : self._cursor]:
+                self._placed[name] -= 1
+        self._cursor = index
+        self.update()
+
+    def counts(self) -> dict[str, int]:
+        return {name: count for name, count in self._totals.items() if count}
+
+    def placed(self, name: str) -> int:
+        return self._placed.get(name, 0)
+
+    def remaining(self, name: str) -> int:
+        return self._totals.get(name, 0) - self._placed.get(name, 0)
+
+    def _rebuild_cells(self) -> None:
+        self._order = [name for name, count in self._totals.items() if count]
+        self._cells = {name: x for x, name in enumerate(self._order)}
+        self.updateGeometry()
+
+    # Painting
+    def cell_rect(self, name: str) -> QRect:
+        x = self._cells[name] * (self.cell_size + self.spacing)
+        return QRect(x, 0, self.cell_size, self.cell_size)
+
+    def sizeHint(self) -> QSize:
+        width = len(self._order) * (self.cell_size + self.spacing)
+        return QSize(max(width, self.cell_size), self.cell_size)
+
+    def minimumSizeHint(self) -> QSize:
+        return QSize(self.cell_size, self.cell_size)
+
+    def _text_layer(self, text: str) -> QPixmap:
+        """
+        Outlined text rendered once and cached.
+        :param text:
+        :return:
+        """
+        layer = self._text_layers.get(text)
+        if layer is not None:
+            return layer
+
+        metrics = QFontMetrics(self.text_font)
+        pad = 3
+        ratio = self.devicePixelRatioF()
+        width = metrics.horizontalAdvance(text) + pad * 2
+        height = metrics.height() + pad * 2
+
+        layer = QPixmap(int(width * ratio), int(height * ratio))
+        layer.setDevicePixelRatio(ratio)
+        layer.fill(Qt.transparent)
+
+        baseline = QPointF(pad, pad + metrics.ascent())
+        path = QPainterPath()
+        path.addText(baseline, self.text_font, text)
+
+        painter = QPainter(layer)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setFont(self.text_font)
+
+        # Shadow, outline then fill
+        painter.setPen(self.shadow_color)
+        painter.drawText(baseline + QPointF(2, 2), text)
+        painter.strokePath(path, QPen(self.outline_color, 2))
+        painter.setPen(self.text_color)
+        painter.drawText(baseline, text)
+        painter.end()
+
+        self._text_layers[text] = layer
+        return layer
+
+    @traced("tally paint", "tally")
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        exposed = event.rect()
+        metrics = QFontMetrics(self.text_font)
+        pad = 3
+
+        for name in self._order:
+            rect = self.cell_rect(name)
+            if not rect.intersects(exposed):
+                continue
+
+            if self._palette is not None:
+                painter.drawPixmap(
+                    rect.topLeft(), self._palette.pixmap(name, self.cell_size)
+                )
+
+            total = self._totals[name]
+            remaining = total - self._placed.get(name, 0)
+            percent = int((total / self._total) * 100) if self._total else 0
+
+            lines = [*format_stacks(remaining), f"{percent}%"]
+            for line, text in enumerate(lines):
+                y = rect.top() + self.line_height * (line + 1) - metrics.ascent() - pad
+                painter.drawPixmap(rect.left() - pad, y, self._text_layer(text))
+
+            if total:
+                bar_width = int(rect.width() * (total - remaining) / total)
+                painter.fillRect(
+                    rect.left(), rect.bottom() - 3, bar_width, 4, self.bar_color
+                )
+
+        painter.end()
+
+    def event(self, event):
+        if event.type() == event.Type.ToolTip:
+            for name in self._order:
+                if self.cell_rect(name).contains(event.pos()):
+                    total = self._totals[name]
+                    stack, remainder = format_stacks(total)
+                    self.setToolTip(
+                        f"{name}: {total} ({stack} {remainder})\n"
+                        f"Placed: {self.placed(name)}\n"
+                        f"Remaining: {self.remaining(name)}"
+                    )
+                    break
+            else:
+                self.setToolTip("")
+        return super().event(event)
@@ -1,32 +1,101 @@
+import bisect
+
 from PySide6.QtWidgets import (
     QComboBox,
     QCompleter,
 )
 
-from PySide6.QtGui import (
-    QStandardItemModel,
-    QIcon,
-    QStandardItem,
+from PySide6.QtCore import (
+    Qt,
+    QAbstractListModel,
+    QModelIndex,
+    QSortFilterProxyModel,
 )
-from PySide6.QtCore import Qt, QSortFilterProxyModel
+
+
+class PaletteModel(QAbstractListModel):
+    """
+    List model over a palette.Palette, shared by every item selector.
+    Icons are only decoded when a view asks for them.
+    """
+
+    def __init__(self, palette, parent=None):
+        super().__init__(parent)
+        self._palette = palette
+        self._names = list(palette)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        name = self._names[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return name
+        if role == Qt.DecorationRole:
+            return self._palette.icon(name)
+        return None
+
+    @property
+    def names(self) -> list[str]:
+        return self._names
+
+    def set_palette(self, palette) -> None:
+        self.beginResetModel()
+        self._palette = palette
+        self._names = list(palette)
+        self.endResetModel()
+
+    def apply(self, change) -> None:
+        """
+        Follow a refresh of the palette row by row, views keep their current
+        items and only changed icons are asked for again.
+        :param change: palette.PaletteChange
+        :return:
+        """
+        for name in change.removed:
+            row = bisect.bisect_left(self._names, name)
+            if row < len(self._names) and self._names[row] == name:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self._names[row]
+                self.endRemoveRows()
+        for name in sorted(change.added):
+            row = bisect.bisect_left(self._names, name)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._names.insert(row, name)
+            self.endInsertRows()
+        for name in change.changed:
+            row = bisect.bisect_left(self._names, name)
+            if row < len(self._names) and self._names[row] == name:
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.DecorationRole])
 
 
 class SearchableStrictComboBox(QComboBox):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, model=None):
         super().__init__(parent)
         self.setEditable(True)
         self.setInsertPolicy(QComboBox.NoInsert)
 
         self.setMinimumWidth(120)
 
+        # Avoid measuring every row (and decoding every icon) to size the box
+        self.setSizeAdjustPolicy(QComboBox.AdjustToMinimumContentsLengthWithIcon)
+        self.setMinimumContentsLength(14)
+
         # Item model
-        self.model_ = QStandardItemModel(self)
-        self.setModel(self.model_)
+        if model is not None:
+            self.setModel(model)
+        self.view().setUniformItemSizes(True)
 
         # Filtering model
         self.proxy_model = QSortFilterProxyModel(self)
         self.proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
-        self.proxy_model.setSourceModel(self.model_)
+        self.proxy_model.setSourceModel(self.model())
 
         # Completer setup
         self.completer = QCompleter(self.proxy_model, self)
@@ -41,28 +110,16 @@ class SearchableStrictComboBox(QComboBox):
         self.lineEdit().editingFinished.connect(self.validate_input)
         self.setMinimumWidth(140)
 
-    def add_item(self, text, icon_path=None):
-        item = QStandardItem(text)
-        self.model_.appendRow(item)
-
-    def set_icon(self, index, icon: QIcon):
-        self.model_.item(index).setIcon(icon)
-        # self.model_.dataChanged.emit(
-        #    self.model_.index(index, index),
-        #    self.model_.index(index, index),
-        #    Qt.DecorationRole,
-        # )
+    def set_palette_model(self, model) -> None:
+        self.setModel(model)
+        self.view().setUniformItemSizes(True)
+        self.proxy_model.setSourceModel(model)
 
     def validate_input(self):
-        text = self.currentText()
-        match_found = False
-
-        for row in range(self.model_.rowCount()):
-            if self.model_.item(row).text().lower() == text.lower():
-                self.setCurrentIndex(row)
-                match_found = True
-                break
+        row = self.findText(self.currentText(), Qt.MatchFixedString)
 
-        if not match_found:
+        if row >= 0:
+            self.setCurrentIndex(row)
+        else:
             self.setCurrentIndex(-1)
             self.lineEdit().clear()
@@ -0,0 +1,202 @@
+"""
+Providers that track the on screen rectangle of the game window.
+
+Providers emit geometry_changed only when the rectangle actually changes and
+closed when the window goes away, so the overlay doesn't have to poll.
+"""
+
+from PySide6.QtCore import QObject, QRect, QTimer, Signal
+
+
+class WindowGeometryProvider(QObject):
+    """
+    Interface for tracking a window's geometry.
+    """
+
+    geometry_changed = Signal(QRect)
+    closed = Signal()
+
+    def __init__(self, handle, parent=None):
+        super().__init__(parent)
+        self.handle = handle
+        self._rect = QRect()
+
+    def geometry(self) -> QRect:
+        """
+        Last known rectangle of the window in screen coordinates.
+        :return:
+        """
+        return QRect(self._rect)
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def _set_rect(self, rect: QRect) -> None:
+        if rect == self._rect:
+            return
+        self._rect = QRect(rect)
+        self.geometry_changed.emit(QRect(rect))
+
+
+class FakeGeometryProvider(WindowGeometryProvider):
+    """
+    Provider driven by hand, for tests and platforms without a game window
+    e.g. under Xvfb or the offscreen platform.
+    """
+
+    def __init__(self, rect: QRect | None = None, handle=0, parent=None):
+        super().__init__(handle, parent)
+        if rect is not None:
+            self._rect = QRect(rect)
+
+    def move(self, rect: QRect) -> None:
+        self._set_rect(rect)
+
+    def close_window(self) -> None:
+        self.closed.emit()
+
+
+class PollingGeometryProvider(WindowGeometryProvider):
+    """
+    Provider for platforms without window events, polls a rect function and
+    only emits when the rectangle changed.
+    """
+
+    def __init__(self, handle, get_rect, is_window, interval=250, parent=None):
+        super().__init__(handle, parent)
+        self._get_rect = get_rect
+        self._is_window = is_window
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self._refresh)
+        self._refresh()
+
+    def _refresh(self) -> None:
+        if not self._is_window(self.handle):
+            self.stop()
+            self.closed.emit()
+            return
+        x, y, r, b = self._get_rect(self.handle)
+        self._set_rect(QRect(x, y, r - x, b - y))
+
+    def start(self) -> None:
+        self._timer.start()
+
+    def stop(self) -> None:
+        self._timer.stop()
+
+
+class Win32GeometryProvider(WindowGeometryProvider):
+    """
+    Follows a window with a WinEvent hook on location changes of that window.
+    The hook is installed out of context, so callbacks are delivered through
+    the Qt event loop's message pump on the GUI thread.
+    Falls back to slow polling if the hook can't be installed.
+    """
+
+    EVENT_OBJECT_DESTROY = 0x8001
+    EVENT_OBJECT_LOCATIONCHANGE = 0x800B
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    OBJID_WINDOW = 0
+    poll_interval = 500
+
+    def __init__(self, handle, parent=None):
+        super().__init__(handle, parent)
+
+        self._hooks = []
+        self._callback = None
+        self._timer = None
+        self._refresh()
+
+    def _refresh(self) -> None:
+        import win32gui
+
+        if not win32gui.IsWindow(self.handle):
+            self.stop()
+            self.closed.emit()
+            return
+        x, y, r, b = win32gui.GetWindowRect(self.handle)
+        self._set_rect(QRect(x, y, r - x, b - y))
+
+    def start(self) -> None:
+        if self._hooks or self._timer:
+            return
+        try:
+            self._install_hooks()
+        except (OSError, AttributeError) as e:
+            print("WinEvent hook unavailable, polling window: %s" % e)
+            self._timer = QTimer(self)
+            self._timer.timeout.connect(self._refresh)
+            self._timer.start(self.poll_interval)
+
+    def _install_hooks(self) -> None:
+        import ctypes
+        from ctypes import wintypes
+
+        import win32process
+
+        user32 = ctypes.windll.user32
+        thread_id, process_id = win32process.GetWindowThreadProcessId(self.handle)
+
+        proc_type = ctypes.WINFUNCTYPE(
+            None,
+            wintypes.HANDLE,
+            wintypes.DWORD,
+            wintypes.HWND,
+            wintypes.LONG,
+            wintypes.LONG,
+            wintypes.DWORD,
+            wintypes.DWORD,
+        )
+
+        def on_event(hook, event, hwnd, id_object, id_child, thread, time):
+            if hwnd != self.handle or id_object != self.OBJID_WINDOW:
+                return
+            if event == self.EVENT_OBJECT_DESTROY:
+                self.stop()
+                self.closed.emit()
+            else:
+                self._refresh()
+
+        # Keep a reference, the hook calls into it for as long as it's set
+        self._callback = proc_type(on_event)
+        user32.SetWinEventHook.restype = wintypes.HANDLE
+        user32.SetWinEventHook.argtypes = [
+            wintypes.DWORD,
+            wintypes.DWORD,
+            wintypes.HMODULE,
+            proc_type,
+            wintypes.DWORD,
+            wintypes.DWORD,
+            wintypes.DWORD,
+        ]
+        user32.UnhookWinEvent.argtypes = [wintypes.HANDLE]
+
+        for event in (self.EVENT_OBJECT_DESTROY, self.EVENT_OBJECT_LOCATIONCHANGE):
+            hook = user32.SetWinEventHook(
+                event,
+                event,
+                0,
+                self._callback,
+                process_id,
+                thread_id,
+                self.WINEVENT_OUTOFCONTEXT,
+            )
+            if not hook:
+                self.stop()
+                raise OSError("SetWinEventHook failed")
+            self._hooks.append(hook)
+
+    def stop(self) -> None:
+        if self._timer:
+            self._timer.stop()
+            self._timer = None
+        if self._hooks:
+            import ctypes
+
+            for hook in self._hooks:
+                ctypes.windll.user32.UnhookWinEvent(hook)
+            self._hooks = []
@@ -1,36 +1,348 @@
-import win32gui
-import win32process
-import psutil
+"""
+Game window discovery.
 
+Backends list the visible top level windows of a platform, the registry
+caches the game's handle and process names so a still valid handle is
+reused without enumerating again, and the watcher rediscovers the window
+off the GUI thread when the game starts late or restarts.
+"""
 
-def get_process_name(pid):
-    try:
-        return psutil.Process(pid).name()
-    except Exception:
+import sys
+import threading
+from dataclasses import dataclass
+
+from PySide6.QtCore import QObject, QRect, Signal
+
+from .window_geometry import (
+    FakeGeometryProvider,
+    PollingGeometryProvider,
+    Win32GeometryProvider,
+    WindowGeometryProvider,
+)
+
+GAME_TITLE = "minecraft"
+
+
+@dataclass(frozen=True)
+class WindowInfo:
+    handle: int
+    title: str
+    process_name: str
+    pid: int
+
+
+class WindowBackend:
+    """
+    Interface to a platform's windows.
+    """
+
+    def find_windows(self, title: str) -> list[tuple[int, str, int]]:
+        """
+        Visible top level windows with title in their title, case insensitive.
+        :param title:
+        :return: [(handle, title, pid)]
+        """
+        raise NotImplementedError
+
+    def is_window(self, handle: int) -> bool:
+        raise NotImplementedError
+
+    def window_rect(self, handle: int) -> tuple[int, int, int, int]:
+        """
+        :param handle:
+        :return: left, top, right, bottom in screen coordinates
+        """
+        raise NotImplementedError
+
+    def process_name(self, pid: int) -> str:
         return "Unknown"
 
+    def geometry_provider(self, handle: int, parent=None) -> WindowGeometryProvider:
+        return PollingGeometryProvider(
+            handle, self.window_rect, self.is_window, parent=parent
+        )
+
+
+class Win32Backend(WindowBackend):
+    def __init__(self):
+        import win32gui
+        import win32process
+
+        self._win32gui = win32gui
+        self._win32process = win32process
+
+    def find_windows(self, title: str) -> list[tuple[int, str, int]]:
+        win32gui = self._win32gui
+        title = title.lower()
 
-def find_minecraft_window():
-    def callback(hwnd, results):
-        if not win32gui.IsWindowVisible(hwnd):
+        def callback(hwnd, results):
+            if not win32gui.IsWindowVisible(hwnd):
+                return True
+            window_title = win32gui.GetWindowText(hwnd)
+            if title in window_title.lower():
+                _, pid = self._win32process.GetWindowThreadProcessId(hwnd)
+                results.append((hwnd, window_title, pid))
             return True
-        title = win32gui.GetWindowText(hwnd)
-        if "minecraft" in title.lower():
-            _, pid = win32process.GetWindowThreadProcessId(hwnd)
-            try:
-                proc = psutil.Process(pid)
-                proc_name = proc.name()
-                # Print for debugging
-                print(f"Found title: {title}, hwnd: {hwnd}, proc: {proc_name}")
-                results.append((hwnd, title, proc_name, pid))
-            except psutil.NoSuchProcess:
-                pass
-        return True
-
-    results = []
-    win32gui.EnumWindows(callback, results)
-    return results
-
-
-def get_window_rect(hwnd):
-    return win32gui.GetWindowRect(hwnd)
+
+        results = []
+        win32gui.EnumWindows(callback, results)
+        return results
+
+    def is_window(self, handle: int) -> bool:
+        return bool(self._win32gui.IsWindow(handle))
+
+    def window_rect(self, handle: int) -> tuple[int, int, int, int]:
+        return self._win32gui.GetWindowRect(handle)
+
+    def process_name(self, pid: int) -> str:
+        import psutil
+
+        try:
+            return psutil.Process(pid).name()
+        except Exception:
+            return "Unknown"
+
+    def geometry_provider(self, handle: int, parent=None) -> WindowGeometryProvider:
+        return Win32GeometryProvider(handle, parent)
+
+
+class X11Backend(WindowBackend):
+    """
+    Windows listed by the window manager through EWMH, needs python-xlib.
+    """
+
+    def __init__(self):
+        from Xlib import X, display
+
+        self._X = X
+        self._display = display.Display()
+        self._root = self._display.screen().root
+        self._lock = threading.Lock()
+        self._atoms = {
+            name: self._display.intern_atom(name)
+            for name in (
+                "_NET_CLIENT_LIST",
+                "_NET_WM_NAME",
+                "_NET_WM_PID",
+                "UTF8_STRING",
+            )
+        }
+
+    def _property(self, window, name):
+        prop = window.get_full_property(self._atoms[name], self._X.AnyPropertyType)
+        return prop.value if prop else None
+
+    def _client_list(self) -> list[int]:
+        return list(self._property(self._root, "_NET_CLIENT_LIST") or [])
+
+    def find_windows(self, title: str) -> list[tuple[int, str, int]]:
+        title = title.lower()
+        results = []
+        with self._lock:
+            for handle in self._client_list():
+                window = self._display.create_resource_object("window", handle)
+                try:
+                    name = self._property(window, "_NET_WM_NAME")
+                    name = name.decode("utf-8", "replace") if name else ""
+                    name = name or window.get_wm_name() or ""
+                    if title not in name.lower():
+                        continue
+                    pid = self._property(window, "_NET_WM_PID")
+                    results.append((handle, name, int(pid[0]) if pid else 0))
+                except Exception:
+                    # Window went away mid enumeration
+                    continue
+        return results
+
+    def is_window(self, handle: int) -> bool:
+        with self._lock:
+            return handle in self._client_list()
+
+    def window_rect(self, handle: int) -> tuple[int, int, int, int]:
+        with self._lock:
+            window = self._display.create_resource_object("window", handle)
+            geometry = window.get_geometry()
+            origin = window.translate_coords(self._root, 0, 0)
+        x, y = -origin.x, -origin.y
+        return x, y, x + geometry.width, y + geometry.height
+
+    def process_name(self, pid: int) -> str:
+        try:
+            with open("/proc/%d/comm" % pid) as f:
+                return f.read().strip()
+        except OSError:
+            return "Unknown"
+
+
+class FakeBackend(WindowBackend):
+    """
+    In memory windows for tests and platforms without a supported backend.
+    """
+
+    def __init__(self):
+        self._windows: dict[int, list] = {}
+        self._providers: dict[int, list[FakeGeometryProvider]] = {}
+        self._lock = threading.Lock()
+
+    def add_window(
+        self,
+        handle: int,
+        title: str,
+        rect: QRect | None = None,
+        pid: int = 0,
+        process_name: str = "Unknown",
+    ) -> None:
+        with self._lock:
+            self._windows[handle] = [title, QRect(rect or QRect()), pid, process_name]
+
+    def move_window(self, handle: int, rect: QRect) -> None:
+        with self._lock:
+            self._windows[handle][1] = QRect(rect)
+            providers = list(self._providers.get(handle, []))
+        for provider in providers:
+            provider.move(rect)
+
+    def remove_window(self, handle: int) -> None:
+        with self._lock:
+            self._windows.pop(handle, None)
+            providers = self._providers.pop(handle, [])
+        for provider in providers:
+            provider.close_window()
+
+    def find_windows(self, title: str) -> list[tuple[int, str, int]]:
+        title = title.lower()
+        with self._lock:
+            return [
+                (handle, window[0], window[2])
+                for handle, window in self._windows.items()
+                if title in window[0].lower()
+            ]
+
+    def is_window(self, handle: int) -> bool:
+        return handle in self._windows
+
+    def window_rect(self, handle: int) -> tuple[int, int, int, int]:
+        rect = self._windows[handle][1]
+        return rect.left(), rect.top(), rect.right() + 1, rect.bottom() + 1
+
+    def process_name(self, pid: int) -> str:
+        with self._lock:
+            for window in self._windows.values():
+                if window[2] == pid:
+                    return window[3]
+        return "Unknown"
+
+    def geometry_provider(self, handle: int, parent=None) -> WindowGeometryProvider:
+        provider = FakeGeometryProvider(self._windows[handle][1], handle, parent)
+        provider.destroyed.connect(lambda: self._forget(handle, provider))
+        with self._lock:
+            self._providers.setdefault(handle, []).append(provider)
+        return provider
+
+    def _forget(self, handle: int, provider: FakeGeometryProvider) -> None:
+        with self._lock:
+            providers = self._providers.get(handle, [])
+            if provider in providers:
+                providers.remove(provider)
+
+
+def default_backend() -> WindowBackend:
+    """
+    Backend for the current platform, an empty FakeBackend when the
+    platform isn't supported.
+    :return:
+    """
+    try:
+        if sys.platform == "win32":
+            return Win32Backend()
+        return X11Backend()
+    except Exception as e:
+        print("No window backend available: %s" % e)
+        return FakeBackend()
+
+
+class WindowRegistry:
+    """
+    Caches the game window's handle and the process name of each pid, so
+    lookups of a still valid window are a single is_window call.
+    """
+
+    def __init__(self, backend: WindowBackend, title: str = GAME_TITLE):
+        self.backend = backend
+        self.title = title
+        self._current: WindowInfo | None = None
+        self._process_names: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> WindowInfo | None:
+        return self._current
+
+    def find(self, refresh: bool = False) -> WindowInfo | None:
+        """
+        The game window, enumerating windows only when the cached one is
+        no longer valid.
+        :param refresh: Enumerate even if the cached window is still valid.
+        :return:
+        """
+        with self._lock:
+            current = self._current
+            if current and not refresh and self.backend.is_window(current.handle):
+                return current
+
+            self._current = None
+            for handle, title, pid in self.backend.find_windows(self.title):
+                name = self._process_names.get(pid)
+                if name is None:
+                    name = self.backend.process_name(pid)
+                    self._process_names[pid] = name
+                self._current = WindowInfo(handle, title, name, pid)
+                # Rediscovering the same window is routine, only log a new one
+                if self._current != current:
+                    print(f"Found title: {title}, hwnd: {handle}, proc: {name}")
+                break
+            return self._current
+
+
+class WindowWatcher(QObject):
+    """
+    Worker that keeps looking for the game window, emits window_found with
+    the WindowInfo when it appears or changes and window_lost when it
+    goes away.
+    """
+
+    window_found = Signal(object)
+    window_lost = Signal()
+    finished = Signal()
+
+    def __init__(self, registry: WindowRegistry, interval: float = 2.0):
+        super().__init__()
+        self.registry = registry
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._current: WindowInfo | None = None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def check(self) -> None:
+        try:
+            info = self.registry.find()
+        except Exception as e:
+            print("Window discovery failed: %s" % e)
+            info = None
+
+        if info == self._current:
+            return
+        self._current = info
+        if info is None:
+            self.window_lost.emit()
+        else:
+            self.window_found.emit(info)
+
+    def run(self) -> None:
+        self._stop_event.clear()
+        while not self._stop_event.is_set():
+            self.check()
+            self._stop_event.wait(self.interval)
+        self.finished.emit()